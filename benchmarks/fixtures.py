@@ -0,0 +1,192 @@
+"""
+Contains generators of synthetic session data for the benchmarks, shaped like the FastF1 objects
+used in the notebooks, so the benchmarks need neither the network nor the FastF1 cache.
+"""
+import numpy as np
+import pandas as pd
+
+from constants import *
+
+DRIVERS = list(TEAMMATE_PAIRS_DICT.keys())
+
+# The session types generated for each event, and the number of laps per driver
+SESSION_LAPS = {'FP2': 30, 'Q': 12, 'R': 70}
+
+
+def make_session_laps(seed: int = 0, session: str = 'R', no_of_laps: int = None,
+                      drivers: list = None) -> object:
+    """
+    Returns the laps of a synthetic session, with the columns of fastf1.core.Laps used by the
+    project (lap times as TimeDelta objects, track status as strings etc.).
+
+    :param seed: an int used to seed the random number generator.
+
+    :param session: a string representing the session, e.g. 'FP2', 'Q' or 'R'.
+
+    :param no_of_laps: an int representing the number of laps of each driver. Defaults to
+    SESSION_LAPS[session].
+
+    :param drivers: a list of strings representing the drivers. Defaults to DRIVERS.
+
+    :return: a DataFrame containing the laps, ordered by driver and lap number.
+    """
+    rng = np.random.default_rng(seed)
+    drivers = DRIVERS if drivers is None else drivers
+    no_of_laps = SESSION_LAPS[session] if no_of_laps is None else no_of_laps
+
+    # Neutralised laps are shared by all drivers.
+    track_status = rng.choice(['1', '1', '1', '1', '1', '12', '2', '4', '6', '67', '5'],
+                              no_of_laps)
+
+    frames = []
+    for i, driver in enumerate(drivers):
+        # Pit every 8 to 30 laps onto a random dry compound.
+        pit_laps = np.cumsum(rng.integers(8, 30, no_of_laps))
+        pit_laps = pit_laps[pit_laps < no_of_laps]
+        lap_numbers = np.arange(1, no_of_laps + 1)
+        stints = np.searchsorted(pit_laps, lap_numbers, side='left') + 1
+        stint_starts = np.concatenate([[1], pit_laps + 1])
+        tyre_life = lap_numbers - stint_starts[stints - 1] + rng.integers(1, 4)
+        compounds = rng.choice(DRY_TYRES, len(stint_starts))[stints - 1]
+
+        lap_times = 80 + i * 0.1 + 0.05 * tyre_life + rng.normal(0, 0.3, no_of_laps) + \
+            5 * (rng.random(no_of_laps) < 0.05)
+        in_laps = np.isin(lap_numbers, pit_laps)
+        out_laps = np.isin(lap_numbers - 1, pit_laps) | (lap_numbers == 1)
+        lap_times += 20 * in_laps + 15 * out_laps
+        lap_start_times = 3600 + i * 0.2 + np.concatenate([[0], np.cumsum(lap_times)[:-1]])
+
+        # As in FastF1, laps without a lap time, in laps and out laps are not accurate.
+        # The last lap always has a lap time, so calculate_race_lap_times can fill the others.
+        missing = rng.random(no_of_laps) < 0.03
+        missing[-1] = False
+        is_accurate = (rng.random(no_of_laps) > 0.1) & ~missing & ~in_laps & ~out_laps
+        lap_times = pd.to_timedelta(lap_times, unit='s').to_numpy().copy()
+        lap_times[missing] = np.timedelta64('NaT')
+        lap_start_times = pd.Series(pd.to_timedelta(lap_start_times, unit='s'))
+
+        frames.append(pd.DataFrame({
+            'Driver': driver, 'Team': 'Team {}'.format(i // 2), 'LapNumber': lap_numbers * 1.0,
+            'LapTime': lap_times, 'LapStartTime': lap_start_times, 'Compound': compounds,
+            'TyreLife': tyre_life * 1.0, 'Stint': stints * 1.0, 'TrackStatus': track_status,
+            'PitInTime': (lap_start_times + pd.Timedelta(seconds=80)).where(in_laps),
+            'PitOutTime': lap_start_times.where(out_laps),
+            'IsAccurate': is_accurate,
+            'SpeedFL': rng.uniform(250, 300, no_of_laps),
+            'SpeedST': rng.uniform(280, 320, no_of_laps)}))
+
+    return pd.concat(frames, ignore_index=True)
+
+
+def make_season_laps(no_of_events: int = 22, sessions: list = None, season: int = 2022,
+                     seed: int = 0) -> object:
+    """
+    Returns the laps of the sessions of a synthetic season in a single DataFrame.
+
+    :param no_of_events: an int representing the number of events.
+
+    :param sessions: a list of strings representing the sessions of each event. Defaults to the
+    keys of SESSION_LAPS.
+
+    :param season: an int representing the season.
+
+    :param seed: an int used to seed the random number generator.
+
+    :return: a DataFrame like make_session_laps, with the extra columns 'season', 'event' and
+    'session'.
+    """
+    sessions = list(SESSION_LAPS) if sessions is None else sessions
+
+    frames = []
+    for event in range(no_of_events):
+        for i, session in enumerate(sessions):
+            laps = make_session_laps(seed * 1000 + event * len(sessions) + i, session)
+            frames.append(laps.assign(season=season, event='Event {}'.format(event + 1),
+                                      session=session))
+
+    return pd.concat(frames, ignore_index=True)
+
+
+def make_qualifying_results(seed: int = 0) -> object:
+    """
+    Returns synthetic qualifying results, like fastf1.core.Session.results of a qualifying session.
+
+    :param seed: an int used to seed the random number generator.
+
+    :return: a DataFrame with the columns 'Abbreviation', 'Q1', 'Q2' and 'Q3' (TimeDelta objects),
+    ordered by qualifying position.
+    """
+    rng = np.random.default_rng(seed)
+    q1 = rng.uniform(77, 79, len(DRIVERS))
+    q2 = q1 - rng.uniform(0, 0.5, len(DRIVERS))
+    q3 = q2 - rng.uniform(0, 0.3, len(DRIVERS))
+
+    results = pd.DataFrame({'Abbreviation': DRIVERS, 'Q1': pd.to_timedelta(q1, unit='s'),
+                            'Q2': pd.to_timedelta(q2, unit='s'),
+                            'Q3': pd.to_timedelta(q3, unit='s')})
+
+    return results.sort_values('Q3').reset_index(drop=True)
+
+
+def make_driver_tyre_data(seed: int = 0) -> object:
+    """
+    Returns synthetic deg factors and long run estimates, like driver_tyre_data in RaceSim.ipynb.
+
+    :param seed: an int used to seed the random number generator.
+
+    :return: a DataFrame with the columns 'Driver', 'SoftDegFactor', 'MediumDegFactor',
+    'HardDegFactor', 'TotalDegFactor' and 'LongRunEstimate'.
+    """
+    rng = np.random.default_rng(seed)
+
+    driver_tyre_data = pd.DataFrame({'Driver': DRIVERS})
+    for compound in DRY_TYRES + ['Total']:
+        driver_tyre_data[compound.title() + 'DegFactor'] = rng.uniform(0.8, 1.2, len(DRIVERS))
+    driver_tyre_data['LongRunEstimate'] = np.sort(rng.uniform(80, 82, len(DRIVERS)))
+
+    return driver_tyre_data
+
+
+def make_lap_telemetry(seed: int = 0, drivers: list = None, laps_per_driver: int = 1,
+                       lap_length: float = 4300) -> list:
+    """
+    Returns the car telemetry of synthetic laps, shaped like fastf1.core.Telemetry after calling
+    add_distance(), e.g. for telemetry.write_telemetry.
+
+    :param seed: an int used to seed the random number generator.
+
+    :param drivers: a list of strings representing the drivers. Defaults to DRIVERS.
+
+    :param laps_per_driver: an int representing the number of laps of each driver.
+
+    :param lap_length: a float representing the length of the lap (in metres).
+
+    :return: a list of tuples (driver, team, lap number, telemetry) ordered by driver and lap
+    number, where the telemetry is a DataFrame with the columns 'Time' (a TimeDelta object),
+    'Distance', 'Speed', 'Throttle', 'Brake' and 'nGear'.
+    """
+    rng = np.random.default_rng(seed)
+    drivers = DRIVERS if drivers is None else drivers
+
+    # The corners of the track slow every car down to a corner speed.
+    corners = np.sort(rng.uniform(0, lap_length, 10))
+    corner_speeds = rng.uniform(80, 200, len(corners))
+
+    laps = []
+    for i, driver in enumerate(drivers):
+        for lap_number in range(1, laps_per_driver + 1):
+            # Samples every 10 to 20 metres, as the car data is sampled about 4 times per second.
+            distance = np.concatenate([[0], np.cumsum(rng.uniform(10, 20, int(lap_length / 10)))])
+            distance = distance[distance < lap_length + 15]
+            gaps = np.abs(distance[:, None] - corners[None, :])
+            speed = np.min(corner_speeds + 0.3 * gaps, axis=1).clip(None, 320) * \
+                (1 - 0.002 * i + rng.normal(0, 0.002))
+            time = np.concatenate([[0], np.cumsum(np.diff(distance) / (speed[1:] / 3.6))])
+
+            laps.append((driver, 'Team {}'.format(i // 2), lap_number, pd.DataFrame({
+                'Time': pd.to_timedelta(time, unit='s'), 'Distance': distance, 'Speed': speed,
+                'Throttle': np.clip((speed - 100) / 2, 0, 100),
+                'Brake': np.diff(speed, append=speed[-1]) < -1,
+                'nGear': np.clip(speed // 40, 1, 8).astype(int)})))
+
+    return laps
@@ -0,0 +1,511 @@
+"""
+Runs the benchmarks of the analysis and simulation hot paths on synthetic data, and compares the
+results with a stored baseline.
+
+Usage, from the root of the project:
+    python benchmarks/run.py run [--scale session|season] [--repeat 5] [--output results.json]
+    python benchmarks/run.py compare baseline.json results.json [--threshold 0.1]
+
+The 'session' scale uses the sessions of one event, the 'season' scale the sessions of 22 events.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import timeit
+import warnings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+import pandas as pd
+
+import fixtures
+from constants import *
+
+SCALES = {'session': 1, 'season': 22}
+
+# Maps the name of each benchmark to its setup function, which takes the fixtures and returns the
+# function to time.
+BENCHMARKS = {}
+
+
+def benchmark(name: str):
+    """
+    Registers a benchmark setup function under a name.
+    """
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+
+    return register
+
+
+def get_fixtures(no_of_events: int) -> dict:
+    """
+    Returns the synthetic data shared by the benchmarks.
+
+    :param no_of_events: an int representing the number of events.
+
+    :return: a dict containing the laps of the season, the FP2 and race laps of each event, the
+    qualifying results of each event and the driver tyre data.
+    """
+    from practice import get_long_run_pace_df
+    from qualifying import get_fastest_lap_in_qualifying
+
+    season_laps = fixtures.make_season_laps(no_of_events)
+    sessions = {key: laps.drop(columns=['season', 'event', 'session']).reset_index(drop=True)
+                for key, laps in season_laps.groupby(['event', 'session'], sort=False)}
+
+    fp2_laps = [laps for (_, session), laps in sessions.items() if session == 'FP2']
+    race_laps = [laps for (_, session), laps in sessions.items() if session == 'R']
+    qualifying_times = [get_fastest_lap_in_qualifying(fixtures.make_qualifying_results(seed))
+                        for seed in range(no_of_events)]
+
+    return {'season_laps': season_laps, 'fp2_laps': fp2_laps, 'race_laps': race_laps,
+            'fp2_race_sims': [get_long_run_pace_df(laps) for laps in fp2_laps],
+            'qualifying_times': qualifying_times,
+            'driver_tyre_data': fixtures.make_driver_tyre_data()}
+
+
+@benchmark('get_stint_lengths')
+def setup_get_stint_lengths(data):
+    from driver_stats import get_stint_lengths
+
+    compounds = [laps.Compound.tolist() for _, laps in
+                 data['season_laps'].groupby(['event', 'session', 'Driver'], sort=False)]
+
+    return lambda: [get_stint_lengths(driver_compounds) for driver_compounds in compounds]
+
+
+@benchmark('encode_stints')
+def setup_encode_stints(data):
+    from driver_stats import encode_stints
+
+    return lambda: encode_stints(data['season_laps'])
+
+
+@benchmark('get_driver_moments')
+def setup_get_driver_moments(data):
+    from driver_stats import get_driver_moments
+
+    return lambda: get_driver_moments(data['season_laps'])
+
+
+@benchmark('get_lap_table')
+def setup_get_lap_table(data):
+    from lap_table import get_lap_table
+
+    return lambda: get_lap_table(data['season_laps'])
+
+
+@benchmark('get_driver_moments_lap_table')
+def setup_get_driver_moments_lap_table(data):
+    from driver_stats import get_driver_moments
+    from lap_table import get_lap_table
+
+    table = get_lap_table(data['season_laps'])
+
+    return lambda: get_driver_moments(table)
+
+
+@benchmark('extract_long_run_pace_from_longest_practice_stint')
+def setup_extract_long_run_pace(data):
+    from fastf1.core import Laps
+    from practice import extract_long_run_pace_from_longest_practice_stint
+
+    sessions = [Laps(laps) for laps in data['fp2_laps']]
+
+    return lambda: [extract_long_run_pace_from_longest_practice_stint(laps, driver)
+                    for laps in sessions for driver in laps['Driver'].unique()]
+
+
+@benchmark('extract_long_run_pace_all_drivers')
+def setup_extract_long_run_pace_all_drivers(data):
+    from practice import extract_long_run_pace_all_drivers
+
+    return lambda: [extract_long_run_pace_all_drivers(laps) for laps in data['fp2_laps']]
+
+
+@benchmark('get_tyre_model_fits')
+def setup_get_tyre_model_fits(data):
+    from charts import get_tyre_model_fits
+
+    return lambda: [get_tyre_model_fits(laps) for laps in data['fp2_laps']]
+
+
+@benchmark('get_tyre_model_table_all_sessions')
+def setup_get_tyre_model_table_all_sessions(data):
+    from practice import get_tyre_model_table
+
+    # Every driver on every compound of every session of the season, in a single fit.
+    season_laps = data['season_laps'].assign(Driver=data['season_laps']['event'] + ' ' +
+                                             data['season_laps']['session'] + ' ' +
+                                             data['season_laps']['Driver'])
+
+    return lambda: get_tyre_model_table(season_laps)
+
+
+@benchmark('get_teammate_mini_sector_deltas')
+def setup_get_teammate_mini_sector_deltas(data):
+    import atexit
+    import shutil
+    import tempfile
+
+    from telemetry import get_teammate_mini_sector_deltas, open_telemetry, write_telemetry
+
+    # The fastest laps of a qualifying session of each event, in one memory-mapped store each.
+    paths = []
+    for event in range(len(data['fp2_laps'])):
+        paths.append(tempfile.mkdtemp(prefix='telemetry_'))
+        atexit.register(shutil.rmtree, paths[-1], True)
+        write_telemetry(fixtures.make_lap_telemetry(event), paths[-1])
+
+    return lambda: [get_teammate_mini_sector_deltas(open_telemetry(path)) for path in paths]
+
+
+@benchmark('laptime_model')
+def setup_laptime_model(data):
+    from race_sim import laptime_model
+
+    long_runs = [(np.array(row.LapNumbers), np.array(row.LapTimes))
+                 for fp2_race_sim in data['fp2_race_sims'] for row in fp2_race_sim.itertuples()
+                 if row.NoOfLaps > 2]
+
+    return lambda: [laptime_model(laps, laptimes, MEDIUM) for laps, laptimes in long_runs]
+
+
+@benchmark('batch_laptime_model')
+def setup_batch_laptime_model(data):
+    from race_sim import batch_laptime_model, get_ragged_array
+
+    long_runs = pd.concat(data['fp2_race_sims'])
+    long_runs = long_runs[long_runs.NoOfLaps > 2]
+
+    def run():
+        laps, offsets = get_ragged_array(long_runs.LapNumbers)
+        laptimes, _ = get_ragged_array(long_runs.LapTimes)
+        return batch_laptime_model(laps, laptimes, offsets, MEDIUM)
+
+    return run
+
+
+@benchmark('get_head_to_head_df')
+def setup_get_head_to_head_df(data):
+    from prediction import get_head_to_head_df
+
+    return lambda: [get_head_to_head_df(fp2_race_sim, times_df) for fp2_race_sim, times_df in
+                    zip(data['fp2_race_sims'], data['qualifying_times'])]
+
+
+@benchmark('get_head_to_head_batch')
+def setup_get_head_to_head_batch(data):
+    from prediction import get_head_to_head_batch
+
+    fp2_race_sims = pd.concat([fp2_race_sim.assign(Weekend=i)
+                               for i, fp2_race_sim in enumerate(data['fp2_race_sims'])])
+    qualifying_times = pd.concat([times_df.assign(Weekend=i)
+                                  for i, times_df in enumerate(data['qualifying_times'])])
+
+    return lambda: get_head_to_head_batch(fp2_race_sims, qualifying_times)
+
+
+@benchmark('replay_session')
+def setup_replay_session(data):
+    from live import replay_session
+    from strategy import clear_strategy_cache
+
+    strategy_parameters = {'no_of_laps': 70, 'in_lap': 2.5, 'out_lap': 16.5, 'start_time': 6}
+
+    def run():
+        clear_strategy_cache()
+        return [list(replay_session(laps, times_df, None, data['driver_tyre_data'],
+                                    strategy_parameters))[-1]
+                for laps, times_df in zip(data['fp2_laps'], data['qualifying_times'])]
+
+    return run
+
+
+@benchmark('service_cached_questions')
+def setup_service_cached_questions(data):
+    import asyncio
+    import atexit
+
+    from practice import get_tyre_model_table
+    from prediction import get_head_to_head_df
+    from service import add_weekend, answer, close_service, create_service
+
+    service = create_service(processes=1)
+    atexit.register(close_service, service)
+
+    h2h = get_head_to_head_df(data['fp2_race_sims'][0], data['qualifying_times'][0])
+    driver_tyre_data = data['driver_tyre_data'].drop(columns='LongRunEstimate').merge(
+        h2h[['Driver', 'LongRunEstimate', 'QualifyingPosition']], on='Driver')
+    parameters = {'no_of_laps': 70, 'in_lap': 2.5, 'out_lap': 16.5, 'start_time': 6}
+    add_weekend(service, 2022, 1, {
+        'weekend': pd.DataFrame({'Season': [2022], 'Round': [1], 'Event': ['Event 1']}),
+        'fp2_laps': data['fp2_laps'][0], 'fp2_race_sim': data['fp2_race_sims'][0], 'h2h': h2h,
+        'driver_tyre_data': driver_tyre_data, 'strategy_parameters': parameters,
+        'simulation_parameters': dict(parameters, safety_car_probability=0.5,
+                                      virtual_safety_car_probability=0.5),
+        'tyre_models': get_tyre_model_table(data['fp2_laps'][0]).reset_index()})
+
+    # Ten questions per event asked at the same time, needing at most 60 strategy tables.
+    questions = []
+    for i in range(10 * len(data['race_laps'])):
+        driver = driver_tyre_data['Driver'].iloc[i % len(driver_tyre_data)]
+        question = {'season': 2022, 'round': 1, 'drivers': [driver],
+                    'deg_factor_changes': {driver: {HARD: 1 + 0.05 * (i % 3)}}}
+        path = ['/strategies', '/strategies', '/tyre_models', '/head_to_head'][i % 4]
+        questions.append((path, json.dumps(question).encode()))
+
+    async def ask():
+        return await asyncio.gather(*[answer(service, 'POST', path, body)
+                                      for path, body in questions])
+
+    # Only the cached answers are timed.
+    asyncio.run(ask())
+
+    return lambda: asyncio.run(ask())
+
+
+@benchmark('calculate_race_lap_times')
+def setup_calculate_race_lap_times(data):
+    from race import calculate_race_lap_times
+
+    driver_laps = [laps for race_laps in data['race_laps']
+                   for _, laps in race_laps.groupby('Driver', sort=False)]
+
+    return lambda: [calculate_race_lap_times(laps.copy()) for laps in driver_laps]
+
+
+@benchmark('calculate_race_lap_times_all_races')
+def setup_calculate_race_lap_times_all_races(data):
+    from race import calculate_race_lap_times
+
+    race_laps = data['season_laps'][data['season_laps']['session'] == 'R']
+
+    return lambda: calculate_race_lap_times(race_laps.copy())
+
+
+@benchmark('get_track_status_by_lap')
+def setup_get_track_status_by_lap(data):
+    from race import get_track_status_by_lap
+
+    return lambda: [get_track_status_by_lap(laps) for laps in data['race_laps']]
+
+
+@benchmark('get_track_status_flags')
+def setup_get_track_status_flags(data):
+    from race import get_track_status_flags
+
+    return lambda: get_track_status_flags(data['season_laps'])
+
+
+@benchmark('get_optimal_strategies')
+def setup_get_optimal_strategies(data):
+    from strategy import get_optimal_strategies
+
+    return lambda: [get_optimal_strategies(data['driver_tyre_data'], 70, 2.5, 16.5, 6)
+                    for _ in data['race_laps']]
+
+
+@benchmark('get_optimal_strategies_cached')
+def setup_get_optimal_strategies_cached(data):
+    from strategy import clear_strategy_cache, get_optimal_strategies_cached
+
+    # Each race changes the deg factors of one driver, so the other drivers hit the cache.
+    driver_tyre_data = [data['driver_tyre_data'].copy() for _ in data['race_laps']]
+    for i, race_driver_tyre_data in enumerate(driver_tyre_data):
+        race_driver_tyre_data.loc[i % len(race_driver_tyre_data), 'SoftDegFactor'] += 0.01 * i
+
+    def run():
+        clear_strategy_cache()
+        return [get_optimal_strategies_cached(race_driver_tyre_data, 70, 2.5, 16.5, 6)
+                for race_driver_tyre_data in driver_tyre_data]
+
+    return run
+
+
+@benchmark('sweep_optimal_strategies')
+def setup_sweep_optimal_strategies(data):
+    from tracks import build_track_registry, sweep_optimal_strategies
+
+    # One track per race, with different race distances and pit losses.
+    registry = build_track_registry({
+        'Track {}'.format(i): {'NoOfLaps': 50 + i, 'InLap': 2 + i % 3, 'OutLap': 15 + i % 5}
+        for i in range(len(data['race_laps']))})
+
+    return lambda: sweep_optimal_strategies(data['driver_tyre_data'], registry)
+
+
+@benchmark('get_strategy_robustness')
+def setup_get_strategy_robustness(data):
+    from strategy import get_optimal_strategies, get_strategy_robustness
+
+    rng = np.random.default_rng(0)
+    driver_tyre_data = data['driver_tyre_data'].assign(**{
+        compound.title() + 'DegFactorVariance': rng.uniform(0.001, 0.01, 20)
+        for compound in DRY_TYRES}, BaseTimeVariance=rng.uniform(0.001, 0.02, 20))
+    # The ten fastest strategies of every number of stops, scored once per race.
+    strategies = get_optimal_strategies(driver_tyre_data, 70, 2.5, 16.5, 6, max_stops=3, top_k=10)
+
+    return lambda: [get_strategy_robustness(strategies, driver_tyre_data, 70, 2.5, 16.5, 6,
+                                            seed=i) for i in range(len(data['race_laps']))]
+
+
+@benchmark('simulate_races')
+def setup_simulate_races(data):
+    from race_engine import get_race_setup, simulate_races
+    from strategy import get_optimal_strategies
+
+    strategies = get_optimal_strategies(data['driver_tyre_data'], 70, 2.5, 16.5, 6)
+    race_setup = get_race_setup(data['driver_tyre_data'], strategies, 70, 2.5, 16.5, 6)
+
+    return lambda: simulate_races(race_setup, 1000, seed=0, processes=1)
+
+
+
+@benchmark('results_store_queries')
+def setup_results_store_queries(data):
+    import atexit
+    import shutil
+    import tempfile
+
+    from race_engine import get_race_setup, simulate_races
+    from results_store import append_races, create_results_store, \
+        get_head_to_head_probabilities, get_position_distribution, get_race_time_quantiles, \
+        get_track_status_probabilities
+    from strategy import get_optimal_strategies
+
+    strategies = get_optimal_strategies(data['driver_tyre_data'], 70, 2.5, 16.5, 6)
+    race_setup = get_race_setup(data['driver_tyre_data'], strategies, 70, 2.5, 16.5, 6)
+
+    # One chunk of 5000 races per event.
+    store_dir = tempfile.mkdtemp(prefix='results_')
+    atexit.register(shutil.rmtree, store_dir, True)
+    create_results_store(store_dir, race_setup)
+    races = simulate_races(race_setup, 5000, seed=0, processes=1)
+    for _ in data['race_laps']:
+        append_races(store_dir, *races)
+
+    return lambda: [query(store_dir) for query in [get_position_distribution,
+                                                   get_head_to_head_probabilities,
+                                                   get_race_time_quantiles,
+                                                   get_track_status_probabilities]]
+
+def run_benchmarks(scale: str, repeat: int, names: list = None) -> dict:
+    """
+    Runs the benchmarks and returns their timings.
+
+    :param scale: a string in SCALES representing the size of the synthetic data.
+
+    :param repeat: an int representing the number of timed runs of each benchmark.
+
+    :param names: a list of strings representing the benchmarks to run, or None for all of them.
+
+    :return: a dict containing the metadata of the run and, for each benchmark, the minimum,
+    median and maximum run times in seconds.
+    """
+    data = get_fixtures(SCALES[scale])
+
+    results = {}
+    for name, setup in BENCHMARKS.items():
+        if names is not None and name not in names:
+            continue
+
+        function = setup(data)
+        # One untimed run, so lazy imports and caches do not count.
+        function()
+        timings = timeit.Timer(function).repeat(repeat=repeat, number=1)
+        results[name] = {'min': min(timings), 'median': statistics.median(timings),
+                         'max': max(timings)}
+        print('{:<52}{:>12.4f} s'.format(name, results[name]['min']))
+
+    return {'meta': {'scale': scale, 'repeat': repeat, 'python': platform.python_version(),
+                     'numpy': np.__version__, 'pandas': pd.__version__,
+                     'machine': platform.platform(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+            'results': results}
+
+
+def compare_results(baseline: dict, results: dict, threshold: float) -> bool:
+    """
+    Prints the change of each benchmark against the baseline, using the minimum run times.
+
+    :param baseline: a dict returned by run_benchmarks, e.g. loaded from a stored JSON file.
+
+    :param results: a dict returned by run_benchmarks.
+
+    :param threshold: a float representing the relative slow down flagged as a regression, e.g.
+    0.1 for 10%.
+
+    :return: a bool indicating whether any benchmark regressed.
+    """
+    regressed = False
+    print('{:<52}{:>12}{:>12}{:>10}'.format('benchmark', 'baseline', 'current', 'ratio'))
+
+    for name, result in results['results'].items():
+        if name not in baseline['results']:
+            print('{:<52}{:>12}{:>12.4f}{:>10}'.format(name, '-', result['min'], 'new'))
+            continue
+
+        ratio = result['min'] / baseline['results'][name]['min']
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  REGRESSION'
+            regressed = True
+        elif ratio < 1 - threshold:
+            flag = '  faster'
+
+        print('{:<52}{:>12.4f}{:>12.4f}{:>10.2f}{}'.format(
+            name, baseline['results'][name]['min'], result['min'], ratio, flag))
+
+    return regressed
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='run the benchmarks')
+    run_parser.add_argument('--scale', choices=list(SCALES), default='session')
+    run_parser.add_argument('--repeat', type=int, default=5)
+    run_parser.add_argument('--output', help='write the results to this JSON file')
+    run_parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS),
+                            help='only run these benchmarks')
+
+    compare_parser = subparsers.add_parser('compare', help='compare results with a baseline')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('results')
+    compare_parser.add_argument('--threshold', type=float, default=0.1)
+
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        # The original functions trigger pandas warnings, which would flood the output.
+        warnings.simplefilter('ignore')
+        results = run_benchmarks(args.scale, args.repeat, args.only)
+        if args.output is not None:
+            with open(args.output, 'w') as file:
+                json.dump(results, file, indent=2)
+        return 0
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    with open(args.results) as file:
+        results = json.load(file)
+
+    if baseline['meta']['scale'] != results['meta']['scale']:
+        print('The baseline was run at a different scale ({} vs {}).'.format(
+            baseline['meta']['scale'], results['meta']['scale']))
+        return 2
+
+    return 1 if compare_results(baseline, results, args.threshold) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
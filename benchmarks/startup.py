@@ -0,0 +1,85 @@
+"""
+Measures the time it takes to import each module in a fresh interpreter, and checks that no module
+imports the heavy optional dependencies (fastf1, matplotlib and scipy) when it is imported.
+
+The simulation modules, which are imported by every worker process, must also start within a
+budget on top of importing numpy.
+
+Usage, from the root of the project:
+    python benchmarks/startup.py [--budget 50] [--repeat 5]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# The modules measured, and whether they are imported by the simulation workers.
+MODULES = {'constants': True, 'race_sim': True, 'strategy': True, 'race_engine': True,
+           'tracks': True, 'prediction': False, 'driver_stats': False, 'race': False,
+           'practice': False, 'qualifying': False, 'pipeline': False, 'profiling': False,
+           'telemetry': False, 'live': False, 'service': False, 'results_store': False}
+
+HEAVY_MODULES = ['fastf1', 'matplotlib', 'scipy']
+
+PROBE = """
+import sys, time, json
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed,
+                  'heavy': [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure_import(module: str, repeat: int) -> dict:
+    """
+    Imports a module in fresh interpreters and returns the fastest import time.
+
+    :param module: a string representing the name of the module, e.g. 'race_sim'.
+
+    :param repeat: an int representing the number of fresh interpreters.
+
+    :return: a dict containing the fastest import time in milliseconds and the heavy modules
+    imported as a side effect.
+    """
+    results = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', PROBE.format(module=module,
+                                                                    heavy=HEAVY_MODULES)],
+                                cwd=ROOT, capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    return {'milliseconds': min(result['seconds'] for result in results) * 1000,
+            'heavy': results[0]['heavy']}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--budget', type=float, default=50,
+                        help='the import time budget of the simulation modules in milliseconds, '
+                             'on top of importing numpy')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    numpy_milliseconds = measure_import('numpy', args.repeat)['milliseconds']
+    print('{:<16}{:>10}  {}'.format('module', 'ms', 'heavy modules'))
+    print('{:<16}{:>10.1f}  {}'.format('numpy', numpy_milliseconds, '(baseline)'))
+
+    failed = False
+    for module, is_worker_module in MODULES.items():
+        result = measure_import(module, args.repeat)
+        over_budget = is_worker_module and \
+            result['milliseconds'] - numpy_milliseconds > args.budget
+        failed |= over_budget or len(result['heavy']) > 0
+        print('{:<16}{:>10.1f}  {}{}'.format(module, result['milliseconds'],
+                                             ', '.join(result['heavy']) or '-',
+                                             '  (over budget)' if over_budget else ''))
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,264 @@
+"""
+Contains helper functions for rendering the charts of a session to image files, without a display.
+
+All fits and outlier masks are computed up front, then each page (one or more drivers) is drawn on
+its own figure with the Agg backend, in parallel worker processes. Only one figure per worker is
+held in memory at a time.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from constants import *
+from practice import TYRE_MODEL_COEFFICIENT_COLUMNS, get_tyre_model_laps, \
+    get_tyre_model_table
+from race import get_track_status_by_lap
+
+# The size of the figure of one driver (in inches)
+TYRE_MODEL_ROW_SIZE = (25, 5)
+LAP_TIME_CHART_SIZE = (20, 10)
+
+
+def _get_lap_times_in_seconds(df) -> object:
+    """
+    Returns the lap times in seconds, whether they are TimeDelta objects or already in seconds.
+    """
+    if pd.api.types.is_timedelta64_dtype(df['LapTime']):
+        return df['LapTime'].dt.total_seconds()
+
+    return df['LapTime'].astype(float)
+
+
+def get_tyre_model_fits(df, drivers: list = None) -> dict:
+    """
+    Returns the tyre models of the representative laps of each driver on each dry compound, the
+    same way practice.plot_dry_tyre_models_all_drivers fits them, without plotting. The models are
+    fitted together with practice.get_tyre_model_table.
+
+    :param df: A DataFrame containing data of a session. Usually this is a fastf1.core.Laps object,
+    or a lap table returned by lap_table.get_lap_table. It is not changed.
+
+    :param drivers: a list of strings representing the drivers, or None for all drivers.
+
+    :return: a dict mapping each driver to a dict mapping each dry compound to a dict with the keys
+    'TyreLife' and 'LapTime' (numpy.arrays of the representative laps), 'Outliers' (a numpy.array
+    of booleans of the laps drawn as outliers), 'Model' (a numpy.poly1d, or None) and 'Color'.
+    """
+    if isinstance(df, dict):
+        from lap_table import lap_table_to_df
+
+        df = lap_table_to_df(df)
+
+    laps = get_tyre_model_laps(df, drivers)
+    table = get_tyre_model_table(None, laps=laps)
+
+    drivers = df['Driver'].unique().tolist() if drivers is None else drivers
+    fits = {driver: {} for driver in drivers}
+    for (driver, compound), group in laps.groupby(['Driver', 'Compound'], sort=False):
+        row = table.loc[(driver, compound)]
+        if row['ValidLaps'] == 0:
+            continue
+
+        outliers = group['Outlier'].to_numpy()
+        model = None
+        color = '#1f77b4'
+        if row['Fitted']:
+            model = np.poly1d(row[TYRE_MODEL_COEFFICIENT_COLUMNS].to_numpy(dtype=float))
+        else:
+            # Too few laps for a model, so all laps are drawn in red without outliers.
+            color = 'red'
+            outliers = np.zeros(len(group), dtype=bool)
+
+        fits[driver][compound] = {'TyreLife': group['TyreLife'].to_numpy(),
+                                  'LapTime': group['LapTime'].to_numpy(),
+                                  'Outliers': outliers, 'Model': model, 'Color': color}
+
+    return fits
+
+
+def get_lap_time_chart_data(df, drivers: list = None) -> dict:
+    """
+    Returns the data of the lap time bar chart of each driver, see race.plot_lap_time_bar_graph.
+
+    :param df: A DataFrame containing data of a race session. Usually this is a fastf1.core.Laps
+    object. It is not changed.
+
+    :param drivers: a list of strings representing the drivers, or None for all drivers.
+
+    :return: a dict mapping each driver to a dict with the keys 'LapNumber', 'LapTime'
+    (numpy.arrays) and 'Compound' and 'TrackStatus' (lists of strings).
+    """
+    drivers = df['Driver'].unique().tolist() if drivers is None else drivers
+
+    laps = pd.DataFrame({'Driver': df['Driver'], 'LapNumber': df['LapNumber'].astype(float),
+                         'LapTime': _get_lap_times_in_seconds(df),
+                         'Compound': df['Compound'].astype(str),
+                         'TrackStatus': get_track_status_by_lap(df)})
+    laps = laps[laps['Driver'].isin(drivers)]
+
+    return {driver: {'LapNumber': group['LapNumber'].to_numpy(),
+                     'LapTime': group['LapTime'].to_numpy(),
+                     'Compound': group['Compound'].tolist(),
+                     'TrackStatus': group['TrackStatus'].tolist()}
+            for driver, group in laps.groupby('Driver', sort=False)}
+
+
+def _draw_tyre_models(axes, driver: str, fits: dict) -> None:
+    """
+    Draws the tyre models of a driver on a row of axes, one per dry compound.
+    """
+    for ax, compound in zip(axes, DRY_TYRES):
+        ax.set_title(driver)
+        if compound not in fits:
+            continue
+
+        fit = fits[compound]
+        outliers = fit['Outliers']
+        ax.scatter(fit['TyreLife'][~outliers], fit['LapTime'][~outliers], color=fit['Color'])
+        ax.scatter(fit['TyreLife'][outliers], fit['LapTime'][outliers], color='red')
+        ax.set_xlabel('TyreLife')
+        ax.set_ylabel('LapTime')
+
+        if fit['Model'] is not None:
+            # The third parameter is the number of samples, set it to double of the laps
+            m = np.nanmin(fit['TyreLife'])
+            M = np.nanmax(fit['TyreLife'])
+            polyline = np.linspace(m, M, int((M - m) * 2))
+            ax.plot(polyline, fit['Model'](polyline))
+
+
+def _draw_lap_times(ax, driver: str, data: dict) -> None:
+    """
+    Draws the lap time bar chart of a driver, with the track status above each bar.
+    """
+    from constants import TYRES_COLOR_LEGEND
+
+    colors = [TYRES_LEGEND_COLORS.get(compound + '_PATCHES', ('grey', ''))[0]
+              for compound in data['Compound']]
+    bars = ax.bar(data['LapNumber'], data['LapTime'], width=0.99, color=colors,
+                  edgecolor='black')
+    ax.set_title(driver)
+    ax.set_xlabel('Lap Number')
+    ax.set_ylabel('Lap Time (second)')
+    ax.legend(handles=TYRES_COLOR_LEGEND, loc='upper right')
+
+    for bar, lap_status in zip(bars, data['TrackStatus']):
+        if lap_status:
+            ax.text(bar.get_x() + bar.get_width() / 2, bar.get_y() + bar.get_width(), lap_status,
+                    color='black', rotation='vertical')
+
+
+def _render_page(page: tuple) -> list:
+    """
+    Renders one page of charts to files with the Agg backend, and returns the paths of the files.
+
+    :param page: a tuple containing the kind of chart ('tyre_models' or 'lap_times'), the path of
+    the files without extension, the image formats, and a list of (driver, data) tuples.
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    kind, path, formats, drivers = page
+
+    if kind == 'tyre_models':
+        fig = Figure(figsize=(TYRE_MODEL_ROW_SIZE[0], TYRE_MODEL_ROW_SIZE[1] * len(drivers)))
+        axs = fig.subplots(len(drivers), len(DRY_TYRES), squeeze=False)
+        fig.suptitle('Long Run Race Pace')
+        for row, (driver, fits) in zip(axs, drivers):
+            _draw_tyre_models(row, driver, fits)
+    else:
+        fig = Figure(figsize=(LAP_TIME_CHART_SIZE[0], LAP_TIME_CHART_SIZE[1] * len(drivers)))
+        axs = fig.subplots(len(drivers), 1, squeeze=False)
+        for (ax,), (driver, data) in zip(axs, drivers):
+            _draw_lap_times(ax, driver, data)
+
+    FigureCanvasAgg(fig)
+    paths = []
+    for image_format in formats:
+        paths.append('{}.{}'.format(path, image_format))
+        fig.savefig(paths[-1], format=image_format)
+    fig.clear()
+
+    return paths
+
+
+def _render_pages(kind: str, data: dict, out_dir: str, drivers_per_page: int, formats: tuple,
+                  processes: int) -> list:
+    """
+    Splits the data of the drivers into pages and renders them, in parallel unless processes is 1.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+
+    drivers = list(data.items())
+    pages = []
+    for start in range(0, len(drivers), drivers_per_page):
+        page_drivers = drivers[start:start + drivers_per_page]
+        if drivers_per_page == 1:
+            name = '{}_{}'.format(kind, page_drivers[0][0])
+        else:
+            name = '{}_{}'.format(kind, start // drivers_per_page + 1)
+        pages.append((kind, os.path.join(out_dir, name), tuple(formats), page_drivers))
+
+    if processes == 1:
+        paths = list(map(_render_page, pages))
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            paths = list(executor.map(_render_page, pages))
+
+    return [path for page_paths in paths for path in page_paths]
+
+
+def render_tyre_model_charts(df, out_dir: str, drivers: list = None, drivers_per_page: int = 1,
+                             formats: tuple = ('png',), processes: int = None) -> list:
+    """
+    Renders the tyre models of each driver on each dry compound (the charts of
+    practice.plot_dry_tyre_models_all_drivers) to image files.
+
+    :param df: A DataFrame containing data of a session. Usually this is a fastf1.core.Laps object.
+
+    :param out_dir: a string representing the folder of the image files. It is created if needed.
+
+    :param drivers: a list of strings representing the drivers, or None for all drivers.
+
+    :param drivers_per_page: an int representing the number of drivers (rows) in each file.
+
+    :param formats: a tuple of strings representing the image formats, e.g. ('png', 'svg').
+
+    :param processes: an int representing the number of worker processes, or None to use all
+    CPUs. Use 1 to render in the current process.
+
+    :return: a list of strings representing the paths of the image files.
+    """
+    fits = get_tyre_model_fits(df, drivers)
+
+    return _render_pages('tyre_models', fits, out_dir, drivers_per_page, formats, processes)
+
+
+def render_lap_time_charts(df, out_dir: str, drivers: list = None, drivers_per_page: int = 1,
+                           formats: tuple = ('png',), processes: int = None) -> list:
+    """
+    Renders the lap time bar chart of each driver (the chart of race.plot_lap_time_bar_graph) to
+    image files.
+
+    :param df: A DataFrame containing data of a race session. Usually this is a fastf1.core.Laps
+    object, after calling race.calculate_race_lap_times.
+
+    :param out_dir: a string representing the folder of the image files. It is created if needed.
+
+    :param drivers: a list of strings representing the drivers, or None for all drivers.
+
+    :param drivers_per_page: an int representing the number of drivers in each file.
+
+    :param formats: a tuple of strings representing the image formats, e.g. ('png', 'svg').
+
+    :param processes: an int representing the number of worker processes, or None to use all
+    CPUs. Use 1 to render in the current process.
+
+    :return: a list of strings representing the paths of the image files.
+    """
+    data = get_lap_time_chart_data(df, drivers)
+
+    return _render_pages('lap_times', data, out_dir, drivers_per_page, formats, processes)
@@ -0,0 +1,24 @@
+"""
+Contains helper functions for configuring the project before loading any data.
+
+None of the other modules configure FastF1 when they are imported, so a notebook or a script
+loading sessions calls enable_cache once before calling ff1.get_session.
+"""
+import os
+
+from constants import *
+
+
+def enable_cache(cache_dir: str = None) -> None:
+    """
+    Enables the FastF1 cache, creating the cache folder if needed.
+
+    :param cache_dir: a string representing the folder of the cache. Defaults to the FASTF1_CACHE
+    environment variable if it is set, otherwise to CACHE_DIRECTORY.
+    """
+    import fastf1 as ff1
+
+    if cache_dir is None:
+        cache_dir = os.environ.get('FASTF1_CACHE', CACHE_DIRECTORY)
+    os.makedirs(cache_dir, exist_ok=True)
+    ff1.Cache.enable_cache(cache_dir)
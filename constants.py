@@ -1,10 +1,9 @@
 """
 Contains constants for analysing a Formula 1 weekend.
+
+This module has no side effects and does not import matplotlib. The legend patches below are
+created on first access.
 """
-import fastf1 as ff1
-import matplotlib.patches as mpatches
-# Enable the cache by providing the name of the cache folder
-ff1.Cache.enable_cache('cache')
 
 # Constants for tyre strings
 SOFT = 'SOFT'
@@ -14,14 +13,24 @@ INTERMEDIATE = 'INTERMEDIATE'
 WET = 'WET'
 DRY_TYRES = [SOFT, MEDIUM, HARD]
 WET_TYRES = [INTERMEDIATE, WET]
+TYRES = DRY_TYRES + WET_TYRES
+
+# Integer codes for tyre compounds, used when compounds are stored in numpy arrays
+COMPOUND_CODES = {compound: code for code, compound in enumerate(TYRES)}
+
+# Coefficients (a, b, c) of the tyre degradation model a * x ** 2 + b * x + c for each compound,
+# where x is the tyre life divided by the deg_factor of the driver.
+# Compounds without a model of their own (e.g. wet compounds) use the HARD model.
+TYRE_MODEL_COEFFICIENTS = {SOFT: (0.0025, 0.05, -1.5),
+                           MEDIUM: (0.0008333, 0.01, -0.4),
+                           HARD: (0.00007, 0.01, 0)}
 
 # Set the mapping for plot legend labels
-SOFT_PATCHES = mpatches.Patch(color='red', label='Soft')
-MEDIUM_PATCHES = mpatches.Patch(color='yellow', label='Medium')
-HARD_PATCHES = mpatches.Patch(color='white', label='Hard')
-INTERMEDIATE_PATCHES = mpatches.Patch(color='green', label='Intermediate')
-WET_PATCHES = mpatches.Patch(color='blue', label='Wet')
-TYRES_COLOR_LEGEND = [SOFT_PATCHES, MEDIUM_PATCHES, HARD_PATCHES, INTERMEDIATE_PATCHES, WET_PATCHES]
+# The matplotlib patches (SOFT_PATCHES, ..., TYRES_COLOR_LEGEND) are created by __getattr__ below.
+TYRES_LEGEND_COLORS = {'SOFT_PATCHES': ('red', 'Soft'), 'MEDIUM_PATCHES': ('yellow', 'Medium'),
+                       'HARD_PATCHES': ('white', 'Hard'),
+                       'INTERMEDIATE_PATCHES': ('green', 'Intermediate'),
+                       'WET_PATCHES': ('blue', 'Wet')}
 
 # Another color mapping... just for the purpose of line plot
 TYRES_COLOR_DICT = {"SOFT": "red", "MEDIUM": "#FFC000", "HARD": "white", "INTERMEDIATE": "green",
@@ -29,8 +38,22 @@ TYRES_COLOR_DICT = {"SOFT": "red", "MEDIUM": "#FFC000", "HARD": "white", "INTERM
 
 TYRE_DEGRADATION_REGRESSION_DEGREE = 2
 
+# The folder of the FastF1 cache, see config.enable_cache
+CACHE_DIRECTORY = 'cache'
+
+# The folder of the local session store
+SESSION_STORE_DIRECTORY = 'store'
+
+# The columns identifying a session in a frame containing the laps of several sessions
+SESSION_KEY_COLUMNS = ['season', 'event', 'session']
+
 QUALIFYING_SESSIONS = ['Q1', 'Q2', 'Q3']
 
+# Short identifiers of the sessions, as accepted by ff1.get_session
+SESSION_NAMES = {'Practice 1': 'FP1', 'Practice 2': 'FP2', 'Practice 3': 'FP3',
+                 'Sprint Qualifying': 'SQ', 'Sprint Shootout': 'SS', 'Sprint': 'S',
+                 'Qualifying': 'Q', 'Race': 'R'}
+
 # Teammate pairs in 2022 and values can be keys
 TEAMMATE_PAIRS_DICT = {'RUS': 'HAM', 'VER': 'PER', 'MSC': 'MAG', 'BOT': 'ZHO', 'RIC': 'NOR',
                        'STR': 'VET', 'ALB': 'LAT', 'TSU': 'GAS', 'OCO': 'ALO', 'SAI': 'LEC'}
@@ -41,3 +64,92 @@ TEAMMATE_MAX_GAP_SECOND = 1
 QUALIFYING_MAX_GAP_PERCENTAGE = 1.02
 FP2_MAX_GAP_PERCENTAGE = 1.03
 MAX_GAP_VALUE = 20
+
+# Track status flags, which can be combined, e.g. SAFETY_CAR | YELLOW_FLAG
+SAFETY_CAR = 1
+VIRTUAL_SAFETY_CAR = 2
+VIRTUAL_SAFETY_CAR_ENDING = 4
+RED_FLAG = 8
+YELLOW_FLAG = 16
+# The track status of the lap is unknown (missing)
+NO_TRACK_STATUS = 64
+
+# The flag of each digit of a FastF1 track status, e.g. '67' is VIRTUAL_SAFETY_CAR |
+# VIRTUAL_SAFETY_CAR_ENDING. '1' (green flag) has no flag.
+TRACK_STATUS_CODE_FLAGS = {'2': YELLOW_FLAG, '4': SAFETY_CAR, '5': RED_FLAG,
+                           '6': VIRTUAL_SAFETY_CAR, '7': VIRTUAL_SAFETY_CAR_ENDING}
+
+# Constants for simulating a race
+LAP_TIME_NOISE_SD = 0.4
+GRID_SLOT_GAP_SECOND = 0.2
+MIN_FOLLOWING_GAP_SECOND = 0.3
+OVERTAKE_MIN_PACE_ADVANTAGE_SECOND = 0.8
+RETIREMENT_PROBABILITY_PER_LAP = 0.0005
+SAFETY_CAR_PROBABILITY_PER_LAP = 0.01
+VIRTUAL_SAFETY_CAR_PROBABILITY_PER_LAP = 0.01
+ACCIDENT_SAFETY_CAR_PROBABILITY = 0.5
+SAFETY_CAR_LAPS = 4
+VIRTUAL_SAFETY_CAR_LAPS = 2
+SAFETY_CAR_LAP_TIME_FACTOR = 1.4
+VIRTUAL_SAFETY_CAR_LAP_TIME_FACTOR = 1.3
+SAFETY_CAR_GAP_SECOND = 0.5
+SAFETY_CAR_PIT_LOSS_FACTOR = 0.5
+
+# Parameters of the tracks, see tracks.py. The parameters of the Hungarian Grand Prix are the
+# defaults of the parameters which cannot be derived from the laps of a track.
+TRACK_REGISTRY_FILE = 'tracks.npz'
+DEFAULT_TRACK_PARAMETERS = {'Hungarian Grand Prix': {'NoOfLaps': 70, 'InLap': 2.5, 'OutLap': 16.5,
+                                                     'StartTime': 6}}
+DEFAULT_IN_LAP = 2.5
+DEFAULT_OUT_LAP = 16.5
+DEFAULT_START_TIME = 6
+# The number of different dry compounds a driver must use in a dry race
+MIN_DRY_COMPOUNDS = 2
+
+# Constants for caching strategies, see strategy.get_optimal_strategies_cached
+DEG_FACTOR_QUANTUM = 0.001
+STINT_COST_CACHE_SIZE = 4096
+STRATEGY_CACHE_SIZE = 1024
+
+# The folder of the telemetry store, see telemetry.py
+TELEMETRY_STORE_DIRECTORY = 'telemetry'
+# The number of mini-sectors of a lap, and the distance between the telemetry samples (in metres)
+# used to find the lowest speed in each mini-sector
+NO_OF_MINI_SECTORS = 25
+TELEMETRY_RESOLUTION = 5
+
+# The folder of the results store, see results_store.py, the number of simulated races in each
+# chunk file and its compression, and the number of bins used to find the quantiles of the race
+# times
+RESULTS_STORE_DIRECTORY = 'results'
+RESULTS_STORE_RACES_PER_FILE = 20000
+RESULTS_STORE_COMPRESSION = 'zstd'
+RESULTS_STORE_QUANTILE_BINS = 4096
+
+
+# Constants for the prediction service, see service.py: the address it listens on and the number
+# of weekends, strategy tables and simulations kept in memory
+SERVICE_HOST = '127.0.0.1'
+SERVICE_PORT = 8050
+SERVICE_WEEKEND_CACHE_SIZE = 8
+SERVICE_STRATEGY_CACHE_SIZE = 256
+SERVICE_SIMULATION_CACHE_SIZE = 32
+
+
+def __getattr__(name):
+    """
+    Creates the matplotlib legend patches on first access, so importing this module does not
+    import matplotlib.
+    """
+    if name == 'TYRES_COLOR_LEGEND':
+        legend = [__getattr__(patch_name) for patch_name in TYRES_LEGEND_COLORS]
+    elif name in TYRES_LEGEND_COLORS:
+        import matplotlib.patches as mpatches
+
+        color, label = TYRES_LEGEND_COLORS[name]
+        legend = mpatches.Patch(color=color, label=label)
+    else:
+        raise AttributeError("module 'constants' has no attribute '{}'".format(name))
+
+    globals()[name] = legend
+    return legend
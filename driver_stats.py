@@ -1,6 +1,83 @@
 """
 Contains helper functions for analysing drivers' career performance.
 """
+import numpy as np
+
+from constants import *
+
+# The two (overlapping) groups of laps used for the driver statistics
+LAP_SETS = ['All', 'Rep']
+
+
+def get_change_points(*columns) -> object:
+    """
+    Returns a boolean mask of the rows where a run of equal values starts, i.e. where any of the
+    columns differs from the previous row. Missing values (NaN) never equal each other.
+
+    :param columns: one or more numpy.arrays (or pandas.Series) of the same length.
+
+    :return: a numpy.array of booleans, True for the first row of each run.
+    """
+    import pandas as pd
+
+    change_points = np.zeros(len(columns[0]), dtype=bool)
+    if len(change_points) == 0:
+        return change_points
+    change_points[0] = True
+
+    for column in columns:
+        codes, _ = pd.factorize(np.asarray(column))
+        change_points[1:] |= codes[1:] != codes[:-1]
+        change_points |= codes == -1
+
+    return change_points
+
+
+def encode_stints(df, split_on_pit_stops: bool = False) -> object:
+    """
+    Encodes the laps of one or more sessions into stints with run-length encoding, in one pass.
+
+    By default a stint is a run of laps on the same compound, as in get_stint_lengths. The laps of
+    different drivers and sessions (see SESSION_KEY_COLUMNS) are never in the same stint.
+
+    :param df: A DataFrame containing laps, ordered by driver and lap number within each session.
+    Usually this is a fastf1.core.Laps object, a DataFrame returned by session_store.load_laps, or
+    a lap table returned by lap_table.get_lap_table.
+
+    :param split_on_pit_stops: a bool indicating whether a pit stop onto the same compound starts
+    a new stint as well, using the 'Stint' column and the out laps.
+
+    :return: a DataFrame with the columns 'Driver', the session columns present in df, 'Compound',
+    'StartLap' (the lap number of the first lap, or its row number if df has no 'LapNumber') and
+    'Length', one row per stint.
+    """
+    import pandas as pd
+
+    if isinstance(df, dict):
+        from lap_table import lap_table_to_df
+
+        df = lap_table_to_df(df)
+
+    session_keys = [column for column in SESSION_KEY_COLUMNS if column in df.columns]
+    columns = [df[column] for column in session_keys + ['Driver', 'Compound']]
+
+    if split_on_pit_stops:
+        columns.append(df['Stint'])
+        out_laps = df['PitOut'] if 'PitOut' in df.columns else df['PitOutTime'].notnull()
+        out_laps = np.asarray(out_laps, dtype=bool)
+    else:
+        out_laps = np.zeros(len(df), dtype=bool)
+
+    starts = np.flatnonzero(get_change_points(*columns) | out_laps)
+    lengths = np.diff(np.append(starts, len(df)))
+
+    stints = {column: np.asarray(df[column])[starts] for column in ['Driver'] + session_keys}
+    stints['Compound'] = np.asarray(df['Compound'])[starts]
+    stints['StartLap'] = np.asarray(df['LapNumber'])[starts] if 'LapNumber' in df.columns \
+        else starts
+    stints['Length'] = lengths
+
+    return pd.DataFrame(stints)
 
 
 def get_stint_lengths(stints_list: list):
@@ -13,31 +90,220 @@ def get_stint_lengths(stints_list: list):
     """
 
     # Returns an empty list if input is empty
-    if stints_list == []:
+    if len(stints_list) == 0:
         return []
 
-    # The final result
-    stints_tuples = []
-
-    # Variables for tracking the stint in the for loop below.
-    stint_laps = 0
-    curr = None
-
-    for i in range(len(stints_list)):
-        curr = stints_list[i]
-        # For the first stint, start counting the laps on this current stint.
-        if i == 0:
-            stint_laps = 1
-        else:
-            stint_laps += 1
-            prev = stints_list[i - 1]
-            # If the current stint is different from the previous one, this means the driver
-            # has changed a tyres and we can conclude the previous stint lap count.
-            if curr != prev:
-                stints_tuples.append((prev, stint_laps - 1))
-                stint_laps = 1
-
-    # For the final stint, remember to append the result to the returning list.
-    stints_tuples.append((curr, stint_laps))
-
-    return stints_tuples
+    # Unlike get_change_points, equal missing values (e.g. None) form a single stint, as they did
+    # in the original loop over the laps. NaN still never equals itself.
+    compounds = np.asarray(stints_list, dtype=object)
+    starts = np.flatnonzero(np.append(True, compounds[1:] != compounds[:-1]))
+    lengths = np.diff(np.append(starts, len(compounds)))
+
+    return list(zip(compounds[starts].tolist(), lengths.tolist()))
+
+
+def get_representative_laps_mask(df) -> object:
+    """
+    Returns a boolean mask of the representative laps, i.e. the laps picked by
+    df.pick_accurate().pick_wo_box().pick_track_status('1') on a fastf1.core.Laps object.
+
+    :param df: A DataFrame containing laps. Usually this is a fastf1.core.Laps object, or a
+    DataFrame returned by session_store.normalize_laps or lap_table.lap_table_to_df.
+
+    :return: a pandas.Series of booleans, True for laps set under green flag which are accurate
+    and are neither in laps nor out laps.
+    """
+    import pandas as pd
+
+    if 'PitIn' in df.columns:
+        in_or_out_lap = df['PitIn'] | df['PitOut']
+    else:
+        in_or_out_lap = df['PitInTime'].notnull() | df['PitOutTime'].notnull()
+
+    # Lap tables store the track status as flags, which are 0 under green flag.
+    green_flag = 0 if pd.api.types.is_integer_dtype(df['TrackStatus']) else '1'
+
+    return (df['IsAccurate'] == True) & ~in_or_out_lap & (df['TrackStatus'] == green_flag)
+
+
+def get_driver_moments(df) -> object:
+    """
+    Computes the lap time statistics of each driver on each dry compound, for all laps ('All')
+    and for representative laps ('Rep'), with one groupby.
+
+    The statistics are kept as mergeable moments (count, mean and sum of squared deviations), so
+    the moments of several races can be combined with merge_driver_moments without reprocessing
+    the laps. See get_driver_stats_df for the final statistics.
+
+    :param df: A DataFrame containing the laps of one or more sessions, ordered by driver and lap
+    number within each session. Usually this is a fastf1.core.Laps object, a DataFrame returned
+    by session_store.load_laps, or a lap table. Lap times can be TimeDelta objects or seconds. The
+    laps of different sessions are told apart by the columns in SESSION_KEY_COLUMNS, if present.
+
+    :return: a DataFrame indexed by ('Driver', 'LapSet', 'Compound') with the columns 'Time' (the
+    total lap time), 'Laps', 'Stints', 'Count' (the number of laps with a lap time), 'Mean' and
+    'M2' (the sum of squared deviations from the mean).
+    """
+    import pandas as pd
+
+    if isinstance(df, dict):
+        from lap_table import lap_table_to_df
+
+        df = lap_table_to_df(df)
+
+    lap_times = df['LapTime']
+    if pd.api.types.is_timedelta64_dtype(lap_times):
+        lap_times = lap_times.dt.total_seconds()
+
+    session_keys = [column for column in SESSION_KEY_COLUMNS if column in df.columns]
+    laps = df[['Driver', 'Compound'] + session_keys].assign(LapTime=lap_times)
+
+    lap_sets = []
+    for lap_set, mask in (('All', None), ('Rep', get_representative_laps_mask(df))):
+        subset = laps if mask is None else laps[mask.to_numpy()]
+
+        # A new stint starts whenever the compound (or the driver or the session) changes.
+        new_stint = get_change_points(*[subset[column] for column in
+                                        ['Driver', 'Compound'] + session_keys])
+
+        lap_sets.append(subset.assign(LapSet=lap_set, NewStint=new_stint))
+
+    laps = pd.concat(lap_sets)
+    laps = laps[laps['Compound'].isin(DRY_TYRES)]
+
+    grouped = laps.groupby(['Driver', 'LapSet', 'Compound'])
+    moments = grouped.agg(Time=('LapTime', 'sum'), Laps=('LapTime', 'size'),
+                          Stints=('NewStint', 'sum'), Count=('LapTime', 'count'),
+                          Mean=('LapTime', 'mean'))
+    moments['M2'] = (grouped['LapTime'].var(ddof=0) * moments['Count']).fillna(0)
+    moments['Mean'] = moments['Mean'].fillna(0)
+
+    return moments.astype({'Laps': int, 'Stints': int, 'Count': int})
+
+
+def merge_driver_moments(moments, other_moments) -> object:
+    """
+    Combines the moments of two sets of laps, e.g. the moments of the previous races and the
+    moments of a new race, as if they were computed from all the laps at once.
+
+    :param moments: a DataFrame returned by get_driver_moments or merge_driver_moments.
+
+    :param other_moments: a DataFrame returned by get_driver_moments or merge_driver_moments.
+
+    :return: a DataFrame containing the combined moments, in the same format as the inputs.
+    """
+    index = moments.index.union(other_moments.index)
+    a = moments.reindex(index, fill_value=0)
+    b = other_moments.reindex(index, fill_value=0)
+
+    # The parallel algorithm of Chan et al. for combining means and sums of squared deviations.
+    count = a['Count'] + b['Count']
+    weight = (b['Count'] / count.where(count > 0)).fillna(0)
+    delta = b['Mean'] - a['Mean']
+
+    merged = a[['Time', 'Laps', 'Stints']] + b[['Time', 'Laps', 'Stints']]
+    merged['Count'] = count
+    merged['Mean'] = a['Mean'] + delta * weight
+    merged['M2'] = a['M2'] + b['M2'] + delta ** 2 * a['Count'] * weight
+
+    return merged
+
+
+def get_driver_stats_df(moments) -> object:
+    """
+    Returns the season statistics of each driver from the moments of their laps.
+
+    :param moments: a DataFrame returned by get_driver_moments or merge_driver_moments.
+
+    :return: a DataFrame with a 'Driver' column and, for each of 'Soft', 'Medium', 'Hard' and
+    'Total' (all dry compounds) and each lap set ('All' and 'Rep'), the columns '<Compound>Time',
+    '<Compound>Laps', '<Compound>Sd', '<Compound>Stints' and '<Compound>AvgTime', followed by the
+    lap set, e.g. 'SoftTimeAll'. Sd is the (population) standard deviation of the lap times.
+    """
+    import pandas as pd
+
+    # Combine the moments of all dry compounds into the total of each driver and lap set.
+    levels = ['Driver', 'LapSet']
+    totals = moments[['Time', 'Laps', 'Stints', 'Count']].groupby(level=levels).sum()
+    totals['Mean'] = ((moments['Mean'] * moments['Count']).groupby(level=levels).sum() /
+                      totals['Count'].where(totals['Count'] > 0)).fillna(0)
+    deviations = moments['Mean'] - \
+        totals['Mean'].reindex(moments.index.droplevel('Compound')).to_numpy()
+    totals['M2'] = (moments['M2'] + moments['Count'] * deviations ** 2).groupby(level=levels).sum()
+    totals = totals.assign(Compound='Total').set_index('Compound', append=True)
+
+    stats = pd.concat([moments, totals])
+    stats['Sd'] = np.sqrt(stats['M2'] / stats['Count'].where(stats['Count'] > 0)).fillna(0)
+    stats['AvgTime'] = stats['Time'] / stats['Laps']
+
+    wide = stats[['Time', 'Laps', 'Sd', 'Stints', 'AvgTime']].unstack(['Compound', 'LapSet'])
+    driver_stats_df = pd.DataFrame({'Driver': wide.index})
+    for compound in DRY_TYRES + ['Total']:
+        for lap_set in LAP_SETS:
+            for statistic in ['Time', 'Laps', 'Sd', 'Stints', 'AvgTime']:
+                column = (statistic, compound, lap_set)
+                values = wide[column].to_numpy() if column in wide.columns else \
+                    np.full(len(wide), np.nan)
+                if statistic != 'AvgTime':
+                    values = np.nan_to_num(values)
+                driver_stats_df[compound.title() + statistic + lap_set] = values
+
+    return driver_stats_df
+
+
+def get_deg_factors(driver_stats_df, lap_set: str = 'Rep') -> object:
+    """
+    Returns the deg factor of each driver on each dry compound and in total, as in RaceSim.ipynb.
+
+    The deg factor is the average number of laps of the stints of a driver on a compound, relative
+    to the average of all drivers, i.e. a driver with a deg factor above 1 makes their tyres last
+    longer.
+
+    :param driver_stats_df: a DataFrame returned by get_driver_stats_df.
+
+    :param lap_set: a string in LAP_SETS representing the laps used.
+
+    :return: a DataFrame with the columns 'Driver', 'SoftDegFactor', 'MediumDegFactor',
+    'HardDegFactor' and 'TotalDegFactor'. Drivers without a stint on a compound have NaN.
+    """
+    import pandas as pd
+
+    deg_factors = pd.DataFrame({'Driver': driver_stats_df['Driver']})
+    for compound in DRY_TYRES + ['Total']:
+        stints = driver_stats_df[compound.title() + 'Stints' + lap_set]
+        laps_per_stint = driver_stats_df[compound.title() + 'Laps' + lap_set] / \
+            stints.where(stints > 0)
+        deg_factors[compound.title() + 'DegFactor'] = laps_per_stint / laps_per_stint.mean()
+
+    return deg_factors
+
+
+def get_deg_factor_variances(driver_stats_df, lap_set: str = 'Rep') -> object:
+    """
+    Returns the variance of the deg factor of each driver on each dry compound and in total, i.e.
+    how uncertain the deg factors of get_deg_factors are.
+
+    The driver statistics only keep the number of laps and stints of a driver, so the laps of a
+    stint are treated as Poisson distributed: the variance of the average stint length is the
+    average stint length divided by the number of stints. Drivers with few stints thus have
+    uncertain deg factors.
+
+    :param driver_stats_df: a DataFrame returned by get_driver_stats_df.
+
+    :param lap_set: a string in LAP_SETS representing the laps used.
+
+    :return: a DataFrame with the columns 'Driver', 'SoftDegFactorVariance',
+    'MediumDegFactorVariance', 'HardDegFactorVariance' and 'TotalDegFactorVariance'. Drivers
+    without a stint on a compound have NaN.
+    """
+    import pandas as pd
+
+    variances = pd.DataFrame({'Driver': driver_stats_df['Driver']})
+    for compound in DRY_TYRES + ['Total']:
+        stints = driver_stats_df[compound.title() + 'Stints' + lap_set]
+        laps_per_stint = driver_stats_df[compound.title() + 'Laps' + lap_set] / \
+            stints.where(stints > 0)
+        variances[compound.title() + 'DegFactorVariance'] = \
+            laps_per_stint / stints / laps_per_stint.mean() ** 2
+
+    return variances
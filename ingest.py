@@ -0,0 +1,113 @@
+"""
+Contains helper functions for loading many sessions at once, e.g. every race of a season.
+
+The sessions are loaded from the FastF1 cache (see config.enable_cache) and normalized with
+session_store.normalize_laps in a bounded pool of worker processes. The laps of each session are
+returned as soon as it is loaded, so they can be aggregated (e.g. with
+driver_stats.get_driver_moments and driver_stats.merge_driver_moments) while the other sessions
+are still loading.
+"""
+from config import enable_cache
+from constants import *
+
+
+def _load_session(key: tuple, cache_dir: str, offline: bool, store_dir: str) -> tuple:
+    """
+    Loads and normalizes the laps of one session. Runs in a worker process.
+
+    :param key: a tuple (season, round, session) accepted by ff1.get_session, e.g. (2022, 1, 'R').
+
+    :return: a tuple containing the key and the normalized laps, with the columns 'season', 'event'
+    and 'session' appended.
+    """
+    import fastf1 as ff1
+
+    from session_store import normalize_laps, write_session
+
+    enable_cache(cache_dir)
+    if offline:
+        ff1.Cache.offline_mode(True)
+
+    season, round_number, session_name = key
+    session = ff1.get_session(season, round_number, session_name)
+    session.load(laps=True, telemetry=False, weather=False, messages=False)
+
+    laps = normalize_laps(session.laps)
+    event = session.event['EventName']
+    session_name = SESSION_NAMES.get(session.name, session.name)
+    if store_dir is not None:
+        write_session(laps, season, event, session_name, store_dir)
+
+    return key, laps.assign(season=season, event=event, session=session_name)
+
+
+def iter_sessions(keys: list, cache_dir: str = None, processes: int = None,
+                  offline: bool = False, store_dir: str = None):
+    """
+    Loads and normalizes sessions concurrently, and yields the laps of each session as soon as it
+    is loaded, i.e. not necessarily in the order of keys.
+
+    At most 2 * processes sessions are loading or waiting to be collected at any time, so the
+    memory used does not grow with the number of sessions.
+
+    :param keys: a list of tuples (season, round, session) accepted by ff1.get_session, e.g.
+    [(2022, grand_prix_number, 'R') for grand_prix_number in range(1, 11)].
+
+    :param cache_dir: a string representing the folder of the FastF1 cache, see
+    config.enable_cache.
+
+    :param processes: an int representing the number of worker processes, or None to use all
+    CPUs. Use 1 to load the sessions one by one in the current process.
+
+    :param offline: a bool indicating whether to only use the cache, without any network request.
+
+    :param store_dir: a string representing the folder of a session store (see session_store.py)
+    where the laps of each session are written as well, or None.
+
+    :return: a generator of tuples containing the key and a DataFrame of the normalized laps of the
+    session (see session_store.normalize_laps) with the columns 'season', 'event' and 'session'.
+    """
+    if processes == 1:
+        for key in keys:
+            yield _load_session(key, cache_dir, offline, store_dir)
+        return
+
+    import os
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+    processes = os.cpu_count() if processes is None else processes
+    keys = iter(keys)
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        pending = set()
+        while True:
+            # Keep the pool busy, but do not queue all the sessions at once.
+            for key in keys:
+                pending.add(executor.submit(_load_session, key, cache_dir, offline, store_dir))
+                if len(pending) >= 2 * processes:
+                    break
+
+            if not pending:
+                return
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+def load_sessions(keys: list, cache_dir: str = None, processes: int = None,
+                  offline: bool = False, store_dir: str = None) -> object:
+    """
+    Loads and normalizes sessions concurrently, and returns their laps in a single DataFrame.
+
+    See iter_sessions for the parameters.
+
+    :return: a DataFrame containing the normalized laps of all the sessions, with the columns
+    'season', 'event' and 'session', in the order of keys.
+    """
+    import pandas as pd
+
+    keys = list(keys)
+    laps = dict(iter_sessions(keys, cache_dir, processes, offline, store_dir))
+
+    return pd.concat([laps[key] for key in keys], ignore_index=True)
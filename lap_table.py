@@ -0,0 +1,196 @@
+"""
+Contains helper functions for building compact lap tables, for analysing many sessions in memory.
+
+A lap table is a dict of numpy.arrays (struct of arrays), one entry per lap, sorted by session,
+driver and lap number, so the laps of a driver in a session are a contiguous run of rows:
+    'Session'      int16 code of the session (row of table['Sessions'])
+    'Driver'       int8 code of the driver (index of table['Drivers'])
+    'LapNumber'    int16, -1 if missing
+    'LapTime'      float32 seconds, NaN if missing
+    'LapStartTime' float32 seconds, NaN if missing
+    'Compound'     int8 code of the compound (see COMPOUND_CODES), -1 if unknown
+    'TyreLife'     int16, -1 if missing
+    'Stint'        int8, -1 if missing
+    'TrackStatus'  int8 track status flags, see race.get_track_status_flags
+    'PitIn', 'PitOut', 'IsAccurate'  booleans
+The entry 'Offsets' contains the first row of each run (and the number of laps at the end), and
+'RunSession' and 'RunDriver' the session and driver codes of each run.
+
+A season of laps takes about 1 MB, and the laps of a driver (get_driver_laps) are views. Times
+in float32 are precise to about a millisecond over a session of several hours.
+"""
+import numpy as np
+
+from constants import *
+from race import get_track_status_flags
+
+# The per-lap entries of a lap table
+LAP_TABLE_COLUMNS = ['Session', 'Driver', 'LapNumber', 'LapTime', 'LapStartTime', 'Compound',
+                     'TyreLife', 'Stint', 'TrackStatus', 'PitIn', 'PitOut', 'IsAccurate']
+
+
+def _to_seconds(column) -> object:
+    """
+    Returns a column of TimeDelta objects (or seconds) in seconds as a numpy.array of float32.
+    """
+    import pandas as pd
+
+    if pd.api.types.is_timedelta64_dtype(column):
+        column = column.dt.total_seconds()
+
+    return column.to_numpy(dtype=np.float32, na_value=np.nan)
+
+
+def _to_integers(column, dtype) -> object:
+    """
+    Returns a numeric column as a numpy.array of integers, with -1 for missing values.
+    """
+    return column.fillna(-1).to_numpy().astype(dtype)
+
+
+def get_lap_table(df) -> dict:
+    """
+    Builds a compact lap table from the laps of one or more sessions.
+
+    :param df: A DataFrame containing laps. Usually this is a fastf1.core.Laps object, or a
+    DataFrame returned by session_store.load_laps (with the columns 'season', 'event' and
+    'session' for the laps of several sessions).
+
+    :return: a dict containing the lap table, see the description of this module, and the entries
+    'Drivers' (a numpy.array of strings) and 'Sessions' (a DataFrame with the columns in
+    SESSION_KEY_COLUMNS, one row per session, or None if df contains a single session).
+    """
+    import pandas as pd
+
+    session_keys = [column for column in SESSION_KEY_COLUMNS if column in df.columns]
+    if session_keys:
+        session_codes, sessions = pd.MultiIndex.from_frame(df[session_keys]).factorize()
+        sessions = sessions.to_frame(index=False, name=session_keys)
+    else:
+        session_codes, sessions = np.zeros(len(df), dtype=np.int64), None
+
+    driver_codes, drivers = pd.factorize(df['Driver'], sort=True)
+    if len(drivers) > np.iinfo(np.int8).max:
+        raise ValueError('A lap table holds at most {} drivers'.format(np.iinfo(np.int8).max))
+
+    if 'PitIn' in df.columns:
+        pit_in, pit_out = df['PitIn'].to_numpy(dtype=bool), df['PitOut'].to_numpy(dtype=bool)
+    else:
+        pit_in = df['PitInTime'].notnull().to_numpy()
+        pit_out = df['PitOutTime'].notnull().to_numpy()
+
+    table = {
+        'Session': session_codes.astype(np.int16),
+        'Driver': driver_codes.astype(np.int8),
+        'LapNumber': _to_integers(df['LapNumber'], np.int16),
+        'LapTime': _to_seconds(df['LapTime']),
+        'LapStartTime': _to_seconds(df['LapStartTime']),
+        'Compound': df['Compound'].map(COMPOUND_CODES).fillna(-1).to_numpy().astype(np.int8),
+        'TyreLife': _to_integers(df['TyreLife'], np.int16),
+        'Stint': _to_integers(df['Stint'], np.int8),
+        'TrackStatus': get_track_status_flags(df),
+        'PitIn': pit_in,
+        'PitOut': pit_out,
+        'IsAccurate': (df['IsAccurate'] == True).to_numpy(),
+    }
+
+    # Sort the laps by session, driver and lap number, and find the runs of each driver.
+    order = np.lexsort((table['LapNumber'], table['Driver'], table['Session']))
+    if np.any(np.diff(order) != 1):
+        table = {column: values[order] for column, values in table.items()}
+
+    starts = np.flatnonzero(np.diff(table['Session'], prepend=-1) |
+                            np.diff(table['Driver'], prepend=-1))
+    table['Offsets'] = np.append(starts, len(order)).astype(np.int64)
+    table['RunSession'] = table['Session'][starts]
+    table['RunDriver'] = table['Driver'][starts]
+    table['Drivers'] = np.asarray(drivers, dtype=str)
+    table['Sessions'] = sessions
+
+    return table
+
+
+def get_driver_run(table: dict, driver: str, session: int = 0) -> slice:
+    """
+    Returns the rows of the laps of a driver in a session.
+
+    :param table: a dict returned by get_lap_table.
+
+    :param driver: a string representing the abbreviation of the driver.
+
+    :param session: an int representing the code of the session, i.e. the row in table['Sessions'].
+
+    :return: a slice of the rows, which is empty if the driver has no laps in the session.
+    """
+    driver_code = np.searchsorted(table['Drivers'], driver)
+    runs = np.flatnonzero((table['RunDriver'] == driver_code) & (table['RunSession'] == session))
+    if driver_code == len(table['Drivers']) or table['Drivers'][driver_code] != driver or \
+            len(runs) == 0:
+        return slice(0, 0)
+
+    return slice(table['Offsets'][runs[0]], table['Offsets'][runs[0] + 1])
+
+
+def get_driver_laps(table: dict, driver: str, session: int = 0) -> dict:
+    """
+    Returns the laps of a driver in a session as a lap table of views (no data is copied).
+
+    :param table: a dict returned by get_lap_table.
+
+    :param driver: a string representing the abbreviation of the driver.
+
+    :param session: an int representing the code of the session, i.e. the row in table['Sessions'].
+
+    :return: a dict containing a lap table with a single run.
+    """
+    rows = get_driver_run(table, driver, session)
+
+    laps = {column: table[column][rows] for column in LAP_TABLE_COLUMNS}
+    laps['Offsets'] = np.array([0, rows.stop - rows.start], dtype=np.int64)
+    laps['RunSession'] = laps['Session'][:1]
+    laps['RunDriver'] = laps['Driver'][:1]
+    laps['Drivers'] = table['Drivers']
+    laps['Sessions'] = table['Sessions']
+
+    return laps
+
+
+def lap_table_to_df(table: dict) -> object:
+    """
+    Returns a DataFrame of a lap table, with the columns used by the analysis functions: strings
+    for drivers, compounds and sessions, seconds for the lap times and NaN for missing values.
+    'TrackStatus' contains the track status flags.
+
+    :param table: a dict returned by get_lap_table.
+
+    :return: a DataFrame, one row per lap, similar to the one returned by session_store.load_laps.
+    """
+    import pandas as pd
+
+    columns = {}
+    if table['Sessions'] is not None:
+        for column in table['Sessions'].columns:
+            columns[column] = table['Sessions'][column].to_numpy()[table['Session']]
+
+    columns['Driver'] = table['Drivers'].astype(object)[table['Driver']]
+    columns['LapNumber'] = np.where(table['LapNumber'] >= 0, table['LapNumber'], np.nan)
+    # Sums of many lap times need double precision.
+    columns['LapTime'] = table['LapTime'].astype(float)
+    columns['LapStartTime'] = table['LapStartTime'].astype(float)
+    # Unknown compounds (code -1) map to the last entry.
+    columns['Compound'] = np.array(TYRES + [np.nan], dtype=object)[table['Compound']]
+    for column in ['TyreLife', 'Stint']:
+        columns[column] = np.where(table[column] >= 0, table[column], np.nan)
+    for column in ['TrackStatus', 'PitIn', 'PitOut', 'IsAccurate']:
+        columns[column] = table[column]
+
+    return pd.DataFrame(columns, copy=False)
+
+
+def get_lap_table_size(table: dict) -> int:
+    """
+    Returns the memory used by the arrays of a lap table, in bytes.
+
+    :param table: a dict returned by get_lap_table.
+    """
+    return sum(values.nbytes for values in table.values() if isinstance(values, np.ndarray))
@@ -0,0 +1,325 @@
+"""
+Contains helper functions for following a practice session lap by lap, e.g. replaying the laps of a
+stored session as a stand-in for live timing, and updating the long run estimates and the optimal
+strategies after every lap.
+
+A live session is a dict holding the state of every driver: the accurate laps of their current
+stint, the length of their longest stint so far, their long run (see
+practice.extract_long_run_pace_all_drivers) and the running statistics of the fit of their long run
+(see race_sim.batch_laptime_model). A new lap only updates the state of its driver, and the long
+run estimates of all drivers are then computed from arrays of one entry per driver, so the time
+per lap does not grow during the session.
+"""
+import numpy as np
+
+from constants import *
+from practice import remove_long_run_outliers
+from race_sim import tyre_degradation_model
+
+
+def start_live_session(quali_df=None, teammates: object = None) -> dict:
+    """
+    Returns the state of a live session before its first lap.
+
+    :param quali_df: a DataFrame containing the fastest laps in qualifying (times_df), returned by
+    qualifying.get_fastest_lap_in_qualifying, ordered by qualifying position, or None if the
+    qualifying has not happened yet. Without qualifying, the long run estimates only use FP2.
+
+    :param teammates: a dict mapping each driver to their teammate (both directions), or a
+    DataFrame returned by prediction.get_teammate_pairs. Defaults to TEAMMATE_PAIRS_DICT (2022).
+
+    :return: a dict containing the state of the session, updated by update_live_session.
+    """
+    if teammates is None:
+        teammates = TEAMMATE_PAIRS_DICT
+    if isinstance(teammates, dict):
+        pairs = list(teammates.items())
+    else:
+        pairs = list(zip(teammates['Driver'], teammates['Teammate']))
+
+    session = {'Drivers': [], 'DriverCodes': {}, 'Stints': [],
+               'FP2MeanLapTime': np.zeros(0), 'LongRunLaps': np.zeros(0, dtype=int),
+               'BaseTime': np.zeros(0), 'BaseTimeVariance': np.zeros(0),
+               'QualifyingLapTime': np.zeros(0), 'QualifyingPosition': np.zeros(0),
+               'HasQualifying': quali_df is not None, 'Laps': 0}
+
+    for driver, teammate in pairs:
+        _get_driver_code(session, driver)
+        _get_driver_code(session, teammate)
+    session['PairDrivers'] = np.array([session['DriverCodes'][driver] for driver, _ in pairs],
+                                      dtype=int)
+    session['PairTeammates'] = np.array([session['DriverCodes'][teammate]
+                                         for _, teammate in pairs], dtype=int)
+
+    if quali_df is not None:
+        for position, (driver, laptime) in enumerate(zip(quali_df['Abbreviation'],
+                                                         quali_df['Fastest Lap'])):
+            code = _get_driver_code(session, driver)
+            session['QualifyingLapTime'][code] = laptime
+            session['QualifyingPosition'][code] = position + 1
+
+    return session
+
+
+def _get_driver_code(session: dict, driver: str) -> int:
+    """
+    Returns the index of a driver in the arrays of a live session, adding the driver if needed.
+    """
+    code = session['DriverCodes'].get(driver)
+    if code is not None:
+        return code
+
+    code = len(session['Drivers'])
+    session['Drivers'].append(driver)
+    session['DriverCodes'][driver] = code
+    session['Stints'].append({'Stint': None, 'LapTimes': [], 'TyreLives': [], 'Compound': None,
+                              'LongestStintLength': 0})
+    for column, value in [('FP2MeanLapTime', np.nan), ('LongRunLaps', 0), ('BaseTime', np.nan),
+                          ('BaseTimeVariance', np.inf), ('QualifyingLapTime', np.nan),
+                          ('QualifyingPosition', np.nan)]:
+        session[column] = np.append(session[column], value)
+
+    return code
+
+
+def update_live_session(session: dict, driver: str, stint: float, compound: str,
+                        tyre_life: float, laptime: float, is_accurate: bool) -> bool:
+    """
+    Adds a lap to a live session, and updates the long run of its driver if the lap extends their
+    longest stint.
+
+    As in practice.extract_long_run_pace_all_drivers, only accurate laps count, the longest stint
+    is the one with the most accurate laps (the later one if two are the same length), and its
+    slow laps are removed with practice.remove_long_run_outliers.
+
+    :param session: a dict returned by start_live_session.
+
+    :param driver: a string representing the driver.
+
+    :param stint: a number representing the stint of the lap.
+
+    :param compound: a string representing the compound of the lap.
+
+    :param tyre_life: a number representing the tyre life of the lap.
+
+    :param laptime: a float representing the lap time in seconds.
+
+    :param is_accurate: a bool indicating whether the lap is accurate, see fastf1.core.Laps.
+
+    :return: a bool indicating whether the long run of the driver changed.
+    """
+    session['Laps'] += 1
+    # Like the IsAccurate == True filter of practice.extract_long_run_pace_all_drivers, a missing
+    # value (None, NaN or pandas.NA) is not accurate, although NaN is truthy.
+    if not (is_accurate is True or is_accurate is np.True_):
+        return False
+
+    code = _get_driver_code(session, driver)
+    state = session['Stints'][code]
+    if stint != state['Stint']:
+        state.update(Stint=stint, LapTimes=[], TyreLives=[], Compound=compound)
+    state['LapTimes'].append(laptime)
+    state['TyreLives'].append(tyre_life)
+
+    # The current stint only grows, so it becomes the longest stint as soon as it is as long.
+    if len(state['LapTimes']) < state['LongestStintLength']:
+        return False
+    state['LongestStintLength'] = len(state['LapTimes'])
+
+    laptimes = np.array(state['LapTimes'], dtype=float)
+    kept = remove_long_run_outliers(laptimes)
+    laptimes = laptimes[kept]
+    session['FP2MeanLapTime'][code] = sum(laptimes.tolist()) / len(laptimes)
+    session['LongRunLaps'][code] = len(laptimes)
+
+    # The running statistics of the fit of race_sim.laptime_model, with a fixed tyre curve.
+    if len(laptimes) > 2:
+        tyre_lives = np.array(state['TyreLives'], dtype=float)[kept]
+        residuals = laptimes - tyre_degradation_model(tyre_lives, MEDIUM)
+        session['BaseTime'][code] = residuals.mean()
+        session['BaseTimeVariance'][code] = residuals.var(ddof=1) / len(residuals)
+    else:
+        session['BaseTime'][code] = np.nan
+        session['BaseTimeVariance'][code] = np.inf
+
+    return True
+
+
+def get_live_estimates(session: dict) -> object:
+    """
+    Returns the teammate head-to-head comparison and the long run estimate of each driver after
+    the laps so far, computed the same way as prediction.get_head_to_head_df.
+
+    :param session: a dict returned by start_live_session.
+
+    :return: a DataFrame with the columns of prediction.get_head_to_head_df, sorted by the long run
+    estimate.
+    """
+    import pandas as pd
+
+    drivers, teammates = session['PairDrivers'], session['PairTeammates']
+    mean_laptimes = session['FP2MeanLapTime']
+    quali_laptimes = session['QualifyingLapTime']
+    has_long_run = session['LongRunLaps'] > 0
+
+    fp2_median = np.median(mean_laptimes[has_long_run]) if np.any(has_long_run) else np.nan
+    with np.errstate(invalid='ignore'):
+        good_fp2 = (mean_laptimes[drivers] - mean_laptimes[teammates] < TEAMMATE_MAX_GAP_SECOND) & \
+            (mean_laptimes[drivers] < fp2_median * FP2_MAX_GAP_PERCENTAGE) & \
+            (session['LongRunLaps'][drivers] >= 3)
+        good_quali = \
+            (quali_laptimes[drivers] - quali_laptimes[teammates] < TEAMMATE_MAX_GAP_SECOND) & \
+            (quali_laptimes[drivers] < np.nanmin(quali_laptimes, initial=np.inf) *
+             QUALIFYING_MAX_GAP_PERCENTAGE)
+
+    base_times = np.nan_to_num(session['BaseTime'], nan=10000)
+    base_time = base_times[drivers]
+    min_fp2_time = base_time.min(initial=np.inf)
+    fp2_gap = np.minimum(base_time - min_fp2_time, MAX_GAP_VALUE)
+
+    # Drivers of a pair whose teammate has no row (i.e. no pair of their own) have no teammate
+    # base time.
+    has_row = np.zeros(len(session['Drivers']), dtype=bool)
+    has_row[drivers] = True
+    teammate_base_time = np.where(has_row[teammates], base_times[teammates], np.nan)
+    teammate_fp2_gap = np.minimum(teammate_base_time - min_fp2_time + 1, MAX_GAP_VALUE)
+
+    gf, gq = good_fp2.astype(float), good_quali.astype(float)
+    if session['HasQualifying']:
+        quali_time = quali_laptimes[drivers]
+        min_q_time = np.nanmin(quali_time) if np.any(np.isfinite(quali_time)) else np.nan
+        quali_gap = np.minimum(quali_time - min_q_time, MAX_GAP_VALUE)
+        teammate_quali_gap = np.minimum(teammate_base_time - min_q_time + 1, MAX_GAP_VALUE)
+
+        long_run_estimate = min_fp2_time + gf * (1 - 0.5 * gq) * fp2_gap + \
+            gq * (1 - 0.5 * gf) * quali_gap
+        teammate_long_run_estimate = min_fp2_time + \
+            (1 - 0.5 * (teammate_quali_gap < 10)) * teammate_fp2_gap + \
+            gq * (1 - 0.5 * (teammate_fp2_gap < 10)) * teammate_quali_gap
+    else:
+        long_run_estimate = min_fp2_time + gf * fp2_gap
+        teammate_long_run_estimate = min_fp2_time + teammate_fp2_gap
+
+    names = np.array(session['Drivers'], dtype=object)
+    estimates = pd.DataFrame({
+        'Driver': names[drivers], 'GoodFP2': good_fp2, 'GoodQualifying': good_quali,
+        'Teammate': names[teammates],
+        'FP2MeanLapTime': mean_laptimes[drivers].round(3),
+        'TeammateFP2MeanLapTime': mean_laptimes[teammates].round(3),
+        'QualifyingLapTime': quali_laptimes[drivers],
+        'TeammateQualifyingLapTime': quali_laptimes[teammates],
+        'QualifyingPosition': session['QualifyingPosition'][drivers],
+        'TeammateQualifyingPosition': session['QualifyingPosition'][teammates],
+        'BaseTime': base_time, 'BaseTimeVariance': session['BaseTimeVariance'][drivers],
+        'LongRunEstimate': np.where(good_fp2 | good_quali, long_run_estimate,
+                                    teammate_long_run_estimate)})
+
+    # Drivers with the same estimate are ordered by their qualifying position.
+    return estimates.sort_values('QualifyingPosition', kind='stable') \
+        .sort_values('LongRunEstimate', kind='stable').reset_index(drop=True)
+
+
+def get_live_strategies(session: dict, estimates, driver_tyre_data, strategy_parameters: dict,
+                        max_stops: int = 2, top_k: int = 3) -> object:
+    """
+    Returns the fastest strategies of each driver with a long run estimate.
+
+    The long run estimate of a driver adds the same time to all their strategies, so it does not
+    change which strategies are the fastest. The strategies are thus only optimized (see
+    strategy.get_optimal_strategies_cached) when the drivers or their deg factors change, and kept
+    in the session. After each lap, only the race times are updated.
+
+    :param session: a dict returned by start_live_session.
+
+    :param estimates: a DataFrame returned by get_live_estimates.
+
+    :param driver_tyre_data: a DataFrame containing the columns 'Driver', 'SoftDegFactor',
+    'MediumDegFactor' and 'HardDegFactor', e.g. returned by driver_stats.get_deg_factors. Drivers
+    who are missing, or have no deg factor on a compound, degrade their tyres like the average.
+
+    :param strategy_parameters: a dict with the keys 'no_of_laps', 'in_lap', 'out_lap',
+    'start_time' and optionally 'dry_compounds' and 'min_dry_compounds', e.g. returned by
+    tracks.get_strategy_parameters.
+
+    :return: a DataFrame like strategy.get_optimal_strategies.
+    """
+    columns = [compound.title() + 'DegFactor' for compound in DRY_TYRES]
+    estimates = estimates[np.isfinite(estimates['LongRunEstimate'].to_numpy())]
+    deg_factors = driver_tyre_data.set_index('Driver')[columns] \
+        .reindex(np.sort(estimates['Driver'].to_numpy())).fillna(1)
+
+    key = (tuple(deg_factors.index), tuple(deg_factors.to_numpy().ravel().tolist()),
+           tuple(sorted(strategy_parameters.items())), max_stops, top_k)
+    if session.get('StrategiesKey') != key:
+        from strategy import get_optimal_strategies_cached
+
+        tyre_data = deg_factors.reset_index().assign(LongRunEstimate=0.0)
+        session['Strategies'] = get_optimal_strategies_cached(
+            tyre_data, max_stops=max_stops, top_k=top_k, **strategy_parameters)
+        session['StrategiesKey'] = key
+
+    strategies = session['Strategies'].copy()
+    long_run_estimates = estimates.set_index('Driver')['LongRunEstimate']
+    strategies['RaceTime'] += strategies['Driver'].map(long_run_estimates).to_numpy() * \
+        strategy_parameters['no_of_laps']
+
+    return strategies
+
+
+def replay_session(laps, quali_df=None, teammates: object = None, driver_tyre_data=None,
+                   strategy_parameters: dict = None):
+    """
+    Replays the laps of a practice session one at a time, in the order they were completed, and
+    yields the updated predictions after each lap.
+
+    :param laps: A DataFrame containing the laps of a session. Usually this is a DataFrame returned
+    by session_store.load_laps (e.g. with sessions=['FP2']), or a fastf1.core.Laps object.
+
+    :param quali_df: see start_live_session.
+
+    :param teammates: see start_live_session. Defaults to the teams of the laps if they have a
+    'Team' column.
+
+    :param driver_tyre_data: see get_live_strategies, or None to skip the strategies.
+
+    :param strategy_parameters: see get_live_strategies, or None to skip the strategies.
+
+    :return: a generator of tuples containing the lap (a namedtuple), the estimates returned by
+    get_live_estimates and the strategies returned by get_live_strategies (or None). The estimates
+    and strategies are only recomputed when a long run changed.
+    """
+    import pandas as pd
+
+    if teammates is None and 'Team' in laps.columns:
+        from prediction import get_teammate_pairs
+
+        teammates = get_teammate_pairs(laps)
+
+    laptimes = laps['LapTime']
+    start_times = laps['LapStartTime']
+    if pd.api.types.is_timedelta64_dtype(laptimes):
+        laptimes = laptimes.dt.total_seconds()
+    if pd.api.types.is_timedelta64_dtype(start_times):
+        start_times = start_times.dt.total_seconds()
+
+    # Live timing publishes a lap when it is completed.
+    laps = pd.DataFrame({'Driver': laps['Driver'].to_numpy(), 'Stint': laps['Stint'].to_numpy(),
+                         'Compound': laps['Compound'].to_numpy(),
+                         'TyreLife': laps['TyreLife'].to_numpy(),
+                         'LapTime': laptimes.to_numpy(dtype=float),
+                         'IsAccurate': laps['IsAccurate'].to_numpy(),
+                         'CompletedTime': (start_times + laptimes.fillna(0)).to_numpy(dtype=float)})
+    laps = laps.sort_values('CompletedTime', kind='stable')
+
+    session = start_live_session(quali_df, teammates)
+    estimates = get_live_estimates(session)
+    strategies = None
+    for lap in laps.itertuples(index=False):
+        if update_live_session(session, lap.Driver, lap.Stint, lap.Compound, lap.TyreLife,
+                               lap.LapTime, lap.IsAccurate):
+            estimates = get_live_estimates(session)
+            if driver_tyre_data is not None and strategy_parameters is not None:
+                strategies = get_live_strategies(session, estimates, driver_tyre_data,
+                                                 strategy_parameters)
+
+        yield lap, estimates, strategies
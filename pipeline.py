@@ -0,0 +1,426 @@
+"""
+Runs the predictions of a race weekend end to end, without Jupyter: loading the sessions, the
+qualifying and FP2 analysis, the teammate head-to-head, the strategy optimization, the robustness
+of the strategies and the race simulation.
+
+Usage, from the root of the project:
+    python pipeline.py 2022 13 [--out-dir weekends] [--cache-dir cache] [--races 1000] [--seed 0]
+    python pipeline.py 2022 13 --stages h2h strategy simulation --force
+    python pipeline.py 2022 13 --force --profile trace.json [--profile-memory]
+
+Each stage writes its results (artifacts) to Feather files in <out-dir>/<season>_<round>, and
+records a fingerprint of its parameters and input artifacts in manifest.json. A stage is skipped
+when its fingerprint has not changed since its last run and its artifacts exist, so rerunning the
+pipeline after changing e.g. the number of simulated races only reruns the simulation. The loaded
+sessions only change with the season and round, use --refresh to load them again. The simulated
+races are kept in a results store in <out-dir>/<season>_<round>/results (see results_store.py).
+
+With --profile, the stages and the functions they call are profiled (see profiling.py): a summary
+table is printed and the calls are written to a Chrome trace.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+import warnings
+
+from constants import *
+from profiling import PROFILED_MODULES, profile_span
+
+# The name of the file recording the fingerprint of each stage
+MANIFEST_FILE = 'manifest.json'
+
+# The modules profiled with --profile
+PIPELINE_PROFILED_MODULES = PROFILED_MODULES + ['ingest', 'driver_stats', 'strategy',
+                                                'race_engine']
+
+# Maps the name of each stage to a dict with its function, its input and output artifacts, the
+# command line options and the other files it depends on, in the order the stages run.
+STAGES = {}
+
+
+def stage(name: str, inputs: list, outputs: list, options: list = (), files: list = ()):
+    """
+    Registers a stage under a name.
+
+    :param inputs: a list of strings representing the artifacts read by the stage.
+
+    :param outputs: a list of strings representing the artifacts written by the stage.
+
+    :param options: a list of strings representing the command line options the results depend on.
+
+    :param files: a list of strings representing the paths of other files read by the stage, e.g.
+    TRACK_REGISTRY_FILE. The stage reruns when one of them changes, appears or is deleted.
+    """
+    def register(function):
+        STAGES[name] = {'function': function, 'inputs': list(inputs), 'outputs': list(outputs),
+                        'options': list(options), 'files': list(files)}
+        return function
+
+    return register
+
+
+def get_weekend_dir(out_dir: str, season: int, round_number: int) -> str:
+    """
+    Returns the folder of the artifacts of a weekend.
+    """
+    return os.path.join(out_dir, '{}_{:02d}'.format(season, round_number))
+
+
+def get_artifact_path(weekend_dir: str, artifact: str) -> str:
+    """
+    Returns the path of the Feather file of an artifact.
+    """
+    return os.path.join(weekend_dir, artifact + '.feather')
+
+
+def _get_file_hash(path: str) -> str:
+    """
+    Returns the SHA-256 hash of the content of a file.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def get_stage_fingerprint(name: str, weekend_dir: str, args) -> str:
+    """
+    Returns the fingerprint of a stage: a hash of its name, the values of its options and the
+    content of its input artifacts and other files.
+
+    :param name: a string representing the stage, a key of STAGES.
+
+    :param weekend_dir: a string representing the folder of the artifacts of the weekend.
+
+    :param args: the argparse.Namespace of the command line options.
+
+    :return: a string, or None if an input artifact is missing.
+    """
+    stage_info = STAGES[name]
+    paths = [get_artifact_path(weekend_dir, artifact) for artifact in stage_info['inputs']]
+    if not all(os.path.exists(path) for path in paths):
+        return None
+
+    fingerprint = {'stage': name,
+                   'options': {option: getattr(args, option) for option in stage_info['options']},
+                   'inputs': [_get_file_hash(path) for path in paths],
+                   'files': [_get_file_hash(path) if os.path.exists(path) else None
+                             for path in stage_info['files']]}
+
+    return hashlib.sha256(json.dumps(fingerprint, sort_keys=True).encode()).hexdigest()
+
+
+def read_artifacts(weekend_dir: str, artifacts: list) -> dict:
+    """
+    Reads artifacts of a weekend.
+
+    :return: a dict mapping each artifact to a DataFrame.
+    """
+    import pandas as pd
+
+    return {artifact: pd.read_feather(get_artifact_path(weekend_dir, artifact))
+            for artifact in artifacts}
+
+
+def write_artifacts(weekend_dir: str, artifacts: dict) -> None:
+    """
+    Writes artifacts of a weekend. Each file is written under a temporary name and then renamed, so
+    an interrupted run never leaves a partial artifact.
+
+    :param artifacts: a dict mapping each artifact to a DataFrame.
+    """
+    for artifact, df in artifacts.items():
+        path = get_artifact_path(weekend_dir, artifact)
+        df.reset_index(drop=True).to_feather(path + '.tmp')
+        os.replace(path + '.tmp', path)
+
+
+@stage('load', inputs=[], outputs=['weekend', 'race_laps', 'fp2_laps', 'qualifying_results'],
+       options=['season', 'round'])
+def load_weekend(artifacts: dict, args) -> dict:
+    """
+    Loads the races of the season before the weekend, FP2 and the qualifying results.
+    """
+    import fastf1 as ff1
+    import pandas as pd
+
+    from config import enable_cache
+    from ingest import load_sessions
+
+    keys = [(args.season, grand_prix_number, 'R') for grand_prix_number in range(1, args.round)]
+    laps = load_sessions(keys + [(args.season, args.round, 'FP2')], args.cache_dir,
+                         args.processes, args.offline)
+    fp2 = laps['session'] == SESSION_NAMES['Practice 2']
+
+    enable_cache(args.cache_dir)
+    if args.offline:
+        ff1.Cache.offline_mode(True)
+    qualifying = ff1.get_session(args.season, args.round, 'Q')
+    qualifying.load(laps=False, telemetry=False, weather=False, messages=False)
+
+    weekend = pd.DataFrame({'Season': [args.season], 'Round': [args.round],
+                            'Event': [qualifying.event['EventName']]})
+
+    return {'weekend': weekend, 'race_laps': laps[~fp2], 'fp2_laps': laps[fp2],
+            'qualifying_results': pd.DataFrame(qualifying.results[['Abbreviation'] +
+                                                                  QUALIFYING_SESSIONS])}
+
+
+@stage('qualifying', inputs=['qualifying_results'], outputs=['times'])
+def analyse_qualifying(artifacts: dict, args) -> dict:
+    """
+    Finds the fastest laps of each driver in qualifying.
+    """
+    from qualifying import get_fastest_lap_in_qualifying
+
+    return {'times': get_fastest_lap_in_qualifying(artifacts['qualifying_results'])}
+
+
+@stage('fp2', inputs=['fp2_laps'], outputs=['fp2_race_sim'])
+def analyse_fp2(artifacts: dict, args) -> dict:
+    """
+    Extracts the long run pace of each driver in FP2.
+    """
+    from practice import get_long_run_pace_df
+
+    return {'fp2_race_sim': get_long_run_pace_df(artifacts['fp2_laps'])}
+
+
+@stage('driver_stats', inputs=['race_laps', 'fp2_laps'],
+       outputs=['driver_stats', 'deg_factors', 'deg_factor_variances'])
+def analyse_driver_stats(artifacts: dict, args) -> dict:
+    """
+    Computes the season statistics and deg factors of each driver from the previous races, or
+    from FP2 at the first race of the season.
+    """
+    from driver_stats import get_deg_factor_variances, get_deg_factors, get_driver_moments, \
+        get_driver_stats_df
+
+    laps = artifacts['race_laps'] if len(artifacts['race_laps']) > 0 else artifacts['fp2_laps']
+    driver_stats_df = get_driver_stats_df(get_driver_moments(laps))
+
+    return {'driver_stats': driver_stats_df, 'deg_factors': get_deg_factors(driver_stats_df),
+            'deg_factor_variances': get_deg_factor_variances(driver_stats_df)}
+
+
+@stage('h2h', inputs=['fp2_race_sim', 'times', 'fp2_laps'], outputs=['h2h'])
+def analyse_head_to_head(artifacts: dict, args) -> dict:
+    """
+    Compares the teammates of the weekend and estimates the race pace of each driver.
+    """
+    from prediction import get_head_to_head_df, get_teammate_pairs
+
+    teammates = get_teammate_pairs(artifacts['fp2_laps'])
+
+    return {'h2h': get_head_to_head_df(artifacts['fp2_race_sim'], artifacts['times'], teammates)}
+
+
+def get_track_parameters(weekend, simulation: bool) -> dict:
+    """
+    Returns the parameters of the track of the weekend from the track registry, or the defaults
+    if the track is not in the registry.
+    """
+    from tracks import build_track_registry, get_simulation_parameters, get_strategy_parameters, \
+        load_track_registry
+
+    registry = load_track_registry()
+    event = weekend['Event'].iloc[0]
+    if event not in registry['Track']:
+        warnings.warn('{} is not in the track registry, using the default parameters'
+                      .format(event))
+        event = next(iter(DEFAULT_TRACK_PARAMETERS))
+        registry = build_track_registry(DEFAULT_TRACK_PARAMETERS)
+
+    if simulation:
+        return get_simulation_parameters(registry, event)
+
+    return get_strategy_parameters(registry, event)
+
+
+@stage('strategy', inputs=['weekend', 'deg_factors', 'h2h'],
+       outputs=['driver_tyre_data', 'strategies'], options=['max_stops', 'top_k'],
+       files=[TRACK_REGISTRY_FILE])
+def optimize_strategies(artifacts: dict, args) -> dict:
+    """
+    Finds the fastest strategies of each driver at the track of the weekend.
+    """
+    from strategy import get_optimal_strategies
+
+    # Drivers without a stint on a compound degrade their tyres like the average driver.
+    driver_tyre_data = artifacts['deg_factors'].fillna(1).merge(
+        artifacts['h2h'][['Driver', 'LongRunEstimate', 'QualifyingPosition']], on='Driver')
+    strategies = get_optimal_strategies(driver_tyre_data.drop(columns='QualifyingPosition'),
+                                        max_stops=args.max_stops, top_k=args.top_k,
+                                        **get_track_parameters(artifacts['weekend'], False))
+
+    return {'driver_tyre_data': driver_tyre_data, 'strategies': strategies}
+
+
+@stage('robustness', inputs=['weekend', 'driver_tyre_data', 'deg_factor_variances', 'h2h',
+                            'strategies'],
+       outputs=['strategy_robustness'], options=['samples', 'seed'], files=[TRACK_REGISTRY_FILE])
+def score_strategies(artifacts: dict, args) -> dict:
+    """
+    Scores the fastest strategies of each driver under the uncertainty of their deg factors and
+    base time.
+    """
+    from strategy import get_strategy_robustness
+
+    driver_tyre_data = artifacts['driver_tyre_data'] \
+        .merge(artifacts['deg_factor_variances'], on='Driver', how='left') \
+        .merge(artifacts['h2h'].filter(['Driver', 'BaseTimeVariance']), on='Driver', how='left')
+    # The compound rules only restrict the candidate strategies, which are already chosen.
+    track_parameters = get_track_parameters(artifacts['weekend'], False)
+    robustness = get_strategy_robustness(artifacts['strategies'], driver_tyre_data,
+                                         no_of_samples=args.samples, seed=args.seed,
+                                         **{key: track_parameters[key] for key in
+                                            ['no_of_laps', 'in_lap', 'out_lap', 'start_time']})
+
+    return {'strategy_robustness': robustness}
+
+
+@stage('simulation', inputs=['weekend', 'driver_tyre_data', 'strategies'],
+       outputs=['finishing_positions', 'race_time_quantiles'], options=['races', 'seed'],
+       files=[TRACK_REGISTRY_FILE])
+def simulate_weekend(artifacts: dict, args) -> dict:
+    """
+    Simulates the race from the qualifying positions with the fastest strategies. The races are
+    written to a results store in the folder of the weekend (see results_store.py), so any number
+    of races fits in memory, and the store can be queried after the run.
+    """
+    import shutil
+
+    from race_engine import get_race_setup
+    from results_store import get_position_distribution, get_race_time_quantiles, \
+        simulate_races_to_store
+
+    race_data = artifacts['driver_tyre_data'].rename(columns={'QualifyingPosition': 'GridPosition'})
+    race_setup = get_race_setup(race_data, artifacts['strategies'],
+                                **get_track_parameters(artifacts['weekend'], True))
+
+    # The races of the previous run are replaced.
+    store_dir = os.path.join(get_weekend_dir(args.out_dir, args.season, args.round),
+                             RESULTS_STORE_DIRECTORY)
+    shutil.rmtree(store_dir, ignore_errors=True)
+    simulate_races_to_store(race_setup, store_dir, args.races, args.seed, args.processes,
+                            parameters={'season': args.season, 'round': args.round})
+
+    distribution = get_position_distribution(store_dir)
+    distribution.columns = [str(column) for column in distribution.columns]
+    quantiles = get_race_time_quantiles(store_dir)
+    quantiles.columns = [str(column) for column in quantiles.columns]
+
+    return {'finishing_positions': distribution.reset_index(),
+            'race_time_quantiles': quantiles.reset_index()}
+
+
+def run_pipeline(args) -> dict:
+    """
+    Runs the stages of a weekend, skipping the stages whose inputs have not changed.
+
+    :param args: the argparse.Namespace of the command line options.
+
+    :return: a dict mapping each stage to 'ran', 'skipped' or 'not selected'.
+    """
+    weekend_dir = get_weekend_dir(args.out_dir, args.season, args.round)
+    os.makedirs(weekend_dir, exist_ok=True)
+
+    manifest_path = os.path.join(weekend_dir, MANIFEST_FILE)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as file:
+            manifest = json.load(file)
+
+    statuses = {}
+    for name, stage_info in STAGES.items():
+        fingerprint = get_stage_fingerprint(name, weekend_dir, args)
+        outputs_exist = all(os.path.exists(get_artifact_path(weekend_dir, artifact))
+                            for artifact in stage_info['outputs'])
+        if args.stages is not None and name not in args.stages:
+            statuses[name] = 'not selected'
+            continue
+
+        if fingerprint is None:
+            raise FileNotFoundError('The inputs of the stage {} are missing, run the stages '
+                                    'before it first'.format(name))
+
+        forced = args.force or (name == 'load' and args.refresh)
+        if not forced and outputs_exist and manifest.get(name) == fingerprint:
+            statuses[name] = 'skipped'
+            print('{:<16}skipped'.format(name))
+            continue
+
+        start = time.perf_counter()
+        artifacts = read_artifacts(weekend_dir, stage_info['inputs'])
+        with profile_span('stage.' + name, sum(len(df) for df in artifacts.values())):
+            outputs = stage_info['function'](artifacts, args)
+        write_artifacts(weekend_dir, outputs)
+
+        manifest[name] = fingerprint
+        with open(manifest_path, 'w') as file:
+            json.dump(manifest, file, indent=2)
+
+        statuses[name] = 'ran'
+        print('{:<16}ran in {:.2f} s'.format(name, time.perf_counter() - start))
+
+    return statuses
+
+
+def get_parser() -> argparse.ArgumentParser:
+    """
+    Returns the parser of the command line options of the pipeline.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('season', type=int)
+    parser.add_argument('round', type=int, help='the round of the weekend in the season')
+    parser.add_argument('--out-dir', default='weekends',
+                        help='the folder of the artifacts of each weekend')
+    parser.add_argument('--cache-dir', help='the folder of the FastF1 cache')
+    parser.add_argument('--offline', action='store_true', help='only use the FastF1 cache')
+    parser.add_argument('--processes', type=int,
+                        help='the number of worker processes, 1 to run in this process')
+    parser.add_argument('--max-stops', type=int, default=2)
+    parser.add_argument('--top-k', type=int, default=3)
+    parser.add_argument('--samples', type=int, default=2000,
+                        help='the number of parameter samples scoring the strategies')
+    parser.add_argument('--races', type=int, default=1000, help='the number of simulated races')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES),
+                        help='only run these stages (if their inputs have changed)')
+    parser.add_argument('--force', action='store_true',
+                        help='run the stages even if their inputs have not changed')
+    parser.add_argument('--refresh', action='store_true', help='load the sessions again')
+    parser.add_argument('--profile', metavar='TRACE',
+                        help='profile the stages and write a Chrome trace to this JSON file')
+    parser.add_argument('--profile-memory', action='store_true',
+                        help='record the peak memory of each call as well (slower)')
+
+    return parser
+
+
+def main() -> int:
+    args = get_parser().parse_args()
+    if args.profile is None:
+        run_pipeline(args)
+        return 0
+
+    from profiling import disable_profiling, enable_profiling, print_profile_summary, write_trace
+
+    enable_profiling(PIPELINE_PROFILED_MODULES, memory=args.profile_memory)
+    try:
+        run_pipeline(args)
+    finally:
+        disable_profiling()
+        print_profile_summary()
+        write_trace(args.profile)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
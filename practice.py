@@ -1,20 +1,24 @@
 """
 Contains helper functions for analysing race data in notebook.
 """
-import fastf1 as ff1
+from math import comb
+
 import pandas as pd
-from matplotlib import pyplot as plt
 import numpy as np
 from constants import *
-from scipy import stats
-import matplotlib.patches as mpatches
 
-# Enable the cache by providing the name of the cache folder
-from race import convert_laptime_to_seconds, get_all_driver_names
-ff1.Cache.enable_cache('cache')
+from driver_stats import get_representative_laps_mask
+from race import convert_laptime_to_seconds
+
+# The columns of the coefficients of the tyre models, from the highest power of the tyre life to the
+# constant, as in numpy.polyfit
+TYRE_MODEL_COEFFICIENT_COLUMNS = ['C{}'.format(power)
+                                  for power in range(TYRE_DEGRADATION_REGRESSION_DEGREE, -1, -1)]
 
 
 def remove_outlier_laps(df):
+    from scipy import stats
+
     df.loc[(np.abs(stats.zscore(df.LapTime)) >= 1), "LapTime"] = np.NaN
 
 
@@ -34,6 +38,9 @@ def get_tyre_model(df):
 
 def plot_tyre_model(df, model=None, axes=None, size=None, row=0, column=0, color='#1f77b4',
                     remove_outlier=True):
+    from matplotlib import pyplot as plt
+    from scipy import stats
+
     # Get the range of the regression line wanted
     m = df.TyreLife.min()
     M = df.TyreLife.max()
@@ -81,6 +88,8 @@ def get_number_of_valid_laps(df):
 
 
 def plot_dry_tyre_models_all_drivers(df, drivers):
+    from matplotlib import pyplot as plt
+
     # Make a subplot
     fig, axs = plt.subplots(len(drivers), 3)
     fig.suptitle('Long Run Race Pace')
@@ -116,6 +125,128 @@ def plot_dry_tyre_models_all_drivers(df, drivers):
                     axs[i, j].title.set_text(drivers[i])
 
 
+def get_tyre_model_laps(df, drivers: list = None) -> object:
+    """
+    Returns the representative laps of each driver on each dry compound, with the outliers marked
+    the same way as in plot_dry_tyre_models_all_drivers, after filtering the session once.
+
+    Laps whose lap time is at least one standard deviation away from the mean of the driver and
+    compound are outliers. As with scipy.stats.zscore, a missing lap time makes every z-score of
+    the group missing, so no lap of the group is an outlier.
+
+    :param df: A DataFrame containing data of a session. Usually this is a fastf1.core.Laps object,
+    a DataFrame returned by session_store.load_laps, or a lap table. It is not changed.
+
+    :param drivers: a list of strings representing the drivers, or None for all drivers.
+
+    :return: a DataFrame with the columns 'Driver', 'Compound', 'TyreLife', 'LapTime' (seconds),
+    'Outlier' and 'Fit' (whether the lap is used to fit the tyre model, i.e. it has a lap time and
+    is not an outlier, unless the driver has 4 laps or fewer with a lap time on the compound), in
+    the order of the laps in df.
+    """
+    if isinstance(df, dict):
+        from lap_table import lap_table_to_df
+
+        df = lap_table_to_df(df)
+
+    laptimes = df['LapTime']
+    if pd.api.types.is_timedelta64_dtype(laptimes):
+        laptimes = laptimes.dt.total_seconds()
+
+    laps = pd.DataFrame({'Driver': df['Driver'], 'Compound': df['Compound'],
+                         'TyreLife': df['TyreLife'].astype(float),
+                         'LapTime': laptimes.astype(float)})
+    mask = get_representative_laps_mask(df) & laps['Compound'].isin(DRY_TYRES)
+    if drivers is not None:
+        mask &= laps['Driver'].isin(drivers)
+    laps = laps[mask]
+
+    grouped = laps.groupby(['Driver', 'Compound'], sort=False)['LapTime']
+    valid_laps = grouped.transform('count')
+    with np.errstate(invalid='ignore', divide='ignore'):
+        z_scores = (laps['LapTime'] - grouped.transform('mean')) / grouped.transform('std', ddof=0)
+    z_scores[valid_laps < grouped.transform('size')] = np.nan
+
+    laps['Outlier'] = np.abs(z_scores) >= 1
+    laps['Fit'] = laps['LapTime'].notnull() & ~(laps['Outlier'] & (valid_laps > 4))
+
+    return laps.reset_index(drop=True)
+
+
+def get_tyre_model_table(df, drivers: list = None, laps: object = None) -> object:
+    """
+    Fits the tyre model (a polynomial of degree TYRE_DEGRADATION_REGRESSION_DEGREE of the lap time
+    in the tyre life) of every driver on every dry compound at once, with the same laps, outliers
+    and lap count thresholds as plot_dry_tyre_models_all_drivers, without plotting.
+
+    All the least squares fits are solved together from the sums of the powers of the tyre life of
+    each driver and compound (the normal equations). The tyre lives are centred and scaled for
+    each fit, so the equations are well conditioned.
+
+    :param df: A DataFrame containing data of a session, see get_tyre_model_laps. Not used if laps
+    is given.
+
+    :param drivers: a list of strings representing the drivers, or None for all drivers.
+
+    :param laps: a DataFrame returned by get_tyre_model_laps, or None.
+
+    :return: a DataFrame indexed by ('Driver', 'Compound'), one row per driver and compound with
+    representative laps, with the columns 'Laps', 'ValidLaps' (the laps with a lap time),
+    'FitLaps' (the laps used for the fit), 'Fitted' (whether there are more than 3 laps to fit)
+    and the coefficients in TYRE_MODEL_COEFFICIENT_COLUMNS (NaN if not fitted), e.g.
+    np.poly1d(table.loc[('VER', 'SOFT'), TYRE_MODEL_COEFFICIENT_COLUMNS]) is the model of VER on
+    softs.
+    """
+    laps = get_tyre_model_laps(df, drivers) if laps is None else laps
+    degree = TYRE_DEGRADATION_REGRESSION_DEGREE
+
+    grouped = laps.groupby(['Driver', 'Compound'], sort=False)
+    group_codes = grouped.ngroup().to_numpy()
+    no_of_groups = grouped.ngroups
+
+    def group_sum(weights) -> object:
+        return np.bincount(group_codes, weights=weights, minlength=no_of_groups)
+
+    fit = laps['Fit'].to_numpy() & np.isfinite(laps['TyreLife'].to_numpy())
+    fit_laps = group_sum(fit)
+    tyre_life = np.where(fit, laps['TyreLife'].to_numpy(), 0)
+    laptimes = np.where(fit, laps['LapTime'].to_numpy(), 0)
+
+    # Centre and scale the tyre lives of each fit to [-1, 1].
+    centre = group_sum(tyre_life) / np.maximum(fit_laps, 1)
+    deviations = np.where(fit, tyre_life - centre[group_codes], 0)
+    scale = np.zeros(no_of_groups)
+    np.maximum.at(scale, group_codes, np.abs(deviations))
+    scale[scale == 0] = 1
+    x = deviations / scale[group_codes]
+
+    # The sums of the powers of x, and of the lap times times the powers of x, of each fit.
+    powers = x[:, None] ** np.arange(2 * degree + 1) * fit[:, None]
+    power_sums = np.stack([group_sum(powers[:, k]) for k in range(2 * degree + 1)], axis=1)
+    moments = np.stack([group_sum(powers[:, k] * laptimes) for k in range(degree + 1)], axis=1)
+
+    # Solve the normal equations of all fits at once. The pseudo-inverse gives the minimum norm
+    # solution when the tyre lives cannot determine every coefficient, like numpy.polyfit.
+    gram = power_sums[:, np.add.outer(np.arange(degree + 1), np.arange(degree + 1))]
+    scaled_coefficients = (np.linalg.pinv(gram) @ moments[:, :, None])[:, :, 0]
+
+    # Expand the polynomials of (tyre life - centre) / scale into powers of the tyre life.
+    coefficients = np.zeros((no_of_groups, degree + 1))
+    for k in range(degree + 1):
+        for j in range(k + 1):
+            coefficients[:, j] += scaled_coefficients[:, k] * comb(k, j) * \
+                (-centre) ** (k - j) / scale ** k
+
+    table = pd.DataFrame({'Laps': grouped.size(), 'ValidLaps': grouped['LapTime'].count(),
+                          'FitLaps': grouped['Fit'].sum()})
+    table['Fitted'] = table['FitLaps'] > 3
+    # The coefficients are ordered from the highest power, as in numpy.polyfit.
+    table[TYRE_MODEL_COEFFICIENT_COLUMNS] = np.where(table['Fitted'].to_numpy()[:, None],
+                                                     coefficients[:, ::-1], np.nan)
+
+    return table
+
+
 def extract_long_run_pace_from_longest_practice_stint(df, driver):
     """Extract the long run race pace from the longest stint in FP2.
 
@@ -179,3 +310,126 @@ def extract_long_run_pace_from_longest_practice_stint(df, driver):
         longest_stint_laptime_diff_df = longest_stint_laptime_df.diff()
 
     return (longest_stint_laptime_df.tolist(), longest_stint_df.Compound.unique()[0], longest_stint_tyrelife_df)
+
+
+def remove_long_run_outliers(laptimes):
+    """
+    Removes the slow laps of a stint in one pass, with the same result as the cleanup loop of
+    extract_long_run_pace_from_longest_practice_stint.
+
+    The loop repeatedly finds the first lap whose time differs from the previous lap by more than
+    a second, and drops the slower of the two, as long as the sum of such differences is positive.
+    Since the laps before that lap never change again, the kept laps form a stack: each lap is
+    compared with the last kept lap, and the sum of the differences after it is precomputed.
+
+    :param laptimes: a numpy.array containing the lap times of the stint in seconds.
+
+    :return: a list of ints containing the positions of the kept laps.
+    """
+    diffs = np.diff(laptimes)
+    with np.errstate(invalid='ignore'):
+        large_diffs = np.where(np.abs(diffs) > 1, diffs, 0)
+
+    # remaining_diffs[i] is the sum of the large differences between the laps after lap i.
+    remaining_diffs = np.append(np.cumsum(large_diffs[::-1])[::-1], 0).tolist()
+    laptimes = laptimes.tolist()
+
+    kept = []
+    for i in range(len(laptimes)):
+        dropped = False
+        while len(kept) > 0:
+            time_delta = laptimes[i] - laptimes[kept[-1]]
+            if not abs(time_delta) > 1:
+                break
+
+            # The loop stops as soon as the large differences no longer sum to a positive value.
+            if time_delta + remaining_diffs[i] <= 0:
+                return kept + list(range(i, len(laptimes)))
+
+            if time_delta > 0:
+                # The current lap is slower, so drop it.
+                dropped = True
+                break
+
+            # The previous lap is slower, so drop it and compare the lap with the lap before.
+            kept.pop()
+
+        if not dropped:
+            kept.append(i)
+
+    return kept
+
+
+def extract_long_run_pace_all_drivers(df) -> dict:
+    """Extract the long run race pace from the longest stint in FP2 of every driver at once.
+
+    Gives the same results as calling extract_long_run_pace_from_longest_practice_stint for each
+    driver, but selects all the longest stints with one groupby and removes the slow laps of each
+    stint in a single pass (see remove_long_run_outliers).
+
+    df: FP2.laps, the FP2 laps returned by session_store.load_laps, or a lap table returned by
+    lap_table.get_lap_table
+
+    :return: a dict mapping each driver to a tuple containing the lap times, the compound and the
+    tyre lives of the long run, like extract_long_run_pace_from_longest_practice_stint.
+    """
+    if isinstance(df, dict):
+        from lap_table import lap_table_to_df
+
+        df = lap_table_to_df(df)
+
+    accurate = df.loc[df['IsAccurate'] == True]
+
+    # Find the longest stint of each driver. We pick the later stint as reference if two are the
+    # same length, so search the stints in reverse order of appearance.
+    stint_lengths = accurate.groupby(['Driver', 'Stint'], sort=False).size()
+    longest_stints = stint_lengths.iloc[::-1].groupby(level='Driver', sort=False).idxmax()
+
+    in_longest_stint = pd.MultiIndex.from_frame(accurate[['Driver', 'Stint']]) \
+        .isin(longest_stints.tolist())
+    long_runs = accurate.loc[in_longest_stint]
+
+    laptimes = long_runs['LapTime']
+    if pd.api.types.is_timedelta64_dtype(laptimes):
+        laptimes = laptimes.dt.total_seconds()
+
+    # Group the laps of each driver together, keeping the order of the laps.
+    drivers, driver_codes = np.unique(long_runs['Driver'].to_numpy(), return_inverse=True)
+    order = np.argsort(driver_codes, kind='stable')
+    laptimes = laptimes.to_numpy(dtype=float)[order]
+    tyrelife = long_runs['TyreLife'].to_numpy()[order]
+    compounds = long_runs['Compound'].to_numpy()[order]
+    offsets = np.searchsorted(driver_codes[order], np.arange(len(drivers) + 1))
+
+    long_run_pace = {}
+    for i, driver in enumerate(drivers):
+        stint = slice(offsets[i], offsets[i + 1])
+        kept = remove_long_run_outliers(laptimes[stint])
+        long_run_pace[driver] = (laptimes[stint][kept].tolist(), compounds[stint][0],
+                                 tyrelife[stint][kept].tolist())
+
+    # Keep the order in which the drivers appear in the session, like race.get_all_driver_names.
+    return {driver: long_run_pace[driver] for driver in df['Driver'].unique()
+            if driver in long_run_pace}
+
+
+def get_long_run_pace_df(df) -> object:
+    """
+    Returns a DataFrame summarizing the long run race pace of every driver in FP2, sorted by the
+    mean lap time, as shared between the notebooks as fp2_race_sim.
+
+    df: FP2.laps, the FP2 laps returned by session_store.load_laps, or a lap table returned by
+    lap_table.get_lap_table
+
+    :return: a DataFrame with the columns 'Driver', 'MeanLapTime', 'Compound', 'NoOfLaps',
+    'LapTimes' and 'LapNumbers' (the tyre lives of the laps).
+    """
+    rows = []
+    for driver, (laptimes, compound, tyrelife) in extract_long_run_pace_all_drivers(df).items():
+        rows.append([driver, sum(laptimes) / len(laptimes), compound, len(laptimes), laptimes,
+                     tyrelife])
+
+    fp2_race_sim = pd.DataFrame(rows, columns=['Driver', 'MeanLapTime', 'Compound', 'NoOfLaps',
+                                               'LapTimes', 'LapNumbers'])
+
+    return fp2_race_sim.sort_values('MeanLapTime').reset_index(drop=True)
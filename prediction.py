@@ -1,119 +1,189 @@
 """
 Contains helper functions for predicting race strategies.
 """
-import fastf1 as ff1
 import pandas as pd
-from matplotlib import pyplot as plt
 import numpy as np
 from constants import *
-import matplotlib.patches as mpatches
-# Enable the cache by providing the name of the cache folder
-from race_sim import laptime_model
-ff1.Cache.enable_cache('cache')
+from race_sim import batch_laptime_model, get_ragged_array
 
-trackwear = 10
 
-def get_head_to_head_df(fp2_df, quali_df):
-    QUALIFYING_MIN_LAPTIME = quali_df['Fastest Lap'].min()
+def get_teammate_pairs(df, team_column: str = 'Team', key: str = None) -> object:
+    """
+    Returns the teammate of each driver, from a DataFrame containing the team of each driver, e.g.
+    the laps of a session or the results of a session (team_column='TeamName').
 
-    FP2_MIN_MEDIAN_LAPTIME = fp2_df['MeanLapTime'].median()
+    If a team has more than two drivers (e.g. a stand-in), the first two drivers are paired.
 
-    teammates_h2h = pd.DataFrame(
-        columns=['Driver', 'GoodFP2', 'GoodQualifying', 'Teammate', 'FP2MeanLapTime',
-                 'TeammateFP2MeanLapTime',
-                 'QualifyingLapTime', 'TeammateQualifyingLapTime', 'QualifyingPosition',
-                 'TeammateQualifyingPosition'])
+    :param df: a DataFrame with the columns 'Driver' (or 'Abbreviation') and team_column.
 
-    # To be inserted into teammates_h2h
-    # Insert data into the h2h table
-    for driver in TEAMMATE_PAIRS_DICT.keys():
-        teammate = TEAMMATE_PAIRS_DICT[driver]
+    :param team_column: a string representing the column containing the teams.
 
-        # ".values[0]" extracts the values from the series/dataframe and index 0 extracts the first value, which should be the sole value.
+    :param key: an optional string representing a column identifying the weekend, so that the
+    pairs of several weekends (or seasons) are returned at once.
 
-        # FP2
-        fp2_mean_laptime = fp2_df.loc[fp2_df['Driver'] == driver, 'MeanLapTime'].values[
-            0]
-        teammate_fp2_mean_laptime = \
-        fp2_df.loc[fp2_df['Driver'] == teammate, 'MeanLapTime'].values[0]
-        fp2_longest_stint_laps = len(
-            fp2_df.loc[fp2_df['Driver'] == driver, 'LapNumbers'].values[0])
+    :return: a DataFrame with the columns key (if given), 'Driver' and 'Teammate', with one row per
+    driver, i.e. both directions of each pair.
+    """
+    keys = [] if key is None else [key]
+    driver_column = 'Driver' if 'Driver' in df.columns else 'Abbreviation'
 
-        # Qualifying
-        q_fastest_lap = quali_df.loc[quali_df['Abbreviation'] == driver, 'Fastest Lap'].values[0]
-        teammate_q_fastest_lap = \
-        quali_df.loc[quali_df['Abbreviation'] == teammate, 'Fastest Lap'].values[0]
-        q_position = quali_df.index.get_loc(
-            quali_df[quali_df['Abbreviation'] == driver].index[0]) + 1
-        teammate_q_position = quali_df.index.get_loc(
-            quali_df[quali_df['Abbreviation'] == teammate].index[0]) + 1
+    drivers = df[keys + [team_column, driver_column]].drop_duplicates() \
+        .rename(columns={driver_column: 'Driver'})
+    drivers['Seat'] = drivers.groupby(keys + [team_column]).cumcount()
+    seats = drivers[drivers['Seat'] < 2]
 
-        # Booleans of whether driver has a good qualifying and fp2 sim compared to his teammate
-        good_qualifying = q_fastest_lap - teammate_q_fastest_lap < TEAMMATE_MAX_GAP_SECOND \
-                          and q_fastest_lap < QUALIFYING_MIN_LAPTIME * QUALIFYING_MAX_GAP_PERCENTAGE
+    first = seats[seats['Seat'] == 0].drop(columns='Seat')
+    second = seats[seats['Seat'] == 1].drop(columns='Seat').rename(columns={'Driver': 'Teammate'})
+    pairs = first.merge(second, on=keys + [team_column])
 
-        good_fp2 = fp2_mean_laptime - teammate_fp2_mean_laptime < TEAMMATE_MAX_GAP_SECOND \
-                   and fp2_mean_laptime < FP2_MIN_MEDIAN_LAPTIME * FP2_MAX_GAP_PERCENTAGE and fp2_longest_stint_laps >= 3
+    swapped = pairs.rename(columns={'Driver': 'Teammate', 'Teammate': 'Driver'})
 
-        teammates_h2h.loc[len(teammates_h2h)] = [driver, good_fp2, good_qualifying, teammate,
-                                                 fp2_mean_laptime, teammate_fp2_mean_laptime,
-                                                 q_fastest_lap, teammate_q_fastest_lap,
-                                                 q_position, teammate_q_position]
+    return pd.concat([pairs, swapped])[keys + ['Driver', 'Teammate']].reset_index(drop=True)
 
-    teammates_h2h = teammates_h2h.round(
-        {'FP2MeanLapTime': 3, 'TeammateFP2MeanLapTime': 3}).sort_values(
-        'QualifyingPosition').reset_index(drop=True)
 
+def get_head_to_head_df(fp2_df, quali_df, teammates: object = None):
+    """
+    Returns the teammate head-to-head comparison of a weekend and the long run estimate (the
+    predicted race pace) of each driver.
 
-    # Calculate Base Time
-    for driver in TEAMMATE_PAIRS_DICT.keys():
+    :param fp2_df: a DataFrame containing the long runs in FP2 (fp2_race_sim), e.g. returned by
+    practice.get_long_run_pace_df.
+
+    :param quali_df: a DataFrame containing the fastest laps in qualifying (times_df), returned by
+    qualifying.get_fastest_lap_in_qualifying, ordered by qualifying position.
+
+    :param teammates: a dict mapping each driver to their teammate (both directions), or a
+    DataFrame returned by get_teammate_pairs. Defaults to TEAMMATE_PAIRS_DICT (2022).
+
+    :return: a DataFrame with one row per driver, sorted by the long run estimate.
+    """
+    h2h = get_head_to_head_batch(fp2_df.assign(Weekend=0), quali_df.assign(Weekend=0),
+                                 teammates, key='Weekend')
+
+    return h2h.drop(columns='Weekend')
+
+
+def get_head_to_head_batch(fp2_df, quali_df, teammates: object = None, key: str = 'Weekend'):
+    """
+    Returns the teammate head-to-head comparisons and long run estimates of many weekends at once,
+    e.g. for backtesting the estimates over several seasons.
+
+    The FP2 and qualifying data are joined once, the teammates are looked up through an aligned
+    pairing table, and the long run pace of all drivers of all weekends is fitted in one call.
 
-        laptimes = fp2_df[fp2_df['Driver'] == driver].LapTimes.tolist()[0]
-        laps = fp2_df[fp2_df['Driver'] == driver].LapNumbers.tolist()[0]
-        laptimes = np.array(laptimes)
-        laps = np.array(laps)
+    :param fp2_df: a DataFrame containing the long runs in FP2 of every weekend (the frames
+    returned by practice.get_long_run_pace_df, concatenated), with a key column.
 
-        if len(laps) > 2:
-            # TODO: check parameters when function is refined.
-            popt, pcov, model = laptime_model(laps, laptimes, MEDIUM)
-            teammates_h2h.loc[teammates_h2h['Driver'] == driver, 'BaseTime'] = popt[0]
-        else:
-            teammates_h2h.loc[teammates_h2h['Driver'] == driver, 'BaseTime'] = 10000
+    :param quali_df: a DataFrame containing the fastest laps in qualifying of every weekend (the
+    frames returned by qualifying.get_fastest_lap_in_qualifying, concatenated), with a key column.
+    Within a weekend, the rows are ordered by qualifying position.
 
-    teammates_h2h = teammates_h2h.sort_values('BaseTime').reset_index(drop=True)
+    :param teammates: a dict mapping each driver to their teammate (both directions), used for all
+    weekends, or a DataFrame returned by get_teammate_pairs, with a key column if the teammates
+    change between weekends. Defaults to TEAMMATE_PAIRS_DICT (2022).
 
+    :param key: a string representing the column identifying the weekend.
+
+    :return: a DataFrame with one row per driver and weekend, sorted by weekend and long run
+    estimate.
+    """
+    if teammates is None:
+        teammates = TEAMMATE_PAIRS_DICT
+    if isinstance(teammates, dict):
+        teammates = pd.DataFrame({'Driver': list(teammates.keys()),
+                                  'Teammate': list(teammates.values())})
+    if key not in teammates.columns:
+        weekends = pd.DataFrame({key: fp2_df[key].unique()})
+        teammates = weekends.merge(teammates, how='cross')
+
+    # Index the FP2 and qualifying data by (weekend, driver), and align the rows of every driver
+    # and their teammate.
+    fp2 = fp2_df.assign(LongestStintLaps=fp2_df['LapNumbers'].map(len)) \
+        .set_index([key, 'Driver'])
+    quali = quali_df.rename(columns={'Abbreviation': 'Driver'})
+    quali = quali.assign(QualifyingPosition=quali.groupby(key).cumcount() + 1) \
+        .set_index([key, 'Driver'])
+
+    drivers = pd.MultiIndex.from_arrays([teammates[key], teammates['Driver']])
+    teammate_drivers = pd.MultiIndex.from_arrays([teammates[key], teammates['Teammate']])
+
+    def align(df, column, index):
+        return df[column].reindex(index).to_numpy()
+
+    teammates_h2h = pd.DataFrame({
+        key: teammates[key].to_numpy(), 'Driver': teammates['Driver'].to_numpy(),
+        'Teammate': teammates['Teammate'].to_numpy(),
+        'FP2MeanLapTime': align(fp2, 'MeanLapTime', drivers),
+        'TeammateFP2MeanLapTime': align(fp2, 'MeanLapTime', teammate_drivers),
+        'QualifyingLapTime': align(quali, 'Fastest Lap', drivers),
+        'TeammateQualifyingLapTime': align(quali, 'Fastest Lap', teammate_drivers),
+        'QualifyingPosition': align(quali, 'QualifyingPosition', drivers),
+        'TeammateQualifyingPosition': align(quali, 'QualifyingPosition', teammate_drivers)})
+
+    weekend_of_driver = teammates_h2h[key]
+    qualifying_min_laptime = weekend_of_driver.map(quali_df.groupby(key)['Fastest Lap'].min())
+    fp2_min_median_laptime = weekend_of_driver.map(fp2_df.groupby(key)['MeanLapTime'].median())
+    fp2_longest_stint_laps = align(fp2, 'LongestStintLaps', drivers)
+
+    # Booleans of whether driver has a good qualifying and fp2 sim compared to his teammate
+    teammates_h2h['GoodFP2'] = \
+        (teammates_h2h.FP2MeanLapTime - teammates_h2h.TeammateFP2MeanLapTime <
+         TEAMMATE_MAX_GAP_SECOND) & \
+        (teammates_h2h.FP2MeanLapTime < fp2_min_median_laptime * FP2_MAX_GAP_PERCENTAGE) & \
+        (fp2_longest_stint_laps >= 3)
+    teammates_h2h['GoodQualifying'] = \
+        (teammates_h2h.QualifyingLapTime - teammates_h2h.TeammateQualifyingLapTime <
+         TEAMMATE_MAX_GAP_SECOND) & \
+        (teammates_h2h.QualifyingLapTime < qualifying_min_laptime * QUALIFYING_MAX_GAP_PERCENTAGE)
+
+    teammates_h2h = teammates_h2h.round({'FP2MeanLapTime': 3, 'TeammateFP2MeanLapTime': 3})
+
+    # Calculate Base Time
+    # Fit the long runs of all drivers of all weekends with enough laps at once.
+    long_runs = fp2.reindex(drivers)
+    long_runs = long_runs[long_runs.LongestStintLaps > 2]
+    laps, offsets = get_ragged_array(long_runs.LapNumbers)
+    laptimes, _ = get_ragged_array(long_runs.LapTimes)
+
+    # TODO: check parameters when function is refined.
+    popt, pcov, model = batch_laptime_model(laps, laptimes, offsets, MEDIUM)
+    base_times = pd.Series(popt[:, 0], index=long_runs.index)
+    teammates_h2h['BaseTime'] = np.nan_to_num(base_times.reindex(drivers).to_numpy(), nan=10000)
+    # The variance of the base time is infinite for drivers without a fitted long run.
+    base_time_variances = pd.Series(pcov[:, 0, 0], index=long_runs.index)
+    teammates_h2h['BaseTimeVariance'] = base_time_variances.reindex(drivers).fillna(np.inf) \
+        .to_numpy()
 
     # Calculate the long run estimate
-    for driver in TEAMMATE_PAIRS_DICT.keys():
-        self_row = teammates_h2h[teammates_h2h['Driver'] == driver]
-
-        # Qualifying
-        self_q_time = float(self_row.QualifyingLapTime)
-        min_q_time = min(teammates_h2h.QualifyingLapTime)
-        quali_gap = min(self_q_time - min_q_time, MAX_GAP_VALUE)
-
-        # FP2
-        self_fp2_time = float(self_row.BaseTime)
-        min_fp2_time = min(teammates_h2h.BaseTime)
-
-        fp2_gap = min(self_fp2_time - min_fp2_time, MAX_GAP_VALUE)
-
-        good_fp2 = self_row.GoodFP2.iloc[0]
-        good_quali = self_row.GoodQualifying.iloc[0]
-        if good_fp2 or good_quali:
-            teammates_h2h.loc[teammates_h2h['Driver'] == driver, 'LongRunEstimate'] = \
-                min(teammates_h2h.BaseTime) + good_fp2 * (
-                            1 - 0.5 * good_quali) * fp2_gap + good_quali * (
-                            1 - 0.5 * good_fp2) * quali_gap
-        else:
-            teammate_row = teammates_h2h[teammates_h2h['Driver'] == TEAMMATE_PAIRS_DICT[driver]]
-            fp2_gap = min(float(teammate_row.BaseTime) - min_fp2_time + 1, MAX_GAP_VALUE)
-            quali_gap = min(float(teammate_row.BaseTime) - min_q_time + 1, MAX_GAP_VALUE)
-            teammates_h2h.loc[teammates_h2h['Driver'] == driver, 'LongRunEstimate'] = \
-                min(teammates_h2h.BaseTime) + (
-                            1 - 0.5 * (quali_gap < 10)) * fp2_gap + good_quali * (
-                            1 - 0.5 * (fp2_gap < 10)) * quali_gap
-
-    teammates_h2h = teammates_h2h.sort_values('LongRunEstimate').reset_index(drop=True)
-
-    return teammates_h2h
+    grouped = teammates_h2h.groupby(key)
+    min_fp2_time = grouped['BaseTime'].transform('min')
+    min_q_time = grouped['QualifyingLapTime'].transform('min')
+    good_fp2 = teammates_h2h['GoodFP2'].astype(float)
+    good_quali = teammates_h2h['GoodQualifying'].astype(float)
+
+    fp2_gap = np.minimum(teammates_h2h['BaseTime'] - min_fp2_time, MAX_GAP_VALUE)
+    quali_gap = np.minimum(teammates_h2h['QualifyingLapTime'] - min_q_time, MAX_GAP_VALUE)
+    long_run_estimate = min_fp2_time + good_fp2 * (1 - 0.5 * good_quali) * fp2_gap + \
+        good_quali * (1 - 0.5 * good_fp2) * quali_gap
+
+    # Drivers with neither a good FP2 nor a good qualifying are estimated from their teammate.
+    teammate_base_time = teammates_h2h.set_index([key, 'Driver'])['BaseTime'] \
+        .reindex(teammate_drivers).to_numpy()
+    teammate_fp2_gap = np.minimum(teammate_base_time - min_fp2_time + 1, MAX_GAP_VALUE)
+    teammate_quali_gap = np.minimum(teammate_base_time - min_q_time + 1, MAX_GAP_VALUE)
+    teammate_long_run_estimate = min_fp2_time + \
+        (1 - 0.5 * (teammate_quali_gap < 10)) * teammate_fp2_gap + \
+        good_quali * (1 - 0.5 * (teammate_fp2_gap < 10)) * teammate_quali_gap
+
+    teammates_h2h['LongRunEstimate'] = np.where(
+        teammates_h2h['GoodFP2'] | teammates_h2h['GoodQualifying'], long_run_estimate,
+        teammate_long_run_estimate)
+
+    columns = [key, 'Driver', 'GoodFP2', 'GoodQualifying', 'Teammate', 'FP2MeanLapTime',
+               'TeammateFP2MeanLapTime', 'QualifyingLapTime', 'TeammateQualifyingLapTime',
+               'QualifyingPosition', 'TeammateQualifyingPosition', 'BaseTime', 'BaseTimeVariance',
+               'LongRunEstimate']
+
+    # Drivers with the same estimate are ordered by their qualifying position, as before.
+    return teammates_h2h[columns].sort_values('QualifyingPosition', kind='stable') \
+        .sort_values([key, 'LongRunEstimate'], kind='stable').reset_index(drop=True)
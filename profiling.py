@@ -0,0 +1,290 @@
+"""
+Contains helper functions for profiling the analysis, e.g. to find out whether a slow weekend run
+spends its time loading sessions, extracting long runs, fitting lap time models or searching
+strategies.
+
+Profiling is opt-in: enable_profiling wraps the public functions of the profiled modules, and
+disable_profiling puts the original functions back, so nothing is measured (and nothing costs any
+time) while profiling is disabled. Each call records its wall time, the number of rows of its first
+argument and, optionally, its peak memory (with tracemalloc, which slows the calls down). Calls made
+in worker processes are not recorded, and generators are only measured until they are created.
+
+Usage:
+    enable_profiling()
+    ...
+    disable_profiling()
+    print_profile_summary()
+    write_trace('trace.json')  # open in chrome://tracing or https://ui.perfetto.dev
+"""
+import contextlib
+import functools
+import importlib
+import inspect
+import json
+import os
+import sys
+import threading
+import time
+
+# The modules whose public functions are profiled by default
+PROFILED_MODULES = ['race', 'practice', 'qualifying', 'prediction', 'race_sim']
+
+# The largest number of calls kept for the trace, the summary counts every call
+MAX_TRACE_EVENTS = 100000
+
+# The state of the profiler: the statistics of each function or span, and the trace events (name,
+# start, duration, thread, rows, peak memory).
+_PROFILER = {'enabled': False, 'memory': False, 'tracemalloc': False, 'stats': {}, 'events': [],
+             'origin': 0.0}
+_STACKS = threading.local()
+
+
+def _count_rows(args: tuple) -> int:
+    """
+    Returns the number of rows of the first argument of a call: the rows of a DataFrame or a
+    numpy.array, or the laps of a lap table, and 0 otherwise.
+    """
+    if not args:
+        return 0
+
+    data = args[0]
+    if isinstance(data, dict) and 'Offsets' in data:
+        return int(data['Offsets'][-1])
+    shape = getattr(data, 'shape', None)
+    if shape:
+        return int(shape[0])
+
+    return 0
+
+
+def _get_project_modules() -> list:
+    """
+    Returns the loaded modules of the project, i.e. the modules in the folder of this file.
+    """
+    root = os.path.dirname(os.path.abspath(__file__))
+
+    return [module for module in list(sys.modules.values())
+            if getattr(module, '__file__', None) is not None and
+            os.path.dirname(os.path.abspath(module.__file__)) == root]
+
+
+def _start_measure() -> list:
+    """
+    Starts measuring a call or a span, and returns its frame: [start time, memory at the start,
+    peak memory so far].
+    """
+    frame = [time.perf_counter(), 0, 0]
+    if _PROFILER['memory']:
+        import tracemalloc
+
+        current, peak = tracemalloc.get_traced_memory()
+        stack = getattr(_STACKS, 'frames', None)
+        if stack:
+            # The peak is reset for this call, so the enclosing call keeps the peak so far.
+            stack[-1][2] = max(stack[-1][2], peak)
+        tracemalloc.reset_peak()
+        frame[1:] = [current, current]
+
+    _STACKS.__dict__.setdefault('frames', []).append(frame)
+
+    return frame
+
+
+def _stop_measure(name: str, frame: list, rows: int) -> None:
+    """
+    Stops measuring a call or a span, and records its statistics and trace event.
+    """
+    end = time.perf_counter()
+    _STACKS.frames.pop()
+
+    peak_memory = 0
+    if _PROFILER['memory']:
+        import tracemalloc
+
+        frame[2] = max(frame[2], tracemalloc.get_traced_memory()[1])
+        peak_memory = frame[2] - frame[1]
+        if _STACKS.frames:
+            _STACKS.frames[-1][2] = max(_STACKS.frames[-1][2], frame[2])
+
+    duration = end - frame[0]
+    stats = _PROFILER['stats'].setdefault(name, {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0,
+                                                 'rows': 0, 'peak_memory': 0})
+    stats['calls'] += 1
+    stats['seconds'] += duration
+    stats['max_seconds'] = max(stats['max_seconds'], duration)
+    stats['rows'] += rows
+    stats['peak_memory'] = max(stats['peak_memory'], peak_memory)
+
+    if len(_PROFILER['events']) < MAX_TRACE_EVENTS:
+        _PROFILER['events'].append((name, frame[0], duration, threading.get_ident(), rows,
+                                    peak_memory))
+
+
+def _wrap(name: str, function):
+    """
+    Returns a function that records the calls of a function under a name.
+    """
+    @functools.wraps(function)
+    def profiled(*args, **kwargs):
+        # A module imported while profiling may still refer to the wrapper.
+        if not _PROFILER['enabled']:
+            return function(*args, **kwargs)
+
+        frame = _start_measure()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _stop_measure(name, frame, _count_rows(args))
+
+    profiled.__profiled__ = function
+
+    return profiled
+
+
+@contextlib.contextmanager
+def profile_span(name: str, rows: int = 0):
+    """
+    Records a block of code (e.g. a stage of pipeline.py) under a name, like a profiled function.
+    Nothing is recorded if profiling is disabled.
+
+    Usage:
+        with profile_span('strategy', rows=len(driver_tyre_data)):
+            ...
+
+    :param name: a string representing the block of code.
+
+    :param rows: an int representing the number of rows processed by the block.
+    """
+    if not _PROFILER['enabled']:
+        yield
+        return
+
+    frame = _start_measure()
+    try:
+        yield
+    finally:
+        _stop_measure(name, frame, rows)
+
+
+def enable_profiling(modules: list = None, memory: bool = False) -> None:
+    """
+    Starts profiling the public functions of modules. The functions are replaced in the modules,
+    and in the other loaded modules that imported them by name (e.g. with 'from race_sim import
+    *'), so calls between modules are recorded too.
+
+    :param modules: a list of strings representing the modules, defaults to PROFILED_MODULES.
+
+    :param memory: a bool indicating whether to record the peak memory of each call with
+    tracemalloc. The peak includes the memory allocated by numpy and pandas, but tracing makes
+    every allocation slower.
+    """
+    if _PROFILER['enabled']:
+        disable_profiling()
+
+    modules = PROFILED_MODULES if modules is None else modules
+
+    wrappers = {}
+    for module_name in modules:
+        module = importlib.import_module(module_name)
+        for name, function in inspect.getmembers(module, inspect.isfunction):
+            if not name.startswith('_') and function.__module__ == module_name:
+                wrappers[function] = _wrap('{}.{}'.format(module_name, name), function)
+
+    # Replace the functions wherever the project modules refer to them.
+    for module in _get_project_modules():
+        for name, value in list(vars(module).items()):
+            if inspect.isfunction(value) and value in wrappers:
+                setattr(module, name, wrappers[value])
+
+    if memory:
+        import tracemalloc
+
+        # Only stop tracing when disabling if it was started here.
+        _PROFILER['tracemalloc'] = not tracemalloc.is_tracing()
+        if _PROFILER['tracemalloc']:
+            tracemalloc.start()
+
+    _PROFILER.update(enabled=True, memory=memory)
+    if not _PROFILER['origin']:
+        _PROFILER['origin'] = time.perf_counter()
+
+
+def disable_profiling() -> None:
+    """
+    Stops profiling, and puts the original functions back. The recorded statistics are kept until
+    reset_profile is called.
+    """
+    for module in _get_project_modules():
+        for name, value in list(vars(module).items()):
+            if hasattr(value, '__profiled__'):
+                setattr(module, name, value.__profiled__)
+
+    if _PROFILER['tracemalloc']:
+        import tracemalloc
+
+        tracemalloc.stop()
+
+    _PROFILER.update(enabled=False, memory=False, tracemalloc=False)
+
+
+def reset_profile() -> None:
+    """
+    Forgets the recorded statistics and trace events.
+    """
+    origin = time.perf_counter() if _PROFILER['enabled'] else 0.0
+    _PROFILER.update(stats={}, events=[], origin=origin)
+
+
+def get_profile_stats() -> dict:
+    """
+    Returns the statistics of each profiled function or span.
+
+    :return: a dict mapping each name (e.g. 'practice.get_long_run_pace_df') to a dict with the
+    keys 'calls', 'seconds' (the total wall time, including the calls it makes), 'max_seconds',
+    'rows' (the total rows of the first arguments) and 'peak_memory' (the largest peak in bytes,
+    or 0 if memory is not recorded), sorted by total time.
+    """
+    return dict(sorted(((name, dict(stats)) for name, stats in _PROFILER['stats'].items()),
+                       key=lambda item: -item[1]['seconds']))
+
+
+def print_profile_summary(limit: int = None) -> None:
+    """
+    Prints a table of the statistics of each profiled function or span, slowest first.
+
+    :param limit: an int representing the largest number of rows printed, or None for all.
+    """
+    print('{:<52}{:>8}{:>12}{:>12}{:>12}{:>12}'.format('name', 'calls', 'total (s)', 'mean (ms)',
+                                                       'rows', 'peak (MB)'))
+    for name, stats in list(get_profile_stats().items())[:limit]:
+        print('{:<52}{:>8}{:>12.4f}{:>12.3f}{:>12}{:>12.1f}'.format(
+            name, stats['calls'], stats['seconds'], stats['seconds'] / stats['calls'] * 1000,
+            stats['rows'], stats['peak_memory'] / 2 ** 20))
+
+
+def get_trace() -> dict:
+    """
+    Returns the recorded calls in the Chrome trace event format, with the statistics of each
+    function in 'otherData'.
+    """
+    origin = _PROFILER['origin']
+    events = [{'name': name, 'cat': name.split('.')[0], 'ph': 'X', 'pid': os.getpid(),
+               'tid': thread, 'ts': (start - origin) * 1e6, 'dur': duration * 1e6,
+               'args': {'rows': rows, 'peak_memory': peak_memory}}
+              for name, start, duration, thread, rows, peak_memory in _PROFILER['events']]
+
+    return {'traceEvents': events, 'displayTimeUnit': 'ms',
+            'otherData': {'stats': get_profile_stats(),
+                          'dropped_events': sum(stats['calls'] for stats in
+                                                _PROFILER['stats'].values()) - len(events)}}
+
+
+def write_trace(path: str) -> None:
+    """
+    Writes the recorded calls to a JSON file in the Chrome trace event format, which can be opened
+    in chrome://tracing or https://ui.perfetto.dev.
+
+    :param path: a string representing the path of the file.
+    """
+    with open(path, 'w') as file:
+        json.dump(get_trace(), file)
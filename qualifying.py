@@ -4,8 +4,6 @@ Contains helper functions for analysing qualifying data in notebook.
 import pandas as pd
 
 from constants import *
-# Enable the cache by providing the name of the cache folder
-ff1.Cache.enable_cache('cache')
 
 
 def get_fastest_lap_in_qualifying(df) -> object:
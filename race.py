@@ -3,11 +3,8 @@ Contains helper functions for analysing race data in notebook.
 """
 import numpy as np
 import pandas as pd
-from matplotlib import pyplot as plt
 
 from constants import *
-# Enable the cache by providing the name of the cache folder
-ff1.Cache.enable_cache('cache')
 
 
 def get_all_driver_names(df) -> list:
@@ -27,16 +24,32 @@ def calculate_race_lap_times(df) -> None:
     Calculates the lap times of null lap times. Most common case of a null lap time is the first
     lap of a race.
 
+    The laps of several drivers (and of several sessions, if the columns 'season', 'event' and
+    'session' are present) can be processed at once, as long as the laps of each driver are
+    ordered by lap number. A null lap time of the last lap of a driver stays null.
+
     :param df: A DataFrame containing data of a race session. Usually this is a fastf1.core.Laps
-    object
+    object, or a lap table returned by lap_table.get_lap_table.
     """
-    # Get the indices of rows whose "LapTime" is null
-    null_lap_time_indices = df.index[pd.isnull(df["LapTime"])].tolist()
-
     # The LapTime is calculated to be
     # the difference of the start time of the next lap and the current lap.
-    for i in null_lap_time_indices:
-        df.loc[i, "LapTime"] = df.loc[i + 1, "LapStartTime"] - df.loc[i, "LapStartTime"]
+    if isinstance(df, dict):
+        lap_start_times = df["LapStartTime"]
+        next_lap_start_times = np.append(lap_start_times[1:], np.nan)
+        # The last lap of each driver has no next lap.
+        next_lap_start_times[df["Offsets"][1:] - 1] = np.nan
+
+        missing = np.isnan(df["LapTime"])
+        df["LapTime"][missing] = (next_lap_start_times - lap_start_times)[missing]
+        return
+
+    keys = [column for column in SESSION_KEY_COLUMNS + ['Driver'] if column in df.columns]
+    if keys:
+        next_lap_start_time = df.groupby(keys, sort=False)["LapStartTime"].shift(-1)
+    else:
+        next_lap_start_time = df["LapStartTime"].shift(-1)
+
+    df["LapTime"] = df["LapTime"].fillna(next_lap_start_time - df["LapStartTime"])
 
 
 def convert_laptime_to_seconds(df) -> None:
@@ -53,11 +66,59 @@ def convert_laptime_to_seconds(df) -> None:
     df.loc[:, "LapTime"] = df["LapTime"].dt.total_seconds()
 
 
+def get_track_status_flags(df) -> object:
+    """
+    Returns the track status of each lap as a combination of the flags SAFETY_CAR,
+    VIRTUAL_SAFETY_CAR, VIRTUAL_SAFETY_CAR_ENDING, RED_FLAG and YELLOW_FLAG defined in constants.py.
+
+    E.g. the laps under a safety car are (flags & SAFETY_CAR) != 0, and a lap without any flag is
+    a green flag lap. Laps without a track status have the flag NO_TRACK_STATUS.
+
+    :param df: A DataFrame containing data of one or more sessions. Usually this is a
+    fastf1.core.Laps object, or a lap table returned by lap_table.get_lap_table (or a DataFrame of
+    it returned by lap_table.lap_table_to_df).
+
+    :return: a numpy.array of int8, one per lap.
+    """
+    # Lap tables, and the DataFrames of lap_table.lap_table_to_df, store the flags already.
+    if isinstance(df, dict):
+        return df["TrackStatus"]
+    if pd.api.types.is_integer_dtype(df["TrackStatus"]):
+        return df["TrackStatus"].to_numpy(np.int8)
+
+    # Only the few distinct track statuses are decoded, and their flags are looked up per lap.
+    codes, statuses = pd.factorize(df["TrackStatus"])
+
+    status_flags = np.zeros(len(statuses) + 1, dtype=np.int8)
+    status_flags[-1] = NO_TRACK_STATUS
+    for i, status in enumerate(statuses):
+        for code, flag in TRACK_STATUS_CODE_FLAGS.items():
+            if code in str(status):
+                status_flags[i] |= flag
+
+    # Missing track statuses (code -1) map to the last entry.
+    return status_flags[codes]
+
+
+def get_green_flag_mask(df) -> object:
+    """
+    Returns a boolean mask of the laps completed entirely under green flag, like
+    fastf1.core.Laps.pick_track_status('1'), but without matching strings.
+
+    :param df: A DataFrame containing data of one or more sessions. Usually this is a
+    fastf1.core.Laps object, or a lap table returned by lap_table.get_lap_table.
+
+    :return: a numpy.array of booleans, one per lap.
+    """
+    return get_track_status_flags(df) == 0
+
+
 def get_track_status_by_lap(df) -> list:
     """
     Returns a list of strings indicating track statuses.
 
-    Note that several track statuses can occur at the same time and during the same lap.
+    Note that several track statuses can occur at the same time and during the same lap. Only
+    the most important one is reported, see get_track_status_flags for all of them.
 
     TODO: Update the representation of track status, e.g. Safety Car Ending, Restarts etc.
 
@@ -66,24 +127,14 @@ def get_track_status_by_lap(df) -> list:
     :return: A list (whose length is the same as number of laps of the race) of strings. The string
     represents the track condition of the (index + 1) lap.
     """
+    flags = get_track_status_flags(df)
 
-    # The result list
-    track_status = []
+    # Translate the flags to strings, from the most to the least important one
+    conditions = [(flags & SAFETY_CAR) != 0, (flags & VIRTUAL_SAFETY_CAR_ENDING) != 0,
+                  (flags & VIRTUAL_SAFETY_CAR) != 0, (flags & RED_FLAG) != 0]
+    choices = ["Safety Car Deployed", "VSC Ending", "VSC Deployed", "Red Flag"]
 
-    # Iterate the 'TrackStatus' column of df and translate the number codes to strings
-    for status in df["TrackStatus"]:
-        if '4' in str(status):
-            track_status.append("Safety Car Deployed")
-        elif '7' in str(status):
-            track_status.append("VSC Ending")
-        elif '6' in str(status):
-            track_status.append("VSC Deployed")
-        elif '5' in str(status):
-            track_status.append("Red Flag")
-        else:
-            track_status.append("")
-
-    return track_status
+    return np.select(conditions, choices, default="").tolist()
 
 
 def plot_lap_time_bar_graph(df) -> object:
@@ -94,6 +145,9 @@ def plot_lap_time_bar_graph(df) -> object:
     object
     :return: A subplot of a driver
     """
+    from matplotlib import pyplot as plt
+    from constants import TYRES_COLOR_LEGEND
+
     subplot = df.plot(kind='bar', x='LapNumber', y='LapTime',
                       ylabel='Lap Time (second)', xlabel='Lap Number',
                       figsize=(20, 10), xticks=np.arange(0, 71, step=5),
@@ -122,6 +176,9 @@ def plot_lap_time_line_graph(df) -> object:
     object
     :return: A subplot of a driver
     """
+    from matplotlib import pyplot as plt
+    from constants import TYRES_COLOR_LEGEND
+
     temp_df = df.copy().set_index("Compound", append=True).unstack("Compound")["LapTime"]
 
     subplot = temp_df.plot(color=TYRES_COLOR_DICT, ylabel='Lap Time (second)',
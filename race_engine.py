@@ -0,0 +1,315 @@
+"""
+Contains helper functions for simulating complete races lap by lap.
+
+Each race is a numpy state array of race times with one column per car, and many races are
+simulated at once by stacking them as rows. Races are split into chunks, which are simulated in
+parallel, each with its own random number generator spawned from a single seed.
+
+Only numpy is imported at start up, so the worker processes start quickly.
+"""
+import numpy as np
+
+from constants import *
+from race_sim import tyre_degradation_model_array
+
+
+def get_race_plan(compounds: tuple, stint_lengths: tuple) -> tuple:
+    """
+    Returns the compound, tyre life and in lap flag of every lap of a strategy.
+
+    :param compounds: a tuple of strings containing the compound of each stint, e.g.
+    ('SOFT', 'HARD').
+
+    :param stint_lengths: a tuple of ints containing the number of laps of each stint, e.g.
+    (22, 48).
+
+    :return: a tuple containing three numpy.arrays, one entry per lap: the compound codes, the tyre
+    lives and whether the lap is an in lap.
+    """
+    compound_codes = np.repeat([COMPOUND_CODES[compound] for compound in compounds],
+                               stint_lengths).astype(np.int8)
+    tyre_life = np.concatenate([np.arange(1, stint_length + 1) for stint_length in stint_lengths])
+
+    # The driver pits at the end of the last lap of each stint, except the last stint.
+    in_laps = np.zeros(len(tyre_life), dtype=bool)
+    in_laps[np.cumsum(stint_lengths)[:-1] - 1] = True
+
+    return (compound_codes, tyre_life, in_laps)
+
+
+def get_race_setup(race_data, strategies, no_of_laps: int, in_lap: float, out_lap: float,
+                   start_time: float,
+                   safety_car_probability: float = SAFETY_CAR_PROBABILITY_PER_LAP,
+                   virtual_safety_car_probability: float = VIRTUAL_SAFETY_CAR_PROBABILITY_PER_LAP
+                   ) -> dict:
+    """
+    Precomputes the deterministic part of the lap times of every car.
+
+    :param race_data: a DataFrame containing the columns 'Driver', 'LongRunEstimate',
+    'SoftDegFactor', 'MediumDegFactor' and 'HardDegFactor', one row per driver. An optional
+    'GridPosition' column sets the starting grid, otherwise the row order is used.
+
+    :param strategies: a DataFrame returned by strategy.get_optimal_strategies. The fastest
+    strategy of each driver is used.
+
+    :param no_of_laps: an int representing the number of laps of the race.
+
+    :param in_lap: a float representing the time lost (in seconds) on an in lap.
+
+    :param out_lap: a float representing the time lost (in seconds) on an out lap.
+
+    :param start_time: a float representing the time lost (in seconds) at the race start.
+
+    :param safety_car_probability: a float representing the probability of a safety car on each
+    lap, besides the safety cars caused by accidents.
+
+    :param virtual_safety_car_probability: a float representing the probability of a virtual
+    safety car on each lap.
+
+    :return: a dict containing the drivers, the base lap times and the pit losses of each car on
+    each lap (numpy.arrays of shape (cars, laps)), the in laps of each car, the gaps on the grid
+    and the neutralisation probabilities.
+    """
+    if 'GridPosition' in race_data.columns:
+        race_data = race_data.sort_values('GridPosition')
+    drivers = race_data['Driver'].tolist()
+
+    fastest_strategies = strategies.sort_values('RaceTime', kind='stable') \
+        .groupby('Driver').head(1).set_index('Driver')
+
+    base_lap_times = np.zeros((len(drivers), no_of_laps))
+    pit_losses = np.zeros((len(drivers), no_of_laps))
+    in_laps = np.zeros((len(drivers), no_of_laps), dtype=bool)
+
+    for i, driver in enumerate(drivers):
+        row = race_data.iloc[i]
+        strategy = fastest_strategies.loc[driver]
+        compound_codes, tyre_life, in_laps[i] = get_race_plan(strategy.Compounds,
+                                                              strategy.StintLengths)
+
+        deg_factors = np.array([row[compound.title() + 'DegFactor'] for compound in DRY_TYRES])
+        base_lap_times[i] = row.LongRunEstimate + \
+            tyre_degradation_model_array(tyre_life, compound_codes, deg_factors[compound_codes])
+
+        # As in the strategy predictions, a pit stop costs an in lap, an out lap and one second.
+        pit_losses[i, in_laps[i]] += in_lap
+        pit_losses[i, 1:][in_laps[i, :-1]] += out_lap + 1
+
+    pit_losses[:, 0] += start_time
+
+    return {'drivers': drivers, 'base_lap_times': base_lap_times, 'pit_losses': pit_losses,
+            'in_laps': in_laps,
+            'grid_gaps': np.arange(len(drivers)) * GRID_SLOT_GAP_SECOND,
+            'safety_car_probability': safety_car_probability,
+            'virtual_safety_car_probability': virtual_safety_car_probability}
+
+
+def _hold_behind(race_times, new_race_times):
+    """
+    Stops cars from passing the car ahead unless they are fast enough to overtake.
+
+    :param race_times: a numpy.array of shape (races, cars) containing the race times before the
+    lap, which sets the running order.
+
+    :param new_race_times: a numpy.array of shape (races, cars) containing the race times after the
+    lap if no car was held up. It is updated in place.
+    """
+    order = np.argsort(race_times, axis=1, kind='stable')
+    ordered = np.take_along_axis(new_race_times, order, axis=1)
+
+    # Retired cars have infinite race times, so ignore the warnings of inf - inf.
+    with np.errstate(invalid='ignore'):
+        for position in range(1, ordered.shape[1]):
+            car_ahead = ordered[:, position - 1]
+            held = (ordered[:, position] < car_ahead + MIN_FOLLOWING_GAP_SECOND) & \
+                   (car_ahead - ordered[:, position] < OVERTAKE_MIN_PACE_ADVANTAGE_SECOND)
+            ordered[held, position] = car_ahead[held] + MIN_FOLLOWING_GAP_SECOND
+
+    np.put_along_axis(new_race_times, order, ordered, axis=1)
+
+
+def _simulate_chunk(race_setup: dict, no_of_races: int, seed_sequence) -> tuple:
+    """
+    Simulates a chunk of races with a random number generator of its own.
+
+    :return: a tuple containing the finishing positions, the race times and the track status of
+    each lap. See simulate_races.
+    """
+    rng = np.random.default_rng(seed_sequence)
+    base_lap_times = race_setup['base_lap_times']
+    pit_losses = race_setup['pit_losses']
+    safety_car_probability = race_setup['safety_car_probability']
+    virtual_safety_car_probability = race_setup['virtual_safety_car_probability']
+    no_of_cars, no_of_laps = base_lap_times.shape
+
+    race_times = np.tile(race_setup['grid_gaps'], (no_of_races, 1))
+    retired = np.zeros((no_of_races, no_of_cars), dtype=bool)
+    laps_completed = np.full((no_of_races, no_of_cars), no_of_laps, dtype=np.int16)
+    track_status = np.zeros((no_of_races, no_of_laps), dtype=np.int8)
+
+    # The neutralisation (SAFETY_CAR or VIRTUAL_SAFETY_CAR) of each race and its remaining laps.
+    neutralisation = np.zeros(no_of_races, dtype=np.int8)
+    neutralised_laps_left = np.zeros(no_of_races, dtype=np.int16)
+
+    for lap in range(no_of_laps):
+        # Random accidents, some of which bring out the safety car.
+        retiring = (rng.random((no_of_races, no_of_cars)) < RETIREMENT_PROBABILITY_PER_LAP) & \
+            ~retired
+        retired |= retiring
+        laps_completed[retiring] = lap
+
+        green = neutralised_laps_left == 0
+        event = rng.random(no_of_races)
+        accident = retiring.any(axis=1) & \
+            (rng.random(no_of_races) < ACCIDENT_SAFETY_CAR_PROBABILITY)
+        new_safety_car = green & ((event < safety_car_probability) | accident)
+        new_virtual_safety_car = green & ~new_safety_car & \
+            (event < safety_car_probability + virtual_safety_car_probability)
+        neutralisation[new_safety_car] = SAFETY_CAR
+        neutralised_laps_left[new_safety_car] = SAFETY_CAR_LAPS
+        neutralisation[new_virtual_safety_car] = VIRTUAL_SAFETY_CAR
+        neutralised_laps_left[new_virtual_safety_car] = VIRTUAL_SAFETY_CAR_LAPS
+
+        neutralised = neutralised_laps_left > 0
+        safety_car = neutralised & (neutralisation == SAFETY_CAR)
+        virtual_safety_car = neutralised & (neutralisation == VIRTUAL_SAFETY_CAR)
+        track_status[neutralised, lap] = neutralisation[neutralised]
+
+        # Green flag laps, where cars can only pass if they are fast enough.
+        reference_lap_time = base_lap_times[:, lap].min()
+        lap_times = base_lap_times[:, lap] + \
+            rng.normal(0, LAP_TIME_NOISE_SD, (no_of_races, no_of_cars))
+        lap_times[virtual_safety_car] = np.maximum(
+            lap_times[virtual_safety_car], reference_lap_time * VIRTUAL_SAFETY_CAR_LAP_TIME_FACTOR)
+
+        lap_pit_losses = np.tile(pit_losses[:, lap], (no_of_races, 1))
+        lap_pit_losses[neutralised] *= SAFETY_CAR_PIT_LOSS_FACTOR
+
+        new_race_times = race_times + lap_times
+        _hold_behind(race_times, new_race_times)
+
+        # Under the safety car, the field queues up behind the leader.
+        if safety_car.any():
+            running_order = np.argsort(np.argsort(race_times[safety_car], axis=1), axis=1)
+            new_race_times[safety_car] = race_times[safety_car].min(axis=1, keepdims=True) + \
+                reference_lap_time * SAFETY_CAR_LAP_TIME_FACTOR + \
+                running_order * SAFETY_CAR_GAP_SECOND
+
+        race_times = new_race_times + lap_pit_losses
+        race_times[retired] = np.inf
+        neutralised_laps_left[neutralised] -= 1
+
+    # Finishers are classified by race time, followed by retired cars by laps completed.
+    classification_key = np.where(retired, np.inf, race_times)
+    order = np.lexsort((classification_key, -laps_completed), axis=1)
+    positions = np.empty_like(order, dtype=np.int8)
+    np.put_along_axis(positions, order, np.arange(1, no_of_cars + 1, dtype=np.int8), axis=1)
+
+    return (positions, race_times, track_status)
+
+
+def iter_race_chunks(race_setup: dict, no_of_races: int = 1000, seed: int = None,
+                     processes: int = None, races_per_chunk: int = 500):
+    """
+    Simulates many races like simulate_races, but yields the results one chunk at a time in
+    order, so the races do not need to fit in memory at once. Only a few chunks per worker are
+    simulated ahead of the chunk being consumed.
+
+    :param race_setup: a dict returned by get_race_setup.
+
+    :param no_of_races: an int representing the number of races simulated.
+
+    :param seed: an int used to seed the random number generators, or None for random results.
+
+    :param processes: an int representing the number of worker processes, or None to use all
+    CPUs. Use 1 to simulate in the current process.
+
+    :param races_per_chunk: an int representing the number of races simulated at once by a worker.
+
+    :return: a generator of tuples containing the finishing positions, the race times and the
+    track status of the races of each chunk. See simulate_races.
+    """
+    chunk_sizes = [races_per_chunk] * (no_of_races // races_per_chunk)
+    if no_of_races % races_per_chunk > 0:
+        chunk_sizes.append(no_of_races % races_per_chunk)
+    seed_sequences = np.random.SeedSequence(seed).spawn(len(chunk_sizes))
+
+    if processes == 1:
+        for chunk_size, seed_sequence in zip(chunk_sizes, seed_sequences):
+            yield _simulate_chunk(race_setup, chunk_size, seed_sequence)
+        return
+
+    import collections
+    import os
+    from concurrent.futures import ProcessPoolExecutor
+
+    max_pending = 2 * (processes or os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        pending = collections.deque()
+        for chunk_size, seed_sequence in zip(chunk_sizes, seed_sequences):
+            pending.append(executor.submit(_simulate_chunk, race_setup, chunk_size, seed_sequence))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+
+def simulate_races(race_setup: dict, no_of_races: int = 1000, seed: int = None,
+                   processes: int = None, races_per_chunk: int = 500) -> tuple:
+    """
+    Simulates many races in parallel (Monte Carlo simulation) with overtaking, pit stops, random
+    accidents, safety cars and virtual safety cars.
+
+    The races are split into chunks of races_per_chunk races, and each chunk draws its random
+    numbers from its own stream spawned from the seed. Thus the results only depend on the seed and
+    races_per_chunk, but not on the number of processes.
+
+    :param race_setup: a dict returned by get_race_setup.
+
+    :param no_of_races: an int representing the number of races simulated.
+
+    :param seed: an int used to seed the random number generators, or None for random results.
+
+    :param processes: an int representing the number of worker processes, or None to use all
+    CPUs. Use 1 to simulate in the current process.
+
+    :param races_per_chunk: an int representing the number of races simulated at once by a worker.
+
+    :return: a tuple containing the finishing positions (a numpy.array of int8 of shape
+    (races, cars), 1 being the winner), the race times (a numpy.array of shape (races, cars), which
+    is infinite for retired cars) and the track status of each lap (a numpy.array of int8 of shape
+    (races, laps) containing SAFETY_CAR, VIRTUAL_SAFETY_CAR or 0). The cars are in the order of
+    race_setup['drivers'].
+    """
+    chunks = iter_race_chunks(race_setup, no_of_races, seed, processes, races_per_chunk)
+    positions, race_times, track_status = zip(*chunks)
+
+    return (np.concatenate(positions), np.concatenate(race_times), np.concatenate(track_status))
+
+
+def get_finishing_position_distribution(positions, drivers: list) -> object:
+    """
+    Returns the probability of each driver finishing in each position.
+
+    :param positions: a numpy.array of shape (races, cars) returned by simulate_races.
+
+    :param drivers: a list of strings containing the drivers of the cars, e.g.
+    race_setup['drivers'].
+
+    :return: a DataFrame indexed by driver, with one column per finishing position containing the
+    probabilities, and a column 'ExpectedPosition', sorted by the expected position.
+    """
+    import pandas as pd
+
+    no_of_races, no_of_cars = positions.shape
+
+    # Count the finishing positions of every car with a single bincount.
+    counts = np.bincount((np.arange(no_of_cars) * no_of_cars + positions - 1).ravel(),
+                         minlength=no_of_cars * no_of_cars).reshape(no_of_cars, no_of_cars)
+
+    distribution = pd.DataFrame(counts / no_of_races, index=pd.Index(drivers, name='Driver'),
+                                columns=np.arange(1, no_of_cars + 1))
+    distribution['ExpectedPosition'] = positions.mean(axis=0)
+
+    return distribution.sort_values('ExpectedPosition')
@@ -1,14 +1,9 @@
 """
 Contains helper functions for race simulation.
 """
+import numpy as np
 
-
-from scipy.optimize import curve_fit
-
-from practice import *
-
-# Enable the cache by providing the name of the cache folder
-ff1.Cache.enable_cache('cache')
+from constants import *
 
 
 def tyre_degradation_model(tyre_life: any, compound: str, deg_factor: float = 1) -> object:
@@ -37,12 +32,89 @@ def tyre_degradation_model(tyre_life: any, compound: str, deg_factor: float = 1)
     tyre_life = tyre_life / deg_factor
 
     # Simple tyre models with different dry compounds
-    if compound == SOFT:
-        return 0.0025 * tyre_life ** 2 + 0.05 * tyre_life - 1.5
-    elif compound == MEDIUM:
-        return 0.0008333 * tyre_life ** 2 + 0.01 * tyre_life - 0.4
-    else:
-        return 0.00007 * tyre_life ** 2 + 0.01 * tyre_life + 0
+    a, b, c = TYRE_MODEL_COEFFICIENTS.get(compound, TYRE_MODEL_COEFFICIENTS[HARD])
+    return a * tyre_life ** 2 + b * tyre_life + c
+
+
+def get_compound_codes(compounds: object) -> object:
+    """
+    Converts tyre compound strings to their integer codes in COMPOUND_CODES.
+
+    :param compounds: a list or a numpy.array of strings representing tyre compounds. Compounds
+    not defined in constants.py, e.g. 'UNKNOWN', are coded as HARD.
+
+    :return: a numpy.array of int8 containing the compound codes.
+    """
+    return np.array([COMPOUND_CODES.get(compound, COMPOUND_CODES[HARD]) for compound in
+                     compounds], dtype=np.int8)
+
+
+def get_tyre_model_coefficient_table() -> object:
+    """
+    Returns the coefficients of the tyre degradation model of each compound as a table.
+
+    :return: a numpy.array of shape (len(TYRES), 3). Row i holds the coefficients (a, b, c) of the
+    compound whose code is i.
+    """
+    return np.array([TYRE_MODEL_COEFFICIENTS.get(compound, TYRE_MODEL_COEFFICIENTS[HARD])
+                     for compound in TYRES], dtype=float)
+
+
+def tyre_degradation_model_array(tyre_life: object, compound_codes: object,
+                                 deg_factor: object = 1) -> object:
+    """
+    An array version of tyre_degradation_model, evaluating several compounds at once.
+
+    The arguments are broadcast against each other, e.g. a tyre_life of shape (laps, 1) and
+    compound_codes of shape (compounds,) evaluate the model of every compound for every lap.
+
+    :param tyre_life: a number or a numpy.array containing the tyre lives.
+
+    :param compound_codes: an int or a numpy.array containing compound codes, as defined by
+    COMPOUND_CODES in constants.py.
+
+    :param deg_factor: a float or a numpy.array containing the tyre degradation factors. See
+    tyre_degradation_model.
+
+    :return: a numpy.array containing floats representing the time loss (or gain) based on the
+    condition of the tyre.
+    """
+    coefficients = get_tyre_model_coefficient_table()[compound_codes]
+    tyre_life = np.asarray(tyre_life) / deg_factor
+
+    return (coefficients[..., 0] * tyre_life + coefficients[..., 1]) * tyre_life + \
+        coefficients[..., 2]
+
+
+def cumulative_tyre_degradation(stint_length: object, compound_codes: object,
+                                deg_factor: object = 1) -> object:
+    """
+    Returns the total time loss (or gain) of a stint on a new set of tyres, i.e. the sum of
+    tyre_degradation_model over tyre lives 1, 2, ..., stint_length.
+
+    Since the tyre degradation model is a quadratic, the sum is computed in closed form from
+    the sums of the first n integers and the first n squares. The arguments are broadcast against
+    each other like in tyre_degradation_model_array.
+
+    :param stint_length: an int or a numpy.array containing the number of laps in the stints.
+
+    :param compound_codes: an int or a numpy.array containing compound codes, as defined by
+    COMPOUND_CODES in constants.py.
+
+    :param deg_factor: a float or a numpy.array containing the tyre degradation factors. See
+    tyre_degradation_model.
+
+    :return: a numpy.array containing floats representing the time loss (or gain) of the stints.
+    """
+    coefficients = get_tyre_model_coefficient_table()[compound_codes]
+    n = np.asarray(stint_length, dtype=float)
+    deg_factor = np.asarray(deg_factor, dtype=float)
+
+    sum_of_integers = n * (n + 1) / 2
+    sum_of_squares = sum_of_integers * (2 * n + 1) / 3
+
+    return coefficients[..., 0] * sum_of_squares / deg_factor ** 2 + \
+        coefficients[..., 1] * sum_of_integers / deg_factor + coefficients[..., 2] * n
 
 
 def laptime_model(lap_numbers: object, lap_times: object, compound: str) -> object:
@@ -64,6 +136,8 @@ def laptime_model(lap_numbers: object, lap_times: object, compound: str) -> obje
     covariance of popt; and tyre_degradation_model, the function handler used for fitting the model.
     """
 
+    from scipy.optimize import curve_fit
+
     def tyre_degradation_model_beta(tyre_life: object, beta: object) -> object:
         """
 
@@ -76,3 +150,100 @@ def laptime_model(lap_numbers: object, lap_times: object, compound: str) -> obje
     popt, pcov = curve_fit(tyre_degradation_model_beta, lap_numbers, lap_times)
 
     return (popt, pcov, tyre_degradation_model)
+
+
+def get_ragged_array(arrays: list) -> tuple:
+    """
+    Concatenates arrays of different lengths into a single (ragged) array.
+
+    :param arrays: a list (or a pandas.Series) of lists or numpy.arrays, e.g. the lap times of each
+    driver.
+
+    :return: a tuple containing the concatenated values (a numpy.array of floats) and the offsets
+    (a numpy.array of ints of length len(arrays) + 1). The values of the i-th array are
+    values[offsets[i]:offsets[i + 1]].
+    """
+    lengths = [len(array) for array in arrays]
+    offsets = np.concatenate([[0], np.cumsum(lengths, dtype=int)])
+
+    if offsets[-1] == 0:
+        return (np.zeros(0), offsets)
+
+    return (np.concatenate([np.asarray(array, dtype=float) for array in arrays]), offsets)
+
+
+def batch_laptime_model(lap_numbers: object, lap_times: object, offsets: object, compound: str,
+                        fit_deg_factor: bool = False, p0: object = None) -> tuple:
+    """
+    Fits laptime_model to many sets of laps (e.g. the long runs of all drivers) at once.
+
+    With a fixed tyre curve, the only parameter beta is an offset, whose least squares estimate is
+    the mean residual of each set. All the sets are solved together in closed form, giving the
+    same popt and pcov as laptime_model. A non-linear fit (scipy.optimize.curve_fit) is only used
+    when the deg_factor of each set is fitted as well.
+
+    :param lap_numbers: a numpy.array containing the lap numbers (tyre lives) of all sets, as
+    returned by get_ragged_array.
+
+    :param lap_times: a numpy.array containing the lap times of all sets, in the same order as
+    lap_numbers.
+
+    :param offsets: a numpy.array of ints containing the offsets of the sets, as returned by
+    get_ragged_array.
+
+    :param compound: a string representing a tyre compound. Must be defined in constants.py, e.g.
+    SOFT ('SOFT'), MEDIUM ('MEDIUM') etc.
+
+    :param fit_deg_factor: a bool indicating whether the deg_factor of tyre_degradation_model is
+    fitted together with beta.
+
+    :param p0: an optional numpy.array of shape (sets, 2) containing the initial guesses of
+    (beta, deg_factor) of the non-linear fits, e.g. the popt of a previous fit. By default, the
+    non-linear fits are warm-started from the closed form beta and a deg_factor of 1.
+
+    :return: a tuple containing popt, a numpy.array of shape (sets, parameters) containing the
+    optimal values for the parameters; pcov, a numpy.array of shape (sets, parameters, parameters)
+    containing the estimated covariance of popt; and tyre_degradation_model, the function handler
+    used for fitting the model.
+    """
+    lap_numbers = np.asarray(lap_numbers, dtype=float)
+    lap_times = np.asarray(lap_times, dtype=float)
+    offsets = np.asarray(offsets)
+
+    lengths = np.diff(offsets)
+    set_indices = np.repeat(np.arange(len(lengths)), lengths)
+
+    # The least squares offset is the mean residual of each set.
+    residuals = lap_times - tyre_degradation_model(lap_numbers, compound)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        beta = np.bincount(set_indices, residuals, len(lengths)) / lengths
+
+        # The covariance estimate of curve_fit, s ** 2 * (J^T J) ^ -1, where J is a column of ones.
+        squared_errors = (residuals - beta[set_indices]) ** 2
+        variance = np.bincount(set_indices, squared_errors, len(lengths)) / (lengths - 1)
+        variance[lengths <= 1] = np.inf
+
+    if not fit_deg_factor:
+        return (beta[:, None], (variance / lengths)[:, None, None], tyre_degradation_model)
+
+    from scipy.optimize import curve_fit
+
+    if p0 is None:
+        p0 = np.column_stack([beta, np.ones(len(lengths))])
+
+    def tyre_degradation_model_beta(tyre_life: object, beta: object,
+                                    deg_factor: object) -> object:
+        return tyre_degradation_model(tyre_life, compound, deg_factor) + beta
+
+    popt = np.full((len(lengths), 2), np.nan)
+    pcov = np.full((len(lengths), 2, 2), np.inf)
+    for i in range(len(lengths)):
+        # At least as many laps as parameters are needed for a fit.
+        if lengths[i] < 2:
+            continue
+
+        laps = slice(offsets[i], offsets[i + 1])
+        popt[i], pcov[i] = curve_fit(tyre_degradation_model_beta, lap_numbers[laps],
+                                     lap_times[laps], p0=p0[i])
+
+    return (popt, pcov, tyre_degradation_model)
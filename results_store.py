@@ -0,0 +1,465 @@
+"""
+Contains helper functions for storing the results of many simulated races on disk, and
+aggregating them without loading all races into memory.
+
+A results store is a folder holding the races simulated from one race setup (see
+race_engine.get_race_setup):
+    metadata.json           the drivers, the number of laps, the pit laps of each driver, a hash
+                            of the race setup and the parameters describing it (e.g. the season
+                            and round)
+    chunk-000000.feather    the finishing positions, race times and track status of a chunk of
+                            races, one column each (see RESULT_COLUMNS), compressed with
+                            RESULTS_STORE_COMPRESSION
+    chunks.jsonl            one line per chunk: its file, number of races, seed and the smallest
+                            and largest race time of each car
+
+The store is append-only: a chunk file is complete before its line is appended to chunks.jsonl,
+so readers only see complete chunks, and an interrupted write leaves the store readable. There
+must only be one writer at a time. The aggregations read one chunk (and only the columns they
+need) at a time, so their memory does not grow with the number of races.
+
+Usage:
+    simulate_races_to_store(race_setup, 'results/2022_13', 1000000, seed=0,
+                            parameters={'season': 2022, 'round': 13})
+    get_position_distribution('results/2022_13')
+    get_race_time_quantiles('results/2022_13', [0.05, 0.5, 0.95])
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from constants import *
+
+# The columns of each chunk and their types. 'Positions' and 'RaceTimes' have one column per car
+# in the order of the drivers in the metadata, 'TrackStatus' one column per lap (see
+# race_engine.simulate_races).
+RESULT_COLUMNS = {'Positions': np.int8, 'RaceTimes': np.float64, 'TrackStatus': np.int8}
+
+# The names of the files of a store
+METADATA_FILE = 'metadata.json'
+CHUNK_INDEX_FILE = 'chunks.jsonl'
+
+
+def get_parameter_hash(race_setup: dict, parameters: dict = None) -> str:
+    """
+    Returns a hash of a race setup and the parameters describing it, which identifies the races
+    that can be stored together.
+
+    :param race_setup: a dict returned by race_engine.get_race_setup.
+
+    :param parameters: a dict of JSON serializable parameters, e.g. {'season': 2022, 'round': 13}.
+
+    :return: a string containing the hexadecimal SHA-256 hash.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps([race_setup['drivers'], race_setup['safety_car_probability'],
+                              race_setup['virtual_safety_car_probability'], parameters or {}],
+                             sort_keys=True, default=str).encode())
+    for name in ['base_lap_times', 'pit_losses', 'in_laps', 'grid_gaps']:
+        digest.update(np.ascontiguousarray(race_setup[name]).tobytes())
+
+    return digest.hexdigest()
+
+
+def create_results_store(store_dir: str, race_setup: dict, parameters: dict = None) -> dict:
+    """
+    Creates a results store for the races of a race setup, or opens it if it already holds races
+    of the same race setup and parameters.
+
+    :param store_dir: a string representing the folder of the store, e.g.
+    os.path.join(RESULTS_STORE_DIRECTORY, '2022_13'). It is created if needed.
+
+    :param race_setup: a dict returned by race_engine.get_race_setup.
+
+    :param parameters: a dict of JSON serializable parameters describing the race setup, e.g.
+    {'season': 2022, 'round': 13}, which is saved in the metadata.
+
+    :return: a dict containing the metadata of the store.
+    """
+    parameter_hash = get_parameter_hash(race_setup, parameters)
+    metadata_path = os.path.join(store_dir, METADATA_FILE)
+    if os.path.exists(metadata_path):
+        metadata = get_results_metadata(store_dir)
+        if metadata['ParameterHash'] != parameter_hash:
+            raise ValueError('The results store {} holds races of other parameters, use another '
+                             'folder'.format(store_dir))
+        return metadata
+
+    metadata = {'Drivers': list(race_setup['drivers']),
+                'NoOfLaps': int(race_setup['base_lap_times'].shape[1]),
+                'PitLaps': {driver: (np.flatnonzero(in_laps) + 1).tolist()
+                            for driver, in_laps in zip(race_setup['drivers'],
+                                                       race_setup['in_laps'])},
+                'ParameterHash': parameter_hash,
+                'Parameters': parameters or {}}
+
+    os.makedirs(store_dir, exist_ok=True)
+    with open(metadata_path + '.tmp', 'w') as file:
+        json.dump(metadata, file, indent=2, default=str)
+    os.replace(metadata_path + '.tmp', metadata_path)
+
+    return metadata
+
+
+def get_results_metadata(store_dir: str) -> dict:
+    """
+    Returns the metadata of a results store, see create_results_store.
+    """
+    with open(os.path.join(store_dir, METADATA_FILE)) as file:
+        return json.load(file)
+
+
+def get_chunks(store_dir: str) -> list:
+    """
+    Returns the complete chunks of a results store.
+
+    :param store_dir: a string representing the folder of the store.
+
+    :return: a list of dicts, one per chunk in the order they were written, containing the keys
+    'File', 'Races', 'Seed' (the entropy of the seed of the simulation, or None) and
+    'RaceTimeMin' and 'RaceTimeMax' (the smallest and largest finite race time of each car, or
+    None if the car retired in every race).
+    """
+    index_path = os.path.join(store_dir, CHUNK_INDEX_FILE)
+    if not os.path.exists(index_path):
+        return []
+
+    with open(index_path) as file:
+        lines = file.read().split('\n')
+
+    # The last line is empty, or incomplete if a write was interrupted.
+    return [json.loads(line) for line in lines[:-1]]
+
+
+def get_no_of_races(store_dir: str) -> int:
+    """
+    Returns the number of races in a results store.
+    """
+    return sum(chunk['Races'] for chunk in get_chunks(store_dir))
+
+
+def append_races(store_dir: str, positions, race_times, track_status, seed: int = None) -> dict:
+    """
+    Appends simulated races to a results store as a new chunk.
+
+    :param store_dir: a string representing the folder of the store, created by
+    create_results_store.
+
+    :param positions: a numpy.array of shape (races, cars) returned by
+    race_engine.simulate_races, with the cars in the order of the drivers of the store.
+
+    :param race_times: a numpy.array of shape (races, cars) returned by
+    race_engine.simulate_races.
+
+    :param track_status: a numpy.array of shape (races, laps) returned by
+    race_engine.simulate_races.
+
+    :param seed: an int representing the seed of the simulation, which is recorded in the chunk
+    index, or None.
+
+    :return: a dict containing the entry of the chunk in the chunk index, see get_chunks.
+    """
+    metadata = get_results_metadata(store_dir)
+    no_of_races, no_of_cars = positions.shape
+    if no_of_cars != len(metadata['Drivers']) or race_times.shape != positions.shape or \
+            track_status.shape != (no_of_races, metadata['NoOfLaps']):
+        raise ValueError('The races do not match the drivers and laps of the results store '
+                         '{}'.format(store_dir))
+
+    import pyarrow as pa
+    import pyarrow.feather as feather
+
+    file_name = 'chunk-{:06d}.feather'.format(len(get_chunks(store_dir)))
+    chunk_path = os.path.join(store_dir, file_name)
+    # Each row of a column is a fixed size list, e.g. the positions of every car in a race.
+    arrays = {'Positions': positions, 'RaceTimes': race_times, 'TrackStatus': track_status}
+    table = pa.table({column: pa.FixedSizeListArray.from_arrays(
+        pa.array(arrays[column].astype(dtype).ravel()), arrays[column].shape[1])
+        for column, dtype in RESULT_COLUMNS.items()})
+    feather.write_feather(table, chunk_path + '.tmp', compression=RESULTS_STORE_COMPRESSION)
+    os.replace(chunk_path + '.tmp', chunk_path)
+
+    # Record the range of the race times, which sets the bins of get_race_time_quantiles.
+    finite_times = np.where(np.isfinite(race_times), race_times, np.nan)
+    finished = np.isfinite(race_times).any(axis=0)
+    with np.errstate(all='ignore'):
+        minimums = np.where(finished, np.fmin.reduce(finite_times, axis=0), np.nan)
+        maximums = np.where(finished, np.fmax.reduce(finite_times, axis=0), np.nan)
+
+    chunk = {'File': file_name, 'Races': int(no_of_races), 'Seed': seed,
+             'RaceTimeMin': [float(time) if time == time else None for time in minimums],
+             'RaceTimeMax': [float(time) if time == time else None for time in maximums]}
+    with open(os.path.join(store_dir, CHUNK_INDEX_FILE), 'ab+') as file:
+        # Drop the incomplete line of an interrupted write.
+        file.seek(0)
+        contents = file.read()
+        file.truncate(contents.rfind(b'\n') + 1)
+        file.write((json.dumps(chunk) + '\n').encode())
+
+    return chunk
+
+
+def simulate_races_to_store(race_setup: dict, store_dir: str, no_of_races: int = 1000,
+                            seed: int = None, processes: int = None,
+                            races_per_chunk: int = 500,
+                            races_per_file: int = RESULTS_STORE_RACES_PER_FILE,
+                            parameters: dict = None) -> dict:
+    """
+    Simulates many races and appends them to a results store while they are simulated, so the
+    races never need to fit in memory. The races are the same as those returned by
+    race_engine.simulate_races with the same seed and races_per_chunk.
+
+    Calling it again appends more races, which must use another seed (or None).
+
+    :param race_setup: a dict returned by race_engine.get_race_setup.
+
+    :param store_dir: a string representing the folder of the store, see create_results_store.
+
+    :param no_of_races: an int representing the number of races simulated.
+
+    :param seed: an int used to seed the random number generators, or None for random results.
+
+    :param processes: an int representing the number of worker processes, or None to use all
+    CPUs. Use 1 to simulate in the current process.
+
+    :param races_per_chunk: an int representing the number of races simulated at once by a worker.
+
+    :param races_per_file: an int representing the number of races written to each chunk file.
+
+    :param parameters: a dict of JSON serializable parameters describing the race setup, see
+    create_results_store.
+
+    :return: a dict containing the metadata of the store.
+    """
+    from race_engine import iter_race_chunks
+
+    metadata = create_results_store(store_dir, race_setup, parameters)
+
+    # The entropy reproduces the races even if no seed was given.
+    entropy = np.random.SeedSequence(seed).entropy
+    if any(chunk['Seed'] == entropy for chunk in get_chunks(store_dir)):
+        raise ValueError('The results store {} already holds the races of the seed {}, use '
+                         'another seed'.format(store_dir, seed))
+
+    buffered = []
+    for chunk in iter_race_chunks(race_setup, no_of_races, entropy, processes, races_per_chunk):
+        buffered.append(chunk)
+        if sum(len(positions) for positions, _, _ in buffered) >= races_per_file:
+            append_races(store_dir, *map(np.concatenate, zip(*buffered)), seed=entropy)
+            buffered = []
+
+    if buffered:
+        append_races(store_dir, *map(np.concatenate, zip(*buffered)), seed=entropy)
+
+    return metadata
+
+
+def iter_results(store_dir: str, columns: list = None):
+    """
+    Yields the races of a results store one chunk at a time. Only the requested columns of each
+    chunk are read and decompressed.
+
+    :param store_dir: a string representing the folder of the store.
+
+    :param columns: a list of strings in RESULT_COLUMNS, or None for all columns.
+
+    :return: a generator of dicts mapping each column to a read-only numpy.array of the races of a
+    chunk, one row per race.
+    """
+    import pyarrow.feather as feather
+
+    columns = list(RESULT_COLUMNS) if columns is None else columns
+    for chunk in get_chunks(store_dir):
+        table = feather.read_table(os.path.join(store_dir, chunk['File']), columns=columns)
+        yield {column: table.column(column).combine_chunks().flatten().to_numpy()
+               .reshape(table.num_rows, -1) for column in columns}
+
+
+def get_position_distribution(store_dir: str) -> object:
+    """
+    Returns the probability of each driver finishing in each position over the races of a results
+    store, like race_engine.get_finishing_position_distribution.
+
+    :param store_dir: a string representing the folder of the store.
+
+    :return: a DataFrame indexed by driver, with one column per finishing position containing the
+    probabilities, and a column 'ExpectedPosition', sorted by the expected position.
+    """
+    import pandas as pd
+
+    drivers = get_results_metadata(store_dir)['Drivers']
+    no_of_cars = len(drivers)
+
+    counts = np.zeros(no_of_cars * no_of_cars, dtype=np.int64)
+    position_sums = np.zeros(no_of_cars, dtype=np.int64)
+    no_of_races = 0
+    for results in iter_results(store_dir, ['Positions']):
+        positions = results['Positions']
+        counts += np.bincount((np.arange(no_of_cars) * no_of_cars + positions - 1).ravel(),
+                              minlength=no_of_cars * no_of_cars)
+        position_sums += positions.sum(axis=0, dtype=np.int64)
+        no_of_races += len(positions)
+
+    distribution = pd.DataFrame(counts.reshape(no_of_cars, no_of_cars) / no_of_races,
+                                index=pd.Index(drivers, name='Driver'),
+                                columns=np.arange(1, no_of_cars + 1))
+    distribution['ExpectedPosition'] = position_sums / no_of_races
+
+    return distribution.sort_values('ExpectedPosition')
+
+
+def get_head_to_head_probabilities(store_dir: str) -> object:
+    """
+    Returns the probability of each driver finishing ahead of each other driver over the races of
+    a results store.
+
+    :param store_dir: a string representing the folder of the store.
+
+    :return: a DataFrame indexed by driver, with one column per driver, containing the probability
+    of the driver of the row finishing ahead of the driver of the column.
+    """
+    import pandas as pd
+
+    drivers = get_results_metadata(store_dir)['Drivers']
+
+    ahead = np.zeros((len(drivers), len(drivers)), dtype=np.int64)
+    no_of_races = 0
+    for results in iter_results(store_dir, ['Positions']):
+        positions = results['Positions']
+        for car in range(len(drivers) - 1):
+            ahead[car, car + 1:] += np.count_nonzero(positions[:, [car]] < positions[:, car + 1:],
+                                                     axis=0)
+        no_of_races += len(positions)
+
+    # Positions are never shared, so one of every two drivers finishes ahead.
+    lower = np.tril_indices(len(drivers), -1)
+    ahead[lower] = no_of_races - ahead.T[lower]
+
+    return pd.DataFrame(ahead / no_of_races, index=pd.Index(drivers, name='Driver'),
+                        columns=drivers)
+
+
+def _get_bins(race_times, minimums, widths, bins: int):
+    """
+    Returns the bin of each race time of a chunk, the same in every pass over the store.
+    """
+    with np.errstate(invalid='ignore'):
+        return np.clip(((race_times - minimums) / widths).astype(np.int64), 0, bins - 1)
+
+
+def get_race_time_quantiles(store_dir: str, quantiles: list = (0.05, 0.25, 0.5, 0.75, 0.95),
+                            bins: int = RESULTS_STORE_QUANTILE_BINS) -> object:
+    """
+    Returns quantiles of the race time of each driver over the races of a results store in which
+    they finished. The quantiles are exact (as numpy.quantile), but never hold all race times in
+    memory: the first pass counts the race times in bins between the smallest and largest race
+    time of each driver, and the second pass only keeps the race times in the bins holding the
+    quantiles.
+
+    :param store_dir: a string representing the folder of the store.
+
+    :param quantiles: a list of floats between 0 and 1.
+
+    :param bins: an int representing the number of bins of each driver.
+
+    :return: a DataFrame indexed by driver, with one column per quantile, and a column
+    'FinishProbability'. The quantiles are NaN for drivers who never finished.
+    """
+    import pandas as pd
+
+    drivers = get_results_metadata(store_dir)['Drivers']
+    chunks = get_chunks(store_dir)
+    no_of_cars = len(drivers)
+
+    # The range of the race times of each driver, from the chunk index.
+    minimums = np.array([[np.nan if time is None else time for time in chunk['RaceTimeMin']]
+                         for chunk in chunks]).reshape(-1, no_of_cars)
+    maximums = np.array([[np.nan if time is None else time for time in chunk['RaceTimeMax']]
+                         for chunk in chunks]).reshape(-1, no_of_cars)
+    with np.errstate(all='ignore'):
+        minimums = np.fmin.reduce(minimums, axis=0, initial=np.inf)
+        maximums = np.fmax.reduce(maximums, axis=0, initial=-np.inf)
+    widths = np.where(maximums > minimums, (maximums - minimums) / bins, 1.0)
+
+    # First pass: count the race times in each bin.
+    counts = np.zeros((no_of_cars, bins), dtype=np.int64)
+    for results in iter_results(store_dir, ['RaceTimes']):
+        race_times = results['RaceTimes']
+        finished = np.isfinite(race_times)
+        car_bins = _get_bins(race_times, minimums, widths, bins) + np.arange(no_of_cars) * bins
+        counts += np.bincount(car_bins[finished], minlength=no_of_cars * bins) \
+            .reshape(no_of_cars, bins)
+
+    # The ranks of the race times between which each quantile is interpolated, and their bins.
+    finishes = counts.sum(axis=1)
+    quantile_ranks = np.outer(np.maximum(finishes - 1, 0), np.asarray(quantiles, dtype=float))
+    lower_ranks = np.floor(quantile_ranks).astype(np.int64)
+    upper_ranks = np.minimum(lower_ranks + 1, np.maximum(finishes - 1, 0)[:, None])
+    cumulative_counts = counts.cumsum(axis=1)
+    ranks = np.concatenate([lower_ranks, upper_ranks], axis=1)
+    rank_bins = np.array([np.searchsorted(cumulative_counts[car], ranks[car], side='right')
+                          for car in range(no_of_cars)]).reshape(ranks.shape)
+    kept_bins = np.zeros((no_of_cars, bins), dtype=bool)
+    for car in np.flatnonzero(finishes):
+        kept_bins[car, rank_bins[car]] = True
+
+    # Second pass: keep the race times in the bins of the quantiles.
+    kept = [[] for _ in range(no_of_cars)]
+    for results in iter_results(store_dir, ['RaceTimes']):
+        race_times = results['RaceTimes']
+        keep = kept_bins[np.arange(no_of_cars), _get_bins(race_times, minimums, widths, bins)] & \
+            np.isfinite(race_times)
+        for car in np.flatnonzero(finishes):
+            kept[car].append(race_times[keep[:, car], car])
+
+    values = np.full(ranks.shape, np.nan)
+    for car in range(no_of_cars):
+        if finishes[car] == 0:
+            continue
+
+        # The rank of a race time among the kept race times is its rank among all race times,
+        # minus the race times in the bins before it that were not kept.
+        kept_times = np.sort(np.concatenate(kept[car]))
+        kept_counts = np.where(kept_bins[car], counts[car], 0)
+        offsets = cumulative_counts[car] - counts[car] - \
+            (np.cumsum(kept_counts) - kept_counts)
+        values[car] = kept_times[ranks[car] - offsets[rank_bins[car]]]
+
+    no_of_quantiles = len(quantiles)
+    lower_values, upper_values = values[:, :no_of_quantiles], values[:, no_of_quantiles:]
+    result = lower_values + (quantile_ranks - lower_ranks) * (upper_values - lower_values)
+
+    table = pd.DataFrame(result, index=pd.Index(drivers, name='Driver'), columns=list(quantiles))
+    table['FinishProbability'] = finishes / sum(chunk['Races'] for chunk in chunks)
+
+    return table
+
+
+def get_track_status_probabilities(store_dir: str) -> object:
+    """
+    Returns the probability of a safety car and of a virtual safety car on each lap over the races
+    of a results store.
+
+    :param store_dir: a string representing the folder of the store.
+
+    :return: a DataFrame indexed by lap number, with the columns 'SafetyCar' and
+    'VirtualSafetyCar'.
+    """
+    import pandas as pd
+
+    no_of_laps = get_results_metadata(store_dir)['NoOfLaps']
+
+    safety_car_laps = np.zeros(no_of_laps, dtype=np.int64)
+    virtual_safety_car_laps = np.zeros(no_of_laps, dtype=np.int64)
+    no_of_races = 0
+    for results in iter_results(store_dir, ['TrackStatus']):
+        track_status = results['TrackStatus']
+        safety_car_laps += (track_status == SAFETY_CAR).sum(axis=0)
+        virtual_safety_car_laps += (track_status == VIRTUAL_SAFETY_CAR).sum(axis=0)
+        no_of_races += len(track_status)
+
+    return pd.DataFrame({'SafetyCar': safety_car_laps / no_of_races,
+                         'VirtualSafetyCar': virtual_safety_car_laps / no_of_races},
+                        index=pd.Index(np.arange(1, no_of_laps + 1), name='LapNumber'))
@@ -0,0 +1,644 @@
+"""
+Runs a local HTTP/JSON service answering questions about a race weekend while it happens, e.g.
+"the best 2-stop strategy of NOR if their HARD deg is 10% worse", without reloading the sessions
+or refitting the models for each question.
+
+The artifacts of each weekend (see pipeline.py) and the tyre models of FP2 are loaded once and kept
+in memory, as are the strategy tables and the simulations of previous questions, in LRU caches of
+SERVICE_WEEKEND_CACHE_SIZE weekends, SERVICE_STRATEGY_CACHE_SIZE strategy tables and
+SERVICE_SIMULATION_CACHE_SIZE simulations. Loading a weekend, optimizing strategies and simulating
+races run in a pool of worker processes, so the service keeps answering the questions whose
+results are cached. Identical questions asked at the same time share one computation.
+
+Usage, from the root of the project:
+    python service.py [--port 8050] [--out-dir weekends] [--cache-dir cache] [--processes 2]
+    python service.py --preload 2022 13 --preload 2022 14
+
+Questions are POST requests with a JSON object containing the 'season' and the 'round' of the
+weekend, and optionally:
+    /weekend        the event, the drivers and the parameters of the track
+    /head_to_head   the teammate comparison and long run estimate of each driver
+    /long_runs      the FP2 long runs, for 'drivers'
+    /tyre_models    the FP2 tyre models, for 'drivers'
+    /strategies     the fastest strategies, for 'drivers', 'no_of_stops', 'max_stops', 'top_k' and
+                    'deg_factor_changes'
+    /simulation     the finishing position distribution, for 'races', 'seed', 'max_stops', 'top_k'
+                    and 'deg_factor_changes'
+The answer is a JSON object with the 'result' and the 'seconds' it took, or the 'error'. GET
+/status returns the sizes, hits and misses of the caches.
+
+'deg_factor_changes' scales deg factors, e.g. {"HARD": 1.1} makes the HARD tyres of every driver
+degrade 10% faster, and {"NOR": {"HARD": 1.1}} only those of NOR.
+
+Example:
+    curl -d '{"season": 2022, "round": 13, "drivers": ["NOR"], "no_of_stops": 2,
+              "deg_factor_changes": {"NOR": {"HARD": 1.1}}}' http://127.0.0.1:8050/strategies
+"""
+import argparse
+import asyncio
+import functools
+import json
+import sys
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from constants import *
+
+# The stages of pipeline.py run when loading a weekend, and the artifacts kept in memory
+WEEKEND_STAGES = ['load', 'qualifying', 'fp2', 'driver_stats', 'h2h', 'strategy']
+WEEKEND_ARTIFACTS = ['weekend', 'fp2_laps', 'fp2_race_sim', 'h2h', 'driver_tyre_data']
+
+DEG_FACTOR_COLUMNS = [compound.title() + 'DegFactor' for compound in DRY_TYRES]
+
+# The maximum size of each cache
+CACHE_SIZES = {'weekends': SERVICE_WEEKEND_CACHE_SIZE, 'strategies': SERVICE_STRATEGY_CACHE_SIZE,
+               'simulations': SERVICE_SIMULATION_CACHE_SIZE}
+
+HTTP_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                500: 'Internal Server Error'}
+
+# Maps the path of each question to its coroutine function, which takes the service and the JSON
+# object of the request and returns the result.
+QUERIES = {}
+
+
+def query(path: str):
+    """
+    Registers a question under a path.
+    """
+    def register(function):
+        QUERIES[path] = function
+        return function
+
+    return register
+
+
+def _start_worker() -> None:
+    """
+    Imports the modules used by the workers when a worker starts, so the first question does not
+    wait for them.
+    """
+    import pandas  # noqa: F401
+
+    import pipeline  # noqa: F401
+    import race_engine  # noqa: F401
+    import strategy  # noqa: F401
+
+
+def _load_weekend(season: int, round_number: int, out_dir: str, cache_dir: str,
+                  offline: bool) -> dict:
+    """
+    Runs the stages of a weekend that are not up to date (see pipeline.run_pipeline), and returns
+    the artifacts kept in memory, the parameters of the track and the FP2 tyre models. Runs in a
+    worker process.
+    """
+    from pipeline import get_parser, get_track_parameters, get_weekend_dir, read_artifacts, \
+        run_pipeline
+    from practice import get_tyre_model_table
+
+    options = [str(season), str(round_number), '--out-dir', out_dir, '--processes', '1',
+               '--stages'] + WEEKEND_STAGES
+    if cache_dir is not None:
+        options += ['--cache-dir', cache_dir]
+    if offline:
+        options.append('--offline')
+    run_pipeline(get_parser().parse_args(options))
+
+    weekend = read_artifacts(get_weekend_dir(out_dir, season, round_number), WEEKEND_ARTIFACTS)
+    weekend['strategy_parameters'] = get_track_parameters(weekend['weekend'], False)
+    weekend['simulation_parameters'] = get_track_parameters(weekend['weekend'], True)
+    weekend['tyre_models'] = get_tyre_model_table(weekend['fp2_laps']).reset_index()
+
+    return weekend
+
+
+def _optimize_strategies(driver_tyre_data, strategy_parameters: dict, max_stops: int,
+                         top_k: int) -> object:
+    """
+    Returns the fastest strategies of each driver. Runs in a worker process.
+    """
+    from strategy import get_optimal_strategies_cached
+
+    return get_optimal_strategies_cached(driver_tyre_data, max_stops=max_stops, top_k=top_k,
+                                         **strategy_parameters)
+
+
+def _simulate_weekend(driver_tyre_data, strategies, simulation_parameters: dict, races: int,
+                      seed: int) -> object:
+    """
+    Simulates the race from the qualifying positions, like pipeline.simulate_weekend, and returns
+    the finishing position distribution. Runs in a worker process.
+    """
+    from race_engine import get_finishing_position_distribution, get_race_setup, simulate_races
+
+    race_data = driver_tyre_data.rename(columns={'QualifyingPosition': 'GridPosition'})
+    race_setup = get_race_setup(race_data, strategies, **simulation_parameters)
+    positions, _, _ = simulate_races(race_setup, races, seed, processes=1)
+
+    return get_finishing_position_distribution(positions, race_setup['drivers']).reset_index()
+
+
+def create_service(out_dir: str = 'weekends', cache_dir: str = None, offline: bool = False,
+                   processes: int = None) -> dict:
+    """
+    Returns the state of a service: its caches and its pool of worker processes.
+
+    :param out_dir: a string representing the folder of the artifacts of each weekend, see
+    pipeline.py.
+
+    :param cache_dir: a string representing the folder of the FastF1 cache, see
+    config.enable_cache.
+
+    :param offline: a bool indicating whether to only use the FastF1 cache.
+
+    :param processes: an int representing the number of worker processes, or None to use all
+    CPUs.
+
+    :return: a dict containing the state of the service, see close_service.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    return {'out_dir': out_dir, 'cache_dir': cache_dir, 'offline': offline,
+            'executor': ProcessPoolExecutor(max_workers=processes, initializer=_start_worker),
+            'caches': {name: OrderedDict() for name in CACHE_SIZES},
+            'counters': {name: {'hits': 0, 'misses': 0} for name in CACHE_SIZES},
+            'pending': {}, 'requests': 0}
+
+
+def close_service(service: dict) -> None:
+    """
+    Stops the worker processes of a service.
+    """
+    service['executor'].shutdown(cancel_futures=True)
+
+
+def add_weekend(service: dict, season: int, round_number: int, weekend: dict) -> None:
+    """
+    Adds a weekend to the cache of a service, e.g. to answer questions about a weekend analysed in
+    a notebook. The cached strategies and simulations of the weekend are forgotten.
+
+    :param weekend: a dict mapping each of WEEKEND_ARTIFACTS, 'strategy_parameters',
+    'simulation_parameters' and 'tyre_models' to its value, like _load_weekend.
+    """
+    for cache_name in ['strategies', 'simulations']:
+        cache = service['caches'][cache_name]
+        for key in [key for key in cache if key[0] == (season, round_number)]:
+            del cache[key]
+
+    _store(service, 'weekends', (season, round_number), _prepare_weekend(weekend))
+
+
+def _to_json(value) -> object:
+    """
+    Converts a numpy.array or a numpy scalar to a JSON value.
+    """
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+
+    raise TypeError('{} is not JSON serializable'.format(type(value).__name__))
+
+
+def _to_records(df) -> list:
+    """
+    Converts a DataFrame to a list of dicts of JSON values, one per row, with None for the missing
+    and infinite values (e.g. the base time variance of a driver without a long run).
+    """
+    df = df.copy()
+    for column in df.select_dtypes('float').columns:
+        df[column] = df[column].where(np.isfinite(df[column]))
+    records = df.astype(object).where(df.notna(), None).to_dict(orient='records')
+
+    return [{column: _to_json(value) if isinstance(value, (np.ndarray, np.generic)) else value
+             for column, value in record.items()} for record in records]
+
+
+def _prepare_weekend(weekend: dict) -> dict:
+    """
+    Adds the data used by every question to a weekend: its key, the index and deg factors of each
+    driver, and the answers of the questions that do not depend on any option, as JSON values.
+    """
+    driver_tyre_data = weekend['driver_tyre_data']
+    weekend['key'] = tuple(int(value) for value in
+                           weekend['weekend'][['Season', 'Round']].iloc[0].tolist())
+    weekend['drivers'] = {driver: i for i, driver in enumerate(driver_tyre_data['Driver'])}
+    weekend['deg_factors'] = driver_tyre_data[DEG_FACTOR_COLUMNS].to_numpy(dtype=float)
+    weekend['records'] = {artifact: _to_records(weekend[artifact])
+                          for artifact in ['h2h', 'fp2_race_sim', 'tyre_models']}
+
+    return weekend
+
+
+def _store(service: dict, cache_name: str, key: tuple, value) -> None:
+    """
+    Adds a value to a cache, and evicts the least recently used entries beyond its maximum size.
+    """
+    cache = service['caches'][cache_name]
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > CACHE_SIZES[cache_name]:
+        cache.popitem(last=False)
+
+
+def _on_computed(service: dict, cache_name: str, key: tuple, future) -> None:
+    """
+    Caches the result of a computation when it succeeded.
+    """
+    del service['pending'][(cache_name, key)]
+    if not future.cancelled() and future.exception() is None:
+        _store(service, cache_name, key, future.result())
+
+
+async def _get_cached(service: dict, cache_name: str, key: tuple, compute) -> object:
+    """
+    Returns the value of a key in a cache, computing it with a coroutine function if it is missing.
+    A computation is shared by all the questions waiting for the same key, and is not cancelled
+    when one of them disconnects.
+    """
+    cache = service['caches'][cache_name]
+    if key in cache:
+        cache.move_to_end(key)
+        service['counters'][cache_name]['hits'] += 1
+        return cache[key]
+
+    service['counters'][cache_name]['misses'] += 1
+    future = service['pending'].get((cache_name, key))
+    if future is None:
+        future = asyncio.ensure_future(compute())
+        service['pending'][(cache_name, key)] = future
+        future.add_done_callback(functools.partial(_on_computed, service, cache_name, key))
+
+    return await asyncio.shield(future)
+
+
+async def _run_in_worker(service: dict, function, *args) -> object:
+    """
+    Runs a function in a worker process of a service.
+    """
+    return await asyncio.get_running_loop().run_in_executor(service['executor'], function, *args)
+
+
+def _get_field(body: dict, name: str, field_type: type, default: object = None) -> object:
+    """
+    Returns a field of the JSON object of a question, or its default if it is missing.
+
+    :raises ValueError: if the field is missing without a default, or has the wrong type.
+    """
+    if name not in body:
+        if default is None:
+            raise ValueError("The field '{}' is missing".format(name))
+        return default
+
+    value = body[name]
+    if field_type is int and isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if not isinstance(value, field_type) or (isinstance(value, bool) and field_type is not bool):
+        raise ValueError("The field '{}' must be of type {}".format(name, field_type.__name__))
+
+    return value
+
+
+async def get_weekend(service: dict, season: int, round_number: int) -> dict:
+    """
+    Returns a weekend from the cache of a service, loading it in a worker process if needed.
+
+    :return: a dict like add_weekend.
+    """
+    async def load():
+        return _prepare_weekend(await _run_in_worker(
+            service, _load_weekend, season, round_number, service['out_dir'],
+            service['cache_dir'], service['offline']))
+
+    return await _get_cached(service, 'weekends', (season, round_number), load)
+
+
+async def _get_question_weekend(service: dict, body: dict) -> dict:
+    """
+    Returns the weekend of a question.
+    """
+    return await get_weekend(service, _get_field(body, 'season', int),
+                             _get_field(body, 'round', int))
+
+
+def _get_drivers(body: dict, weekend: dict) -> list:
+    """
+    Returns the indices of the drivers of a question in the weekend, defaulting to all drivers.
+
+    :raises ValueError: if a driver is not in the weekend.
+    """
+    if 'drivers' not in body:
+        return list(range(len(weekend['drivers'])))
+
+    drivers = _get_field(body, 'drivers', list)
+    unknown = [driver for driver in drivers if driver not in weekend['drivers']]
+    if unknown:
+        raise ValueError('Unknown drivers: {}'.format(', '.join(map(str, unknown))))
+
+    return [weekend['drivers'][driver] for driver in drivers]
+
+
+def _select_records(records: list, weekend: dict, drivers: list) -> list:
+    """
+    Returns the records of drivers, given by their indices in the weekend.
+    """
+    names = set(weekend['driver_tyre_data']['Driver'].iloc[drivers])
+
+    return [record for record in records if record['Driver'] in names]
+
+
+def get_changed_deg_factors(weekend: dict, changes: dict) -> object:
+    """
+    Returns the deg factors of the drivers of a weekend, scaled by changes.
+
+    :param weekend: a dict returned by get_weekend.
+
+    :param changes: a dict mapping each compound to the scale of its deg factor for all drivers
+    (e.g. {'HARD': 1.1}), or each driver to such a dict (e.g. {'NOR': {'HARD': 1.1}}).
+
+    :return: a numpy.array of shape (drivers, 3) containing the deg factors of DRY_TYRES.
+
+    :raises ValueError: if a compound or a driver is unknown.
+    """
+    deg_factors = weekend['deg_factors'].copy()
+    for name, change in changes.items():
+        if isinstance(change, dict):
+            if name not in weekend['drivers']:
+                raise ValueError('Unknown driver: {}'.format(name))
+            rows = weekend['drivers'][name]
+        else:
+            rows = slice(None)
+            change = {name: change}
+
+        for compound, scale in change.items():
+            if compound not in DRY_TYRES or not isinstance(scale, (int, float)):
+                raise ValueError('Deg factor changes map {} to a number, not {}: {}'.format(
+                    ', '.join(DRY_TYRES), compound, scale))
+            deg_factors[rows, DRY_TYRES.index(compound)] *= scale
+
+    return deg_factors
+
+
+def _get_driver_tyre_data(weekend: dict, drivers: list, deg_factors) -> object:
+    """
+    Returns the 'driver_tyre_data' of drivers at a weekend with changed deg factors.
+    """
+    driver_tyre_data = weekend['driver_tyre_data'].iloc[drivers].reset_index(drop=True)
+    driver_tyre_data[DEG_FACTOR_COLUMNS] = deg_factors[drivers]
+
+    return driver_tyre_data
+
+
+async def get_strategies(service: dict, weekend: dict, drivers: list, deg_factors,
+                         max_stops: int, top_k: int) -> dict:
+    """
+    Returns the fastest strategies of drivers at a weekend from the cache of a service, optimizing
+    them in a worker process if needed.
+
+    :param drivers: a list of ints representing the indices of the drivers in the weekend.
+
+    :param deg_factors: a numpy.array returned by get_changed_deg_factors.
+
+    :return: a dict with the keys 'strategies' (a DataFrame like strategy.get_optimal_strategies)
+    and 'records' (its rows as JSON values).
+    """
+    # The strategies only change with the deg factors rounded like in the strategy cache.
+    rounded = np.rint(deg_factors[drivers] / DEG_FACTOR_QUANTUM).astype(np.int64)
+    key = (weekend['key'], max_stops, top_k, tuple(drivers), rounded.tobytes())
+
+    async def optimize():
+        strategies = await _run_in_worker(
+            service, _optimize_strategies, _get_driver_tyre_data(weekend, drivers, deg_factors),
+            weekend['strategy_parameters'], max_stops, top_k)
+        return {'strategies': strategies, 'records': _to_records(strategies)}
+
+    return await _get_cached(service, 'strategies', key, optimize)
+
+
+@query('/weekend')
+async def query_weekend(service: dict, body: dict) -> dict:
+    """
+    Returns the event, the drivers and the parameters of the track of a weekend.
+    """
+    weekend = await _get_question_weekend(service, body)
+
+    return {'event': weekend['weekend']['Event'].iloc[0], 'drivers': list(weekend['drivers']),
+            'strategy_parameters': weekend['strategy_parameters'],
+            'simulation_parameters': weekend['simulation_parameters']}
+
+
+@query('/head_to_head')
+async def query_head_to_head(service: dict, body: dict) -> list:
+    """
+    Returns the teammate comparison and the long run estimate of each driver, see
+    prediction.get_head_to_head_df.
+    """
+    weekend = await _get_question_weekend(service, body)
+
+    return weekend['records']['h2h']
+
+
+@query('/long_runs')
+async def query_long_runs(service: dict, body: dict) -> list:
+    """
+    Returns the FP2 long runs of drivers, see practice.get_long_run_pace_df.
+    """
+    weekend = await _get_question_weekend(service, body)
+
+    return _select_records(weekend['records']['fp2_race_sim'], weekend,
+                           _get_drivers(body, weekend))
+
+
+@query('/tyre_models')
+async def query_tyre_models(service: dict, body: dict) -> list:
+    """
+    Returns the FP2 tyre models of drivers, see practice.get_tyre_model_table.
+    """
+    weekend = await _get_question_weekend(service, body)
+
+    return _select_records(weekend['records']['tyre_models'], weekend,
+                           _get_drivers(body, weekend))
+
+
+@query('/strategies')
+async def query_strategies(service: dict, body: dict) -> list:
+    """
+    Returns the fastest strategies of drivers, optionally only those with 'no_of_stops' stops.
+    """
+    weekend = await _get_question_weekend(service, body)
+    deg_factors = get_changed_deg_factors(weekend,
+                                          _get_field(body, 'deg_factor_changes', dict, {}))
+
+    strategies = await get_strategies(service, weekend, _get_drivers(body, weekend), deg_factors,
+                                      _get_field(body, 'max_stops', int, 2),
+                                      _get_field(body, 'top_k', int, 3))
+    if 'no_of_stops' not in body:
+        return strategies['records']
+
+    no_of_stops = _get_field(body, 'no_of_stops', int)
+
+    return [record for record in strategies['records'] if record['NoOfStops'] == no_of_stops]
+
+
+@query('/simulation')
+async def query_simulation(service: dict, body: dict) -> list:
+    """
+    Returns the probability of each driver finishing in each position, see
+    race_engine.get_finishing_position_distribution.
+    """
+    weekend = await _get_question_weekend(service, body)
+    deg_factors = get_changed_deg_factors(weekend,
+                                          _get_field(body, 'deg_factor_changes', dict, {}))
+    max_stops = _get_field(body, 'max_stops', int, 2)
+    top_k = _get_field(body, 'top_k', int, 3)
+    races = _get_field(body, 'races', int, 1000)
+    seed = _get_field(body, 'seed', int, 0)
+    if races < 1:
+        raise ValueError("The field 'races' must be positive")
+
+    drivers = list(range(len(weekend['drivers'])))
+    key = (weekend['key'], max_stops, top_k, races, seed, deg_factors.tobytes())
+
+    async def simulate():
+        strategies = await get_strategies(service, weekend, drivers, deg_factors, max_stops,
+                                          top_k)
+        distribution = await _run_in_worker(
+            service, _simulate_weekend, _get_driver_tyre_data(weekend, drivers, deg_factors),
+            strategies['strategies'], weekend['simulation_parameters'], races, seed)
+        return _to_records(distribution)
+
+    return await _get_cached(service, 'simulations', key, simulate)
+
+
+def get_service_status(service: dict) -> dict:
+    """
+    Returns the number of requests, the number of pending computations and the size, maximum size,
+    hits and misses of each cache of a service.
+    """
+    return {'requests': service['requests'], 'pending': len(service['pending']),
+            'caches': {name: dict(service['counters'][name], size=len(cache),
+                                  max_size=CACHE_SIZES[name])
+                       for name, cache in service['caches'].items()}}
+
+
+async def answer(service: dict, method: str, path: str, body: bytes) -> tuple:
+    """
+    Answers a request.
+
+    :return: a tuple containing the HTTP status code and the JSON object of the answer.
+    """
+    service['requests'] += 1
+    path = path.split('?')[0]
+    if method == 'GET' and path == '/status':
+        return 200, get_service_status(service)
+    if path not in QUERIES:
+        return 404, {'error': 'Unknown question {}, ask one of {}'.format(path, list(QUERIES))}
+    if method != 'POST':
+        return 405, {'error': 'Questions are POST requests'}
+
+    start = time.perf_counter()
+    try:
+        request = json.loads(body or b'{}')
+        if not isinstance(request, dict):
+            raise ValueError('The body must be a JSON object')
+        result = await QUERIES[path](service, request)
+    except ValueError as error:
+        return 400, {'error': str(error)}
+    except Exception as error:
+        return 500, {'error': '{}: {}'.format(type(error).__name__, error)}
+
+    return 200, {'result': result, 'seconds': time.perf_counter() - start}
+
+
+def _format_response(status: int, answer_json: dict, keep_alive: bool) -> bytes:
+    """
+    Returns the bytes of an HTTP response containing a JSON object.
+    """
+    content = json.dumps(answer_json, default=_to_json).encode()
+    headers = ['HTTP/1.1 {} {}'.format(status, HTTP_REASONS[status]),
+               'Content-Type: application/json', 'Content-Length: {}'.format(len(content)),
+               'Connection: {}'.format('keep-alive' if keep_alive else 'close')]
+
+    return '\r\n'.join(headers).encode('latin-1') + b'\r\n\r\n' + content
+
+
+async def handle_connection(service: dict, reader, writer) -> None:
+    """
+    Answers the requests of a connection, keeping it open between requests unless the client asks
+    to close it.
+    """
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line.strip():
+                break
+            method, path, version = request_line.decode('latin-1').split()
+
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if not line.strip():
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+            status, answer_json = await answer(service, method, path, body)
+            keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+            writer.write(_format_response(status, answer_json, keep_alive))
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+        # The client disconnected or sent a malformed request.
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(service: dict, host: str = SERVICE_HOST, port: int = SERVICE_PORT,
+                preload: list = ()) -> None:
+    """
+    Answers requests until cancelled.
+
+    :param preload: a list of tuples (season, round) of the weekends loaded when the service
+    starts.
+    """
+    server = await asyncio.start_server(functools.partial(handle_connection, service), host, port)
+    # Keep references to the preloading tasks, so they are not garbage collected.
+    service['preloading'] = [asyncio.ensure_future(get_weekend(service, season, round_number))
+                             for season, round_number in preload]
+    print('Listening on http://{}:{}'.format(host, port))
+
+    async with server:
+        await server.serve_forever()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--host', default=SERVICE_HOST)
+    parser.add_argument('--port', type=int, default=SERVICE_PORT)
+    parser.add_argument('--out-dir', default='weekends',
+                        help='the folder of the artifacts of each weekend')
+    parser.add_argument('--cache-dir', help='the folder of the FastF1 cache')
+    parser.add_argument('--offline', action='store_true', help='only use the FastF1 cache')
+    parser.add_argument('--processes', type=int, help='the number of worker processes')
+    parser.add_argument('--preload', nargs=2, type=int, action='append', default=[],
+                        metavar=('SEASON', 'ROUND'), help='load a weekend when starting')
+
+    args = parser.parse_args()
+    service = create_service(args.out_dir, args.cache_dir, args.offline, args.processes)
+    try:
+        asyncio.run(serve(service, args.host, args.port, args.preload))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        close_service(service)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,154 @@
+"""
+Contains helper functions for storing the laps of sessions locally, so they do not need to be
+parsed from the FastF1 cache again.
+
+The laps are normalized (e.g. lap times in seconds) and stored as Parquet files partitioned by
+season, event and session, i.e. <store>/season=2022/event=Hungarian Grand Prix/session=FP2/.
+Loading only reads the requested partitions, columns and drivers.
+"""
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from constants import *
+
+# The columns of a normalized lap table
+LAP_COLUMNS = ['Driver', 'Team', 'LapNumber', 'LapTime', 'LapStartTime', 'Compound', 'TyreLife',
+               'Stint', 'TrackStatus', 'PitIn', 'PitOut', 'IsAccurate', 'SpeedFL', 'SpeedST']
+
+# The columns used to partition the store
+PARTITION_SCHEMA = pa.schema([('season', pa.int16()), ('event', pa.string()),
+                              ('session', pa.string())])
+
+
+def normalize_laps(df) -> object:
+    """
+    Returns a normalized copy of the laps of a session, without changing the laps.
+
+    The lap times are converted to seconds, and the pit in and pit out times are replaced by
+    booleans indicating in laps and out laps. Missing compounds and track statuses stay missing,
+    e.g. so that get_track_status_flags of race.py gives them the flag NO_TRACK_STATUS.
+
+    :param df: A DataFrame containing data of a session. Usually this is a fastf1.core.Laps object
+
+    :return: a DataFrame containing the columns in LAP_COLUMNS, sorted by driver and lap number.
+    """
+    laps = pd.DataFrame({
+        'Driver': df['Driver'].astype(str),
+        'Team': df['Team'].astype(str),
+        'LapNumber': df['LapNumber'].astype('float32'),
+        'LapTime': df['LapTime'].dt.total_seconds(),
+        'LapStartTime': df['LapStartTime'].dt.total_seconds(),
+        'Compound': df['Compound'].astype(str).where(df['Compound'].notnull()),
+        'TyreLife': df['TyreLife'].astype('float32'),
+        'Stint': df['Stint'].astype('float32'),
+        'TrackStatus': df['TrackStatus'].astype(str).where(df['TrackStatus'].notnull()),
+        'PitIn': df['PitInTime'].notnull(),
+        'PitOut': df['PitOutTime'].notnull(),
+        'IsAccurate': df['IsAccurate'].astype(bool),
+        'SpeedFL': df['SpeedFL'].astype('float32'),
+        'SpeedST': df['SpeedST'].astype('float32'),
+    })
+
+    return laps.sort_values(['Driver', 'LapNumber'], kind='stable').reset_index(drop=True)
+
+
+def write_session(laps, season: int, event: str, session: str,
+                  store_dir: str = SESSION_STORE_DIRECTORY) -> None:
+    """
+    Writes the normalized laps of a session to the store, replacing any previous version.
+
+    :param laps: a DataFrame returned by normalize_laps.
+
+    :param season: an int representing the season, e.g. 2022.
+
+    :param event: a string representing the event, e.g. 'Hungarian Grand Prix'.
+
+    :param session: a string representing the session, e.g. 'FP2', 'Q' or 'R'.
+
+    :param store_dir: a string representing the folder of the store.
+    """
+    table = pa.Table.from_pandas(laps, preserve_index=False)
+    table = table.append_column('season', pa.array(np.full(len(laps), season), pa.int16()))
+    table = table.append_column('event', pa.array([event] * len(laps), pa.string()))
+    table = table.append_column('session', pa.array([session] * len(laps), pa.string()))
+
+    ds.write_dataset(table, store_dir, format='parquet',
+                     partitioning=ds.partitioning(PARTITION_SCHEMA, flavor='hive'),
+                     existing_data_behavior='delete_matching')
+
+
+def store_session(session, store_dir: str = SESSION_STORE_DIRECTORY) -> object:
+    """
+    Normalizes the laps of a loaded session and writes them to the store.
+
+    :param session: a loaded fastf1.core.Session object, e.g. ff1.get_session(2022, 11, 'FP2')
+    after calling load().
+
+    :param store_dir: a string representing the folder of the store.
+
+    :return: a DataFrame containing the normalized laps.
+    """
+    laps = normalize_laps(session.laps)
+    write_session(laps, session.date.year, session.event['EventName'],
+                  SESSION_NAMES.get(session.name, session.name), store_dir)
+
+    return laps
+
+
+def load_laps(store_dir: str = SESSION_STORE_DIRECTORY, seasons: list = None,
+              events: list = None, sessions: list = None, drivers: list = None,
+              columns: list = None) -> object:
+    """
+    Loads laps from the store. Only the matching partitions, columns and drivers are read.
+
+    :param store_dir: a string representing the folder of the store.
+
+    :param seasons: a list of ints representing the seasons to load, or None for all seasons.
+
+    :param events: a list of strings representing the events to load, or None for all events.
+
+    :param sessions: a list of strings representing the sessions to load, e.g. ['FP2'], or None
+    for all sessions.
+
+    :param drivers: a list of strings representing the abbreviations of the drivers to load, or
+    None for all drivers.
+
+    :param columns: a list of strings representing the columns to load, or None for all columns.
+    The partition columns 'season', 'event' and 'session' can be requested as well.
+
+    :return: a DataFrame containing the laps.
+    """
+    dataset = ds.dataset(store_dir, format='parquet',
+                         partitioning=ds.partitioning(PARTITION_SCHEMA, flavor='hive'))
+
+    # Build a filter, which is pushed down to the partitions and the Parquet row groups.
+    conditions = [(ds.field('season'), seasons), (ds.field('event'), events),
+                  (ds.field('session'), sessions), (ds.field('Driver'), drivers)]
+    row_filter = None
+    for field, values in conditions:
+        if values is None:
+            continue
+
+        condition = field.isin(values)
+        row_filter = condition if row_filter is None else row_filter & condition
+
+    return dataset.to_table(columns=columns, filter=row_filter).to_pandas()
+
+
+def get_stored_sessions(store_dir: str = SESSION_STORE_DIRECTORY) -> object:
+    """
+    Returns the sessions in the store.
+
+    :param store_dir: a string representing the folder of the store.
+
+    :return: a DataFrame with the columns 'season', 'event' and 'session', one row per session.
+    """
+    dataset = ds.dataset(store_dir, format='parquet',
+                         partitioning=ds.partitioning(PARTITION_SCHEMA, flavor='hive'))
+    partitions = [ds.get_partition_keys(fragment.partition_expression)
+                  for fragment in dataset.get_fragments()]
+
+    return pd.DataFrame(partitions, columns=['season', 'event', 'session']).drop_duplicates() \
+        .sort_values(['season', 'event', 'session']).reset_index(drop=True)
@@ -0,0 +1,617 @@
+"""
+Contains helper functions for optimizing race strategies.
+"""
+from collections import OrderedDict
+
+import numpy as np
+
+from constants import *
+from race_sim import cumulative_tyre_degradation, get_tyre_model_coefficient_table
+
+
+def get_stint_cost_table(compound: str, deg_factor: object, max_stint_length: int) -> object:
+    """
+    Returns the cumulative time loss (or gain) of a stint for every stint length up to
+    max_stint_length.
+
+    :param compound: a string representing a tyre compound. Must be defined in constants.py, e.g.
+    SOFT ('SOFT'), MEDIUM ('MEDIUM') etc.
+
+    :param deg_factor: A float indicating the tyre degradation factor of the driver, or a
+    numpy.array of them to compute one table per deg_factor. See race_sim.tyre_degradation_model.
+
+    :param max_stint_length: an int representing the longest stint (in laps) in the table.
+
+    :return: a numpy.array of length max_stint_length + 1 (or of shape
+    (len(deg_factor), max_stint_length + 1)). The n-th entry is the total time loss of a stint of n
+    laps on a new set of the compound, i.e. the sum of the tyre degradation model over tyre lives
+    1, 2, ..., n. The 0-th entry is 0.
+    """
+    stint_lengths = np.arange(max_stint_length + 1)
+    deg_factor = np.asarray(deg_factor, dtype=float)[..., None]
+
+    return cumulative_tyre_degradation(stint_lengths, COMPOUND_CODES[compound], deg_factor)
+
+
+def _add_stint(costs, stint_costs, top_k, last_stint_lengths=None, laps=None):
+    """
+    Extends the best strategies of a sequence of stints by one more stint.
+
+    :param costs: a numpy.array of shape (drivers, laps + 1, top_k). costs[d, l, k] is the k-th best
+    time loss of driver d covering exactly l laps with the stints so far.
+
+    :param stint_costs: a numpy.array of shape (drivers, laps + 1) containing the stint cost table
+    of the added compound for each driver.
+
+    :param top_k: an int representing the number of best strategies kept for each lap count.
+
+    :param last_stint_lengths: a numpy.array of shape (drivers, laps + 1, top_k) containing the
+    length of the last stint of each strategy so far if it uses the added compound, or None. The
+    added stint is then at most as long, so the same stints in another order are only found once.
+
+    :param laps: a list of ints representing the lap counts of the extended strategies, or None
+    for every lap count. The costs of the other lap counts are infinite.
+
+    :return: a tuple containing the costs of the extended strategies, the length of the added stint
+    and the rank of the strategy it extends. All three are numpy.arrays of shape
+    (drivers, laps + 1, top_k).
+    """
+    no_of_drivers, no_of_laps_plus_one, _ = costs.shape
+    max_stint_length = no_of_laps_plus_one - 1
+
+    def get_windows(values, fill_value):
+        # Window j of lap l and rank k holds the value of the previous strategy of rank k for the
+        # stint of n = max_stint_length - j laps, which covers l - n laps. The lap counts are
+        # padded in front and are the last axis of the padded values, so the windows are views.
+        padded = np.concatenate([np.full((no_of_drivers, top_k, max_stint_length), fill_value,
+                                         dtype=values.dtype), values.transpose(0, 2, 1)], axis=2)
+        windows = np.lib.stride_tricks.sliding_window_view(padded, max_stint_length, axis=2)[
+            :, :, :-1].transpose(0, 2, 1, 3)
+        return windows if laps is None else windows[:, laps]
+
+    # The candidates of each lap count are written at once in the order (rank, stint length).
+    no_of_rows = no_of_laps_plus_one if laps is None else len(laps)
+    stint_lengths = np.arange(max_stint_length, 0, -1)
+    candidates = np.empty((no_of_drivers, no_of_rows, top_k, max_stint_length))
+    np.add(get_windows(costs, np.inf), stint_costs[:, None, None, :0:-1], out=candidates)
+    if last_stint_lengths is not None:
+        np.putmask(candidates, get_windows(last_stint_lengths, 0) < stint_lengths, np.inf)
+    candidates = candidates.reshape(no_of_drivers, no_of_rows, -1)
+
+    # Keep the top_k candidates for each lap count, from the fastest to the slowest. For a few
+    # ranks, taking the fastest remaining candidate each time is quicker than sorting them all.
+    best = np.empty((no_of_drivers, no_of_rows, top_k), dtype=np.int64)
+    best_costs = np.empty((no_of_drivers, no_of_rows, top_k))
+    for rank in range(top_k):
+        index = candidates.argmin(axis=2)[:, :, None]
+        best[:, :, rank:rank + 1] = index
+        best_costs[:, :, rank:rank + 1] = np.take_along_axis(candidates, index, axis=2)
+        np.put_along_axis(candidates, index, np.inf, axis=2)
+
+    if laps is None:
+        return (best_costs, stint_lengths[best % max_stint_length], best // max_stint_length)
+
+    extended = (np.full((no_of_drivers, no_of_laps_plus_one, top_k), np.inf),
+                np.zeros((no_of_drivers, no_of_laps_plus_one, top_k), dtype=np.int64),
+                np.zeros((no_of_drivers, no_of_laps_plus_one, top_k), dtype=np.int64))
+    for full, values in zip(extended, (best_costs, stint_lengths[best % max_stint_length],
+                                       best // max_stint_length)):
+        full[:, laps] = values
+
+    return extended
+
+
+def get_optimal_strategies(driver_tyre_data, no_of_laps: int, in_lap: float, out_lap: float,
+                           start_time: float, max_stops: int = 2, top_k: int = 3,
+                           dry_compounds: tuple = None,
+                           min_dry_compounds: int = MIN_DRY_COMPOUNDS) -> object:
+    """
+    Returns the fastest strategies of each driver for every number of pit stops up to max_stops.
+
+    Every strategy uses at least min_dry_compounds different dry compounds. Since the tyre
+    degradation model does not depend on the order of the stints, the stints are reported in the
+    order of DRY_TYRES, and the stints of the same compound from the longest to the shortest, e.g.
+    'SOFT 20 SOFT 19 HARD 31' also represents 'HARD 31 SOFT 19 SOFT 20'. Thus the same stints are
+    only returned once.
+
+    The stint costs are precomputed as cumulative tables, and the best stint lengths are found with
+    dynamic programming over laps, adding one stint at a time for all drivers at once. For 20
+    drivers and 70 laps, this takes about 30 ms with max_stops=2 and 60 ms with max_stops=3.
+
+    :param driver_tyre_data: a DataFrame containing the columns 'Driver', 'SoftDegFactor',
+    'MediumDegFactor', 'HardDegFactor' and 'LongRunEstimate', one row per driver.
+
+    :param no_of_laps: an int representing the number of laps of the race.
+
+    :param in_lap: a float representing the time lost (in seconds) on an in lap.
+
+    :param out_lap: a float representing the time lost (in seconds) on an out lap.
+
+    :param start_time: a float representing the time lost (in seconds) at the race start.
+
+    :param max_stops: an int representing the largest number of pit stops considered.
+
+    :param top_k: an int representing the number of strategies returned for each driver and each
+    number of pit stops.
+
+    :param dry_compounds: a tuple of strings representing the dry compounds available in the race,
+    or None for all of DRY_TYRES, e.g. tracks.get_strategy_parameters returns those of a track.
+
+    :param min_dry_compounds: an int representing the number of different dry compounds a strategy
+    must use.
+
+    :return: a DataFrame with the columns 'Driver', 'NoOfStops', 'Rank', 'RaceTime', 'Strategy',
+    'Compounds' and 'StintLengths', sorted by driver and race time.
+    """
+    # A table of stint costs of each driver for each dry compound.
+    stint_cost_tables = {}
+    for compound in DRY_TYRES:
+        deg_factors = driver_tyre_data[compound.title() + 'DegFactor'].to_numpy(dtype=float)
+        stint_cost_tables[compound] = get_stint_cost_table(compound, deg_factors, no_of_laps)
+
+    stints = _get_optimal_stints(stint_cost_tables, no_of_laps, max_stops, top_k, dry_compounds,
+                                 min_dry_compounds)
+
+    return _get_strategies_df(driver_tyre_data, stints, no_of_laps, in_lap, out_lap, start_time,
+                              top_k)
+
+
+def get_optimal_strategies_for_races(driver_tyre_data, races, max_stops: int = 2,
+                                     top_k: int = 3) -> object:
+    """
+    Returns the fastest strategies of each driver in several races at once, e.g. every race of the
+    calendar, with one run of the dynamic programming for the longest race (see
+    get_optimal_strategies).
+
+    :param driver_tyre_data: a DataFrame containing the columns 'Driver', 'SoftDegFactor',
+    'MediumDegFactor', 'HardDegFactor' and 'LongRunEstimate', one row per driver.
+
+    :param races: a DataFrame with the columns 'Track', 'NoOfLaps', 'InLap', 'OutLap' and
+    'StartTime', and optionally 'DryCompounds' (lists of the dry compounds available) and
+    'MinDryCompounds', one row per race, e.g. returned by tracks.get_track_df.
+
+    :param max_stops: an int representing the largest number of pit stops considered.
+
+    :param top_k: an int representing the number of strategies returned for each driver, each
+    race and each number of pit stops.
+
+    :return: a DataFrame like get_optimal_strategies, with a 'Track' column first, sorted by track
+    (in the order of races), driver and race time.
+    """
+    import pandas as pd
+
+    max_laps = int(races['NoOfLaps'].max())
+    stint_cost_tables = {}
+    for compound in DRY_TYRES:
+        deg_factors = driver_tyre_data[compound.title() + 'DegFactor'].to_numpy(dtype=float)
+        stint_cost_tables[compound] = get_stint_cost_table(compound, deg_factors, max_laps)
+    levels = _get_stint_levels(stint_cost_tables, max_stops, top_k,
+                               races['NoOfLaps'].astype(int).unique().tolist())
+
+    strategies = []
+    for race in races.to_dict('records'):
+        stints = _get_stints_from_levels(levels, int(race['NoOfLaps']), max_stops, top_k,
+                                         race.get('DryCompounds'),
+                                         race.get('MinDryCompounds', MIN_DRY_COMPOUNDS))
+        race_strategies = _get_strategies_df(driver_tyre_data, stints, int(race['NoOfLaps']),
+                                             race['InLap'], race['OutLap'], race['StartTime'],
+                                             top_k)
+        race_strategies.insert(0, 'Track', race['Track'])
+        strategies.append(race_strategies)
+
+    return pd.concat(strategies, ignore_index=True)
+
+
+def _get_optimal_stints(stint_cost_tables: dict, no_of_laps: int, max_stops: int, top_k: int,
+                        dry_compounds: tuple = None,
+                        min_dry_compounds: int = MIN_DRY_COMPOUNDS) -> list:
+    """
+    Finds the top_k stint sequences of each driver for each number of pit stops and each set of
+    compounds, see get_optimal_strategies.
+
+    :param stint_cost_tables: a dict mapping each dry compound to a numpy.array of shape
+    (drivers, no_of_laps + 1) returned by get_stint_cost_table.
+
+    :return: a list of tuples containing the index of the driver, the number of stops, the total
+    stint cost, the compounds and the stint lengths of each strategy.
+    """
+    levels = _get_stint_levels(stint_cost_tables, max_stops, top_k, [no_of_laps])
+
+    return _get_stints_from_levels(levels, no_of_laps, max_stops, top_k, dry_compounds,
+                                   min_dry_compounds)
+
+
+def _get_stint_levels(stint_cost_tables: dict, max_stops: int, top_k: int,
+                      race_laps: list = None) -> list:
+    """
+    Runs the dynamic programming over laps of _get_optimal_stints. The costs of every race distance
+    up to the length of the stint cost tables are found at once.
+
+    :param race_laps: a list of ints representing the race distances the strategies with max_stops
+    stops are needed for, or None for every race distance. The other levels cover every distance,
+    as the strategies with more stops extend them.
+
+    :return: a list containing a level for each number of stops. Each level maps a tuple of
+    compounds (in the order of DRY_TYRES) to the costs of the top_k strategies and the back
+    pointers used to recover the stint lengths.
+    """
+    no_of_drivers, no_of_laps_plus_one = stint_cost_tables[DRY_TYRES[0]].shape
+
+    # The strategies with one stint, which are the roots of all other strategies.
+    level = {}
+    for compound in DRY_TYRES:
+        costs = np.full((no_of_drivers, no_of_laps_plus_one, top_k), np.inf)
+        costs[:, 1:, 0] = stint_cost_tables[compound][:, 1:]
+        level[(compound,)] = (costs, None, None)
+    levels = [level]
+
+    # The length of the only stint of each root strategy.
+    root_stint_lengths = np.broadcast_to(np.arange(no_of_laps_plus_one)[None, :, None],
+                                         (no_of_drivers, no_of_laps_plus_one, top_k))
+
+    for no_of_stops in range(1, max_stops + 1):
+        laps = race_laps if no_of_stops == max_stops else None
+        level = {}
+        for compounds, (costs, last_stint_lengths, _) in levels[-1].items():
+            if last_stint_lengths is None:
+                last_stint_lengths = root_stint_lengths
+            for compound in DRY_TYRES[DRY_TYRES.index(compounds[-1]):]:
+                level[compounds + (compound,)] = _add_stint(
+                    costs, stint_cost_tables[compound], top_k,
+                    last_stint_lengths if compound == compounds[-1] else None, laps)
+        levels.append(level)
+
+    return levels
+
+
+def _get_stints_from_levels(levels: list, no_of_laps: int, max_stops: int, top_k: int,
+                            dry_compounds: tuple = None,
+                            min_dry_compounds: int = MIN_DRY_COMPOUNDS) -> list:
+    """
+    Returns the strategies of a race distance from the levels of _get_stint_levels, see
+    _get_optimal_stints.
+
+    :param dry_compounds: a tuple of strings representing the dry compounds available, or None for
+    all of DRY_TYRES.
+
+    :param min_dry_compounds: an int representing the number of different dry compounds a strategy
+    must use.
+    """
+    no_of_drivers = len(next(iter(levels[0].values()))[0])
+
+    stints = []
+    for no_of_stops in range(1, max_stops + 1):
+        for compounds, (costs, _, _) in levels[no_of_stops].items():
+            # Two different dry compounds must be used during the race.
+            if len(set(compounds)) < min_dry_compounds:
+                continue
+            if dry_compounds is not None and not set(compounds).issubset(dry_compounds):
+                continue
+
+            for driver_index in range(no_of_drivers):
+                for rank in range(top_k):
+                    stint_cost = costs[driver_index, no_of_laps, rank]
+                    if not np.isfinite(stint_cost):
+                        continue
+
+                    stint_lengths = _get_stint_lengths(levels, compounds, driver_index,
+                                                       no_of_laps, rank)
+                    stints.append((driver_index, no_of_stops, stint_cost, compounds,
+                                   stint_lengths))
+
+    return stints
+
+
+def _get_strategies_df(driver_tyre_data, stints: list, no_of_laps: int, in_lap: float,
+                       out_lap: float, start_time: float, top_k: int) -> object:
+    """
+    Adds the race base time of each driver to the stint costs, and returns the top_k strategies of
+    each driver and number of stops, see get_optimal_strategies.
+
+    :param stints: a list of tuples returned by _get_optimal_stints.
+    """
+    import pandas as pd
+
+    drivers = driver_tyre_data['Driver'].tolist()
+    long_run_estimates = driver_tyre_data['LongRunEstimate'].to_numpy(dtype=float)
+
+    rows = []
+    for driver_index, no_of_stops, stint_cost, compounds, stint_lengths in stints:
+        race_base_time = long_run_estimates[driver_index] * no_of_laps + \
+                         no_of_stops * (in_lap + out_lap + 1) + start_time
+        rows.append([drivers[driver_index], no_of_stops, race_base_time + stint_cost,
+                     ' '.join('{} {}'.format(compound, laps) for compound, laps in
+                              zip(compounds, stint_lengths)),
+                     compounds, stint_lengths])
+
+    strategies = pd.DataFrame(rows, columns=['Driver', 'NoOfStops', 'RaceTime', 'Strategy',
+                                             'Compounds', 'StintLengths'])
+
+    # Only keep the top_k strategies for each driver and number of stops.
+    strategies = strategies.sort_values(['Driver', 'NoOfStops', 'RaceTime'], kind='stable')
+    strategies = strategies.groupby(['Driver', 'NoOfStops']).head(top_k)
+    strategies.insert(2, 'Rank', strategies.groupby(['Driver', 'NoOfStops']).cumcount() + 1)
+
+    return strategies.sort_values(['Driver', 'RaceTime'], kind='stable').reset_index(drop=True)
+
+
+# Bounded LRU caches of stint cost tables and of the stints of optimal strategies, see
+# get_optimal_strategies_cached. The most recently used entries are at the end.
+_STINT_COST_CACHE = OrderedDict()
+_STRATEGY_CACHE = OrderedDict()
+_CACHE_COUNTERS = {'stint_costs': {'hits': 0, 'misses': 0},
+                   'strategies': {'hits': 0, 'misses': 0}}
+
+
+def _lookup(cache: OrderedDict, counters: dict, keys: list) -> dict:
+    """
+    Returns the cached values of the keys found in a cache, and marks them as recently used.
+    """
+    found = {}
+    for key in keys:
+        if key in cache:
+            cache.move_to_end(key)
+            found[key] = cache[key]
+            counters['hits'] += 1
+        else:
+            counters['misses'] += 1
+
+    return found
+
+
+def _store(cache: OrderedDict, values: dict, max_size: int) -> None:
+    """
+    Adds values to a cache, and evicts the least recently used entries beyond max_size.
+    """
+    cache.update(values)
+    while len(cache) > max_size:
+        cache.popitem(last=False)
+
+
+def get_cached_stint_cost_tables(compound: str, deg_factors: object, max_stint_length: int,
+                                 deg_factor_quantum: float = DEG_FACTOR_QUANTUM) -> object:
+    """
+    Returns the stint cost tables of many deg factors like get_stint_cost_table, reusing the tables
+    of deg factors computed before.
+
+    The deg factors are rounded to multiples of deg_factor_quantum, and the tables are cached by
+    (compound, rounded deg factor, max_stint_length) in a LRU cache of STINT_COST_CACHE_SIZE tables.
+
+    :param compound: a string representing a dry tyre compound.
+
+    :param deg_factors: a numpy.array of floats representing the deg factors.
+
+    :param max_stint_length: an int representing the longest stint (in laps) in the tables.
+
+    :param deg_factor_quantum: a float representing the precision of the deg factors.
+
+    :return: a numpy.array of shape (len(deg_factors), max_stint_length + 1).
+    """
+    quantized = np.rint(np.asarray(deg_factors, dtype=float) / deg_factor_quantum).astype(np.int64)
+    keys = [(compound, q, max_stint_length, deg_factor_quantum) for q in quantized.tolist()]
+
+    tables = _lookup(_STINT_COST_CACHE, _CACHE_COUNTERS['stint_costs'], keys)
+    missing = list(dict.fromkeys(key for key in keys if key not in tables))
+    if missing:
+        missing_deg_factors = np.array([key[1] for key in missing]) * deg_factor_quantum
+        new_tables = dict(zip(missing, get_stint_cost_table(compound, missing_deg_factors,
+                                                            max_stint_length)))
+        _store(_STINT_COST_CACHE, new_tables, STINT_COST_CACHE_SIZE)
+        tables.update(new_tables)
+
+    return np.stack([tables[key] for key in keys]) if keys else \
+        np.empty((0, max_stint_length + 1))
+
+
+def get_optimal_strategies_cached(driver_tyre_data, no_of_laps: int, in_lap: float,
+                                  out_lap: float, start_time: float, max_stops: int = 2,
+                                  top_k: int = 3, dry_compounds: tuple = None,
+                                  min_dry_compounds: int = MIN_DRY_COMPOUNDS,
+                                  deg_factor_quantum: float = DEG_FACTOR_QUANTUM) -> object:
+    """
+    Returns the fastest strategies of each driver like get_optimal_strategies, reusing the results
+    of drivers with the same (rounded) deg factors in previous calls, e.g. when the predictions are
+    rerun after the data of a few drivers changed.
+
+    The deg factors are rounded to multiples of deg_factor_quantum. The stints of the optimal
+    strategies of a driver only depend on the race distance, max_stops, top_k, the compound rules
+    and the rounded deg factors of the three dry compounds, so they are cached by these in a LRU
+    cache of STRATEGY_CACHE_SIZE entries. The pit stop and start losses and the long run estimate
+    only add to the race times, and are applied after the lookup.
+
+    See get_optimal_strategies for the parameters and the returned DataFrame, and
+    get_strategy_cache_info for the hit and miss counts.
+
+    :param deg_factor_quantum: a float representing the precision of the deg factors.
+    """
+    deg_factors = np.column_stack([
+        driver_tyre_data[compound.title() + 'DegFactor'].to_numpy(dtype=float)
+        for compound in DRY_TYRES])
+    quantized = np.rint(deg_factors / deg_factor_quantum).astype(np.int64)
+    compound_rules = (None if dry_compounds is None else tuple(dry_compounds), min_dry_compounds)
+    keys = [(no_of_laps, max_stops, top_k, deg_factor_quantum, tuple(driver_deg_factors)) +
+            compound_rules for driver_deg_factors in quantized.tolist()]
+
+    cached_stints = _lookup(_STRATEGY_CACHE, _CACHE_COUNTERS['strategies'], keys)
+    missing = list(dict.fromkeys(key for key in keys if key not in cached_stints))
+    if missing:
+        # Optimize the strategies of all the missing deg factors at once.
+        missing_deg_factors = np.array([key[4] for key in missing]) * deg_factor_quantum
+        stint_cost_tables = {compound: get_cached_stint_cost_tables(
+            compound, missing_deg_factors[:, i], no_of_laps, deg_factor_quantum)
+            for i, compound in enumerate(DRY_TYRES)}
+
+        new_stints = {key: [] for key in missing}
+        for driver_index, *strategy in _get_optimal_stints(stint_cost_tables, no_of_laps,
+                                                           max_stops, top_k, *compound_rules):
+            new_stints[missing[driver_index]].append(tuple(strategy))
+        _store(_STRATEGY_CACHE, new_stints, STRATEGY_CACHE_SIZE)
+        cached_stints.update(new_stints)
+
+    stints = [(driver_index,) + strategy for driver_index, key in enumerate(keys)
+              for strategy in cached_stints[key]]
+
+    return _get_strategies_df(driver_tyre_data, stints, no_of_laps, in_lap, out_lap, start_time,
+                              top_k)
+
+
+def get_strategy_cache_info() -> dict:
+    """
+    Returns the hit and miss counts and the sizes of the caches of get_optimal_strategies_cached.
+
+    :return: a dict mapping 'stint_costs' and 'strategies' to dicts with the keys 'hits',
+    'misses', 'size' and 'max_size'.
+    """
+    return {'stint_costs': dict(_CACHE_COUNTERS['stint_costs'], size=len(_STINT_COST_CACHE),
+                                max_size=STINT_COST_CACHE_SIZE),
+            'strategies': dict(_CACHE_COUNTERS['strategies'], size=len(_STRATEGY_CACHE),
+                               max_size=STRATEGY_CACHE_SIZE)}
+
+
+def clear_strategy_cache() -> None:
+    """
+    Empties the caches of get_optimal_strategies_cached and resets their counters.
+    """
+    _STINT_COST_CACHE.clear()
+    _STRATEGY_CACHE.clear()
+    for counters in _CACHE_COUNTERS.values():
+        counters.update(hits=0, misses=0)
+
+
+def _get_stint_lengths(levels, compounds, driver_index, no_of_laps, rank) -> tuple:
+    """
+    Recovers the stint lengths of a strategy by following the back pointers of each level.
+
+    :return: a tuple of ints containing the length of each stint, in the order of compounds.
+    """
+    stint_lengths = []
+    laps = no_of_laps
+
+    for depth in range(len(compounds) - 1, 0, -1):
+        _, back_stint_lengths, back_ranks = levels[depth][compounds[:depth + 1]]
+        stint_length = int(back_stint_lengths[driver_index, laps, rank])
+        rank = int(back_ranks[driver_index, laps, rank])
+        stint_lengths.append(stint_length)
+        laps -= stint_length
+
+    # The first stint covers the remaining laps.
+    stint_lengths.append(laps)
+
+    return tuple(reversed(stint_lengths))
+
+
+def _get_variances(driver_tyre_data, columns: list) -> object:
+    """
+    Returns the variances in columns of driver_tyre_data, or 0 if a column is missing. Drivers
+    without a finite variance get the largest finite variance of the column.
+
+    :return: a numpy.array of shape (drivers, len(columns)).
+    """
+    variances = np.zeros((len(driver_tyre_data), len(columns)))
+    for i, column in enumerate(columns):
+        if column in driver_tyre_data.columns:
+            values = driver_tyre_data[column].to_numpy(dtype=float)
+            finite = np.isfinite(values)
+            variances[:, i] = np.where(finite, values, values[finite].max(initial=0))
+
+    return variances
+
+
+def get_strategy_robustness(strategies, driver_tyre_data, no_of_laps: int, in_lap: float,
+                            out_lap: float, start_time: float, no_of_samples: int = 2000,
+                            seed: int = None) -> object:
+    """
+    Scores the candidate strategies of each driver under the uncertainty of the fitted parameters,
+    e.g. how often the fastest strategy of get_optimal_strategies is still the fastest if the deg
+    factors of the driver are a bit off.
+
+    The deg factors and the long run estimate of every driver are sampled no_of_samples times in
+    one matrix: the deg factors from a lognormal distribution with their variance (see
+    driver_stats.get_deg_factor_variances), and the long run estimate from a normal distribution
+    with the variance of the base time (see prediction.get_head_to_head_df). The race time of a
+    strategy is a quadratic in the inverse deg factor of each compound, so the race times of all
+    candidates for all samples are evaluated at once from the power sums of their stint lengths.
+
+    :param strategies: a DataFrame containing the candidate strategies, returned by
+    get_optimal_strategies (e.g. with a larger top_k).
+
+    :param driver_tyre_data: a DataFrame like for get_optimal_strategies, optionally with the
+    columns 'SoftDegFactorVariance', 'MediumDegFactorVariance', 'HardDegFactorVariance' and
+    'BaseTimeVariance'. A missing column means no uncertainty.
+
+    :param no_of_samples: an int representing the number of parameter samples.
+
+    :param seed: an int used to seed the random number generator, or None for random results.
+
+    See get_optimal_strategies for the other parameters.
+
+    :return: strategies with the columns 'WinProbability' (the probability that the strategy is
+    the fastest candidate of the driver, where a tie goes to the candidate that comes first in
+    strategies), 'ExpectedTimeLoss' (the mean time lost against the fastest candidate of the
+    driver in each sample), 'RaceTimeMean' and 'RaceTimeSd'.
+    """
+    drivers = driver_tyre_data['Driver'].tolist()
+    driver_index = np.array([drivers.index(driver) if driver in drivers else -1
+                             for driver in strategies['Driver']], dtype=int)
+    if np.any(driver_index < 0):
+        raise ValueError('The drivers {} are not in driver_tyre_data'.format(
+            sorted(set(strategies['Driver'][driver_index < 0]))))
+
+    # Number the candidates of each driver.
+    candidate_index = strategies.groupby('Driver', sort=False).cumcount().to_numpy()
+    no_of_drivers = len(drivers)
+    no_of_candidates = candidate_index.max(initial=-1) + 1
+
+    # The number of laps, the sum of the tyre lives and the sum of their squares on each compound.
+    power_sums = np.zeros((len(strategies), len(DRY_TYRES), 3))
+    for i, (compounds, stint_lengths) in enumerate(zip(strategies['Compounds'],
+                                                       strategies['StintLengths'])):
+        for compound, n in zip(compounds, stint_lengths):
+            power_sums[i, DRY_TYRES.index(compound)] += \
+                [n, n * (n + 1) / 2, n * (n + 1) * (2 * n + 1) / 6]
+
+    # The weights of the squared and linear inverse deg factors, and the constant time of each
+    # candidate. The padding candidates of drivers with fewer candidates are never the fastest.
+    coefficients = get_tyre_model_coefficient_table()[[COMPOUND_CODES[compound]
+                                                        for compound in DRY_TYRES]]
+    squared_weights = np.zeros((no_of_drivers, no_of_candidates, len(DRY_TYRES)))
+    linear_weights = np.zeros((no_of_drivers, no_of_candidates, len(DRY_TYRES)))
+    constants = np.full((no_of_drivers, no_of_candidates), np.inf)
+    squared_weights[driver_index, candidate_index] = coefficients[:, 0] * power_sums[:, :, 2]
+    linear_weights[driver_index, candidate_index] = coefficients[:, 1] * power_sums[:, :, 1]
+    constants[driver_index, candidate_index] = \
+        power_sums[:, :, 0] @ coefficients[:, 2] + \
+        strategies['NoOfStops'].to_numpy() * (in_lap + out_lap + 1) + start_time
+
+    # Sample the parameters: one standard normal per driver for each deg factor and the base time.
+    deg_factors = np.column_stack([
+        driver_tyre_data[compound.title() + 'DegFactor'].to_numpy(dtype=float)
+        for compound in DRY_TYRES])
+    variances = _get_variances(driver_tyre_data, [compound.title() + 'DegFactorVariance'
+                                                  for compound in DRY_TYRES] + ['BaseTimeVariance'])
+    normals = np.random.default_rng(seed).standard_normal((no_of_drivers, no_of_samples,
+                                                           len(DRY_TYRES) + 1))
+
+    # A lognormal with the mean and variance of each deg factor keeps the deg factors positive.
+    log_variances = np.log1p(variances[:, :3] / deg_factors ** 2)
+    inverse_deg_factors = np.exp(0.5 * log_variances[:, None, :] - np.log(deg_factors)[:, None, :] -
+                                 np.sqrt(log_variances)[:, None, :] * normals[:, :, :3])
+    long_run_estimates = driver_tyre_data['LongRunEstimate'].to_numpy(dtype=float)[:, None] + \
+        np.sqrt(variances[:, 3:]) * normals[:, :, 3]
+
+    # The race times of shape (drivers, samples, candidates).
+    race_times = inverse_deg_factors ** 2 @ squared_weights.transpose(0, 2, 1) + \
+        inverse_deg_factors @ linear_weights.transpose(0, 2, 1) + constants[:, None, :] + \
+        long_run_estimates[:, :, None] * no_of_laps
+
+    fastest = race_times.argmin(axis=2)
+    wins = np.bincount((np.arange(no_of_drivers)[:, None] * no_of_candidates + fastest).ravel(),
+                       minlength=no_of_drivers * no_of_candidates)
+    time_losses = race_times - np.take_along_axis(race_times, fastest[:, :, None], axis=2)
+
+    return strategies.assign(
+        WinProbability=wins.reshape(no_of_drivers, no_of_candidates)[driver_index, candidate_index]
+        / no_of_samples,
+        ExpectedTimeLoss=time_losses.mean(axis=1)[driver_index, candidate_index],
+        RaceTimeMean=race_times.mean(axis=1)[driver_index, candidate_index],
+        RaceTimeSd=race_times.std(axis=1)[driver_index, candidate_index])
@@ -0,0 +1,358 @@
+"""
+Contains helper functions for storing car telemetry in memory-mapped arrays, and comparing the laps
+of teammates mini-sector by mini-sector.
+
+The telemetry of a session is stored in <telemetry>/season=2022/event=Hungarian Grand Prix/
+session=Q/, one raw binary file per channel (see TELEMETRY_CHANNELS) containing the samples of all
+laps one after the other, and index.npz containing the driver, team and lap number of each lap and
+the offsets of its samples (and the number of samples at the end). The files are opened with
+numpy.memmap, so only the samples of the laps being processed are read into memory.
+"""
+import os
+
+import numpy as np
+
+from constants import *
+
+# The channels of the telemetry and their types. 'Time' is the time since the start of the lap
+# (in seconds) and 'Distance' the distance driven since the start of the lap (in metres).
+TELEMETRY_CHANNELS = {'Time': np.float32, 'Distance': np.float32, 'Speed': np.float32,
+                      'Throttle': np.float32, 'Brake': np.bool_, 'nGear': np.int8}
+
+# The name of the index file of a session
+TELEMETRY_INDEX_FILE = 'index.npz'
+
+
+def get_telemetry_path(season: int, event: str, session: str,
+                       telemetry_dir: str = TELEMETRY_STORE_DIRECTORY) -> str:
+    """
+    Returns the folder of the telemetry of a session.
+
+    :param season: an int representing the season, e.g. 2022.
+
+    :param event: a string representing the event, e.g. 'Hungarian Grand Prix'.
+
+    :param session: a string representing the session, e.g. 'Q'.
+
+    :param telemetry_dir: a string representing the folder of the telemetry store.
+    """
+    return os.path.join(telemetry_dir, 'season={}'.format(season), 'event={}'.format(event),
+                        'session={}'.format(session))
+
+
+def write_telemetry(laps, path: str) -> int:
+    """
+    Writes the telemetry of laps to a folder, one lap at a time, so the memory used does not grow
+    with the number of laps. Any previous telemetry in the folder is replaced.
+
+    :param laps: an iterable of tuples (driver, team, lap number, telemetry), where the telemetry
+    is a DataFrame (e.g. fastf1.core.Telemetry) or a dict of arrays containing the channels in
+    TELEMETRY_CHANNELS. 'Time' can be TimeDelta objects or seconds.
+
+    :param path: a string representing the folder, e.g. returned by get_telemetry_path. It is
+    created if needed.
+
+    :return: an int representing the number of laps written.
+    """
+    import pandas as pd
+
+    os.makedirs(path, exist_ok=True)
+    # The index is written last, so an interrupted export leaves no readable telemetry.
+    index_path = os.path.join(path, TELEMETRY_INDEX_FILE)
+    if os.path.exists(index_path):
+        os.remove(index_path)
+
+    drivers, teams, lap_numbers, offsets = [], [], [], [0]
+    files = {channel: open(os.path.join(path, channel + '.bin'), 'wb')
+             for channel in TELEMETRY_CHANNELS}
+    try:
+        for driver, team, lap_number, data in laps:
+            for channel, dtype in TELEMETRY_CHANNELS.items():
+                values = data[channel]
+                if pd.api.types.is_timedelta64_dtype(values):
+                    values = values.dt.total_seconds()
+                files[channel].write(np.asarray(values).astype(dtype).tobytes())
+
+            drivers.append(driver)
+            teams.append(team)
+            lap_numbers.append(lap_number)
+            offsets.append(offsets[-1] + len(data['Distance']))
+    finally:
+        for file in files.values():
+            file.close()
+
+    np.savez(index_path, Drivers=np.array(drivers, dtype=str), Teams=np.array(teams, dtype=str),
+             LapNumbers=np.array(lap_numbers, dtype=np.int16),
+             Offsets=np.array(offsets, dtype=np.int64))
+
+    return len(drivers)
+
+
+def export_fastest_laps(session, path: str, drivers: list = None) -> int:
+    """
+    Writes the car telemetry of the fastest lap of each driver of a session, e.g. to compare the
+    qualifying laps of teammates.
+
+    :param session: a fastf1.core.Session object loaded with laps and telemetry, e.g.
+    ff1.get_session(2022, 13, 'Q') after calling load().
+
+    :param path: a string representing the folder, e.g. returned by get_telemetry_path.
+
+    :param drivers: a list of strings representing the drivers, or None for all drivers.
+
+    :return: an int representing the number of laps written.
+    """
+    drivers = session.laps['Driver'].unique().tolist() if drivers is None else drivers
+
+    def fastest_laps():
+        for driver in drivers:
+            lap = session.laps.pick_driver(driver).pick_fastest()
+            if lap is None or len(lap) == 0 or lap['LapTime'] != lap['LapTime']:
+                continue
+
+            yield driver, lap['Team'], int(lap['LapNumber']), lap.get_car_data().add_distance()
+
+    return write_telemetry(fastest_laps(), path)
+
+
+def open_telemetry(path: str) -> dict:
+    """
+    Opens the telemetry written by write_telemetry, without reading the samples.
+
+    :param path: a string representing the folder.
+
+    :return: a dict containing a read-only numpy.memmap of each channel in TELEMETRY_CHANNELS, and
+    the entries 'Drivers', 'Teams', 'LapNumbers' (one entry per lap) and 'Offsets' (the first
+    sample of each lap, and the number of samples at the end) of the index.
+    """
+    with np.load(os.path.join(path, TELEMETRY_INDEX_FILE)) as file:
+        telemetry = {name: file[name] for name in file.files}
+
+    for channel, dtype in TELEMETRY_CHANNELS.items():
+        if telemetry['Offsets'][-1] == 0:
+            telemetry[channel] = np.zeros(0, dtype=dtype)
+        else:
+            telemetry[channel] = np.memmap(os.path.join(path, channel + '.bin'), dtype=dtype,
+                                           mode='r', shape=(int(telemetry['Offsets'][-1]),))
+
+    return telemetry
+
+
+def get_lap_durations(telemetry: dict) -> object:
+    """
+    Returns the time of the last sample of each lap, or NaN for laps without samples.
+
+    :param telemetry: a dict returned by open_telemetry.
+    """
+    offsets = telemetry['Offsets']
+    durations = np.full(len(offsets) - 1, np.nan)
+    has_samples = offsets[1:] > offsets[:-1]
+    durations[has_samples] = telemetry['Time'][offsets[1:][has_samples] - 1]
+
+    return durations
+
+
+def resample_by_distance(telemetry: dict, distances, channels: list = ('Time', 'Speed'),
+                         laps: list = None, laps_per_chunk: int = 64) -> dict:
+    """
+    Resamples channels of laps at the same distances from the start of the lap, so laps can be
+    compared point by point.
+
+    The channels of a float type are interpolated linearly, the others (brake and gear) take the
+    value of the last sample before each distance. The laps are processed in chunks of contiguous
+    samples, all laps of a chunk at once.
+
+    :param telemetry: a dict returned by open_telemetry.
+
+    :param distances: a numpy.array of floats containing the distances (in metres), in increasing
+    order.
+
+    :param channels: a list of strings representing the channels, in TELEMETRY_CHANNELS.
+
+    :param laps: a list of ints representing the laps (positions in the index), or None for all
+    laps.
+
+    :param laps_per_chunk: an int representing the number of laps processed at once.
+
+    :return: a dict mapping each channel to a numpy.array of shape (laps, distances), NaN (or 0)
+    for laps with fewer than 2 samples.
+    """
+    distances = np.asarray(distances, dtype=float)
+    offsets = telemetry['Offsets']
+    laps = np.arange(len(offsets) - 1) if laps is None else np.asarray(laps, dtype=np.int64)
+
+    resampled = {channel: np.zeros((len(laps), len(distances)),
+                                   dtype=float if np.issubdtype(TELEMETRY_CHANNELS[channel],
+                                                                np.floating)
+                                   else TELEMETRY_CHANNELS[channel])
+                 for channel in channels}
+
+    for chunk_start in range(0, len(laps), laps_per_chunk):
+        chunk = laps[chunk_start:chunk_start + laps_per_chunk]
+        starts, ends = offsets[chunk], offsets[chunk + 1]
+        lengths = ends - starts
+
+        if lengths.sum() == 0:
+            for channel in channels:
+                resampled[channel][chunk_start:chunk_start + len(chunk)] = \
+                    np.nan if resampled[channel].dtype == float else 0
+            continue
+
+        # Gather the samples of the chunk. Consecutive laps are read as a single slice of the
+        # files, without copying.
+        if np.all(chunk[1:] == chunk[:-1] + 1):
+            rows = slice(starts[0], ends[-1])
+        else:
+            rows = np.concatenate([np.arange(start, end) for start, end in zip(starts, ends)])
+        lap_starts = np.concatenate([[0], np.cumsum(lengths)])[:-1]
+        no_of_samples = lengths.sum()
+
+        # Make the distances increase across the laps of the chunk, so one search finds the
+        # samples around every distance of every lap.
+        lap_distances = telemetry['Distance'][rows].astype(float)
+        span = np.max(np.abs(lap_distances)) + np.max(np.abs(distances), initial=0) + 1
+        lap_of_sample = np.repeat(np.arange(len(chunk)), lengths)
+        keys = lap_distances + 2 * span * lap_of_sample
+        queries = distances[None, :] + 2 * span * np.arange(len(chunk))[:, None]
+
+        after = np.searchsorted(keys, queries, side='right')
+        right = np.clip(after, (lap_starts + 1)[:, None], (lap_starts + lengths - 1)[:, None])
+        right = np.clip(right, 0, no_of_samples - 1)
+        left = np.maximum(right - 1, 0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            weights = np.clip((queries - keys[left]) / (keys[right] - keys[left]), 0, 1)
+        weights = np.nan_to_num(weights)
+        too_short = lengths < 2
+
+        for channel in channels:
+            values = telemetry[channel][rows]
+            if np.issubdtype(values.dtype, np.floating):
+                values = values.astype(float)
+                chunk_values = values[left] + weights * (values[right] - values[left])
+                chunk_values[too_short] = np.nan
+            else:
+                # The last sample at or before each distance.
+                chunk_values = np.where(weights < 1, values[left], values[right])
+                chunk_values[too_short] = 0
+            resampled[channel][chunk_start:chunk_start + len(chunk)] = chunk_values
+
+    return resampled
+
+
+def get_mini_sectors(telemetry: dict, laps: list = None,
+                     no_of_mini_sectors: int = NO_OF_MINI_SECTORS,
+                     resolution: float = TELEMETRY_RESOLUTION, laps_per_chunk: int = 64) -> dict:
+    """
+    Splits laps into mini-sectors of equal length, and returns the time spent and the lowest speed
+    (e.g. the speed at the apex of a corner) of each lap in each mini-sector.
+
+    The length of the lap is the shortest distance covered by the laps, so all laps cover all
+    mini-sectors.
+
+    :param telemetry: a dict returned by open_telemetry.
+
+    :param laps: a list of ints representing the laps (positions in the index), or None for all
+    laps.
+
+    :param no_of_mini_sectors: an int representing the number of mini-sectors.
+
+    :param resolution: a float representing the distance (in metres) between the points where the
+    speed is sampled.
+
+    :param laps_per_chunk: an int representing the number of laps resampled at once.
+
+    :return: a dict containing 'Boundaries' (a numpy.array of the distances where each
+    mini-sector starts, and the length of the lap at the end), and 'Times' and 'MinSpeeds'
+    (numpy.arrays of shape (laps, mini-sectors)).
+    """
+    offsets = telemetry['Offsets']
+    laps = np.arange(len(offsets) - 1) if laps is None else np.asarray(laps, dtype=np.int64)
+
+    has_samples = offsets[laps + 1] > offsets[laps]
+    lap_length = np.min(telemetry['Distance'][offsets[laps + 1][has_samples] - 1]) \
+        if np.any(has_samples) else 0.0
+    boundaries = np.linspace(0, lap_length, no_of_mini_sectors + 1)
+
+    # Sample the speed at the same number of points in every mini-sector.
+    points_per_mini_sector = max(int(np.ceil(lap_length / no_of_mini_sectors / resolution)), 1)
+    distances = np.linspace(0, lap_length, no_of_mini_sectors * points_per_mini_sector + 1)
+
+    # Reduce each chunk of laps to mini-sectors before resampling the next chunk.
+    times = np.zeros((len(laps), no_of_mini_sectors))
+    min_speeds = np.zeros((len(laps), no_of_mini_sectors))
+    for chunk_start in range(0, len(laps), laps_per_chunk):
+        chunk = slice(chunk_start, chunk_start + laps_per_chunk)
+        resampled = resample_by_distance(telemetry, distances, ['Time', 'Speed'], laps[chunk],
+                                         laps_per_chunk)
+        times[chunk] = np.diff(resampled['Time'][:, ::points_per_mini_sector], axis=1)
+
+        speeds = resampled['Speed']
+        min_speeds[chunk] = np.minimum(
+            speeds[:, :-1].reshape(len(speeds), no_of_mini_sectors, points_per_mini_sector)
+            .min(axis=2), speeds[:, points_per_mini_sector::points_per_mini_sector])
+
+    return {'Boundaries': boundaries, 'Times': times, 'MinSpeeds': min_speeds}
+
+
+def get_teammate_mini_sector_deltas(telemetry: dict, teammates: object = None,
+                                    no_of_mini_sectors: int = NO_OF_MINI_SECTORS,
+                                    resolution: float = TELEMETRY_RESOLUTION) -> object:
+    """
+    Compares the fastest lap of every driver with the fastest lap of their teammate, mini-sector by
+    mini-sector, for all teammates at once.
+
+    :param telemetry: a dict returned by open_telemetry.
+
+    :param teammates: a dict mapping each driver to their teammate (both directions), or a
+    DataFrame with the columns 'Driver' and 'Teammate' (e.g. returned by
+    prediction.get_teammate_pairs). Defaults to the teams in the index of the telemetry.
+
+    :param no_of_mini_sectors: an int representing the number of mini-sectors.
+
+    :param resolution: a float representing the distance (in metres) between the points where the
+    speed is sampled.
+
+    :return: a DataFrame with the columns 'Driver', 'Teammate', 'MiniSector' (from 1), 'Start' and
+    'End' (the distances in metres), 'Delta' (the time of the driver minus the time of the
+    teammate in the mini-sector, negative if the driver is faster) and 'MinSpeedDelta' (the
+    difference of the lowest speeds in km/h), one row per driver and mini-sector.
+    """
+    import pandas as pd
+
+    # The fastest lap of each driver.
+    laps = pd.DataFrame({'Driver': telemetry['Drivers'], 'Team': telemetry['Teams'],
+                         'Duration': get_lap_durations(telemetry)})
+    laps = laps.dropna(subset=['Duration']).sort_values('Duration', kind='stable')
+    laps = laps[~laps['Driver'].duplicated()]
+
+    if teammates is None:
+        from prediction import get_teammate_pairs
+
+        teammates = get_teammate_pairs(laps)
+    elif isinstance(teammates, dict):
+        teammates = pd.DataFrame({'Driver': list(teammates), 'Teammate': list(teammates.values())})
+
+    lap_of_driver = pd.Series(laps.index.to_numpy(), index=laps['Driver'])
+    pairs = teammates[teammates['Driver'].isin(lap_of_driver.index) &
+                      teammates['Teammate'].isin(lap_of_driver.index)]
+
+    # Resample every fastest lap once, then compare all pairs together.
+    lap_positions = lap_of_driver.to_numpy()
+    mini_sectors = get_mini_sectors(telemetry, lap_positions, no_of_mini_sectors, resolution)
+    row_of_driver = pd.Series(np.arange(len(lap_positions)), index=lap_of_driver.index)
+    driver_rows = row_of_driver[pairs['Driver']].to_numpy()
+    teammate_rows = row_of_driver[pairs['Teammate']].to_numpy()
+
+    deltas = mini_sectors['Times'][driver_rows] - mini_sectors['Times'][teammate_rows]
+    speed_deltas = mini_sectors['MinSpeeds'][driver_rows] - \
+        mini_sectors['MinSpeeds'][teammate_rows]
+    boundaries = mini_sectors['Boundaries']
+
+    return pd.DataFrame({
+        'Driver': np.repeat(pairs['Driver'].to_numpy(), no_of_mini_sectors),
+        'Teammate': np.repeat(pairs['Teammate'].to_numpy(), no_of_mini_sectors),
+        'MiniSector': np.tile(np.arange(1, no_of_mini_sectors + 1), len(pairs)),
+        'Start': np.tile(boundaries[:-1], len(pairs)),
+        'End': np.tile(boundaries[1:], len(pairs)),
+        'Delta': deltas.ravel(),
+        'MinSpeedDelta': speed_deltas.ravel()})
@@ -0,0 +1,10 @@
+"""
+Makes the modules of the project and the synthetic data of benchmarks/fixtures.py importable by
+the tests, like benchmarks/run.py.
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
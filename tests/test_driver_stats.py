@@ -0,0 +1,52 @@
+"""
+Tests of driver_stats.py.
+"""
+import numpy as np
+import pytest
+
+from driver_stats import get_stint_lengths
+
+
+def get_stint_lengths_loop(stints_list: list) -> list:
+    """
+    Returns the stint lengths with the original lap by lap loop of get_stint_lengths.
+    """
+    if stints_list == []:
+        return []
+
+    stints_tuples = []
+    stint_laps = 0
+    curr = None
+    for i in range(len(stints_list)):
+        curr = stints_list[i]
+        if i == 0:
+            stint_laps = 1
+        else:
+            stint_laps += 1
+            prev = stints_list[i - 1]
+            if curr != prev:
+                stints_tuples.append((prev, stint_laps - 1))
+                stint_laps = 1
+    stints_tuples.append((curr, stint_laps))
+
+    return stints_tuples
+
+
+@pytest.mark.parametrize('stints_list', [
+    [],
+    ['SOFT'],
+    ['SOFT', 'SOFT', 'HARD', 'HARD', 'HARD', 'SOFT'],
+    ['SOFT', None, None, 'HARD'],
+    ['SOFT', np.nan, np.nan, 'HARD'],
+    [None, 'MEDIUM', 'MEDIUM', None],
+])
+def test_get_stint_lengths_matches_loop(stints_list):
+    assert get_stint_lengths(stints_list) == get_stint_lengths_loop(stints_list)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_get_stint_lengths_matches_loop_on_random_compounds(seed):
+    rng = np.random.default_rng(seed)
+    stints_list = rng.choice(['SOFT', 'MEDIUM', 'HARD', None], 200, p=[0.4, 0.3, 0.2, 0.1])
+
+    assert get_stint_lengths(stints_list.tolist()) == get_stint_lengths_loop(stints_list.tolist())
@@ -0,0 +1,79 @@
+"""
+Tests of ingest.py on synthetic sessions, with the FastF1 loader replaced by a stub.
+"""
+import threading
+import time
+
+import pytest
+
+import ingest
+from fixtures import DRIVERS, make_session_laps
+from session_store import normalize_laps
+
+KEYS = [(2022, round_number, session) for round_number in range(1, 9)
+        for session in ['FP2', 'R']]
+
+
+@pytest.fixture
+def sessions(monkeypatch) -> dict:
+    """
+    Replaces the FastF1 loader of ingest.py by a stub building synthetic sessions, and the worker
+    processes by threads.
+
+    :return: a dict mapping 'submitted' to the keys of the sessions submitted to the pool and
+    'loaded' to the keys of the sessions loaded, in order.
+    """
+    import concurrent.futures
+
+    sessions = {'submitted': [], 'loaded': []}
+    lock = threading.Lock()
+
+    def load_session(key, cache_dir, offline, store_dir):
+        season, round_number, session = key
+        with lock:
+            sessions['loaded'].append(key)
+
+        # The early sessions take longest, so they finish out of order.
+        time.sleep(0.002 * (len(KEYS) - KEYS.index(key)))
+        laps = normalize_laps(make_session_laps(round_number, session, no_of_laps=5,
+                                                drivers=DRIVERS[:4]))
+
+        return key, laps.assign(season=season, event='Event {}'.format(round_number),
+                                session=session)
+
+    class Executor(concurrent.futures.ThreadPoolExecutor):
+        def submit(self, fn, key, *args):
+            sessions['submitted'].append(key)
+            return super().submit(fn, key, *args)
+
+    monkeypatch.setattr(ingest, '_load_session', load_session)
+    monkeypatch.setattr(concurrent.futures, 'ProcessPoolExecutor', Executor)
+
+    return sessions
+
+
+def test_iter_sessions_in_process_keeps_order(sessions):
+    for i, (key, laps) in enumerate(ingest.iter_sessions(KEYS, processes=1)):
+        # The sessions are loaded lazily, one at a time.
+        assert sessions['loaded'] == KEYS[:i + 1]
+        assert key == KEYS[i]
+        assert (laps['session'] == key[2]).all()
+
+
+@pytest.mark.parametrize('processes', [2, 3])
+def test_iter_sessions_bounds_work_in_flight(sessions, processes):
+    yielded = []
+    for key, laps in ingest.iter_sessions(KEYS, processes=processes):
+        yielded.append(key)
+        assert len(sessions['submitted']) - len(yielded) <= 2 * processes
+
+    assert sorted(yielded) == sorted(KEYS)
+    assert sorted(sessions['submitted']) == sorted(KEYS)
+
+
+def test_load_sessions_keeps_order(sessions):
+    laps = ingest.load_sessions(KEYS, processes=3)
+
+    events = laps[['event', 'session']].drop_duplicates()
+    assert list(events.itertuples(index=False, name=None)) == \
+        [('Event {}'.format(round_number), session) for _, round_number, session in KEYS]
@@ -0,0 +1,21 @@
+"""
+Tests of lap_table.py on synthetic sessions.
+"""
+import numpy as np
+import pytest
+
+from fixtures import make_session_laps
+from lap_table import get_lap_table, lap_table_to_df
+from race import get_track_status_flags
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_lap_table_to_df_keeps_track_status_flags(seed):
+    # Lap tables order the laps by driver.
+    df = make_session_laps(seed, 'R').sort_values(['Driver', 'LapNumber'], ignore_index=True)
+    df.loc[df.index[:3], 'TrackStatus'] = np.nan
+    table = get_lap_table(df)
+
+    expected = get_track_status_flags(df)
+    assert np.array_equal(get_track_status_flags(table), expected)
+    assert np.array_equal(get_track_status_flags(lap_table_to_df(table)), expected)
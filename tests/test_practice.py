@@ -0,0 +1,30 @@
+"""
+Tests of practice.py on synthetic FP2 sessions.
+"""
+import numpy as np
+import pytest
+
+from fixtures import make_session_laps
+from lap_table import get_lap_table
+from practice import extract_long_run_pace_all_drivers, \
+    extract_long_run_pace_from_longest_practice_stint
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('lap_table', [False, True])
+def test_extract_long_run_pace_all_drivers_matches_single_driver(seed, lap_table):
+    from fastf1.core import Laps
+
+    laps = Laps(make_session_laps(seed, 'FP2'))
+    expected = {driver: extract_long_run_pace_from_longest_practice_stint(laps, driver)
+                for driver in laps['Driver'].unique()}
+
+    long_run_pace = extract_long_run_pace_all_drivers(get_lap_table(laps) if lap_table else laps)
+
+    # Lap tables sort the drivers, the laps keep the order of the session.
+    assert list(long_run_pace) == (sorted(expected) if lap_table else list(expected))
+    for driver, (laptimes, compound, tyrelife) in long_run_pace.items():
+        # Lap tables store the lap times as float32.
+        assert np.allclose(laptimes, expected[driver][0], rtol=0, atol=1e-4)
+        assert compound == expected[driver][1]
+        assert tyrelife == expected[driver][2]
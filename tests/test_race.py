@@ -0,0 +1,81 @@
+"""
+Tests of race.py on synthetic sessions.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from fixtures import make_season_laps, make_session_laps
+from lap_table import get_lap_table
+from race import calculate_race_lap_times, get_green_flag_mask, get_track_status_by_lap
+
+
+def calculate_race_lap_times_loop(df) -> None:
+    """
+    Calculates the null lap times with the original loop of calculate_race_lap_times.
+    """
+    for i in df.index[pd.isnull(df["LapTime"])].tolist():
+        df.loc[i, "LapTime"] = df.loc[i + 1, "LapStartTime"] - df.loc[i, "LapStartTime"]
+
+
+def get_track_status_by_lap_loop(df) -> list:
+    """
+    Returns the track status of each lap with the original loop of get_track_status_by_lap.
+    """
+    track_status = []
+    for status in df["TrackStatus"]:
+        if '4' in str(status):
+            track_status.append("Safety Car Deployed")
+        elif '7' in str(status):
+            track_status.append("VSC Ending")
+        elif '6' in str(status):
+            track_status.append("VSC Deployed")
+        elif '5' in str(status):
+            track_status.append("Red Flag")
+        else:
+            track_status.append("")
+
+    return track_status
+
+
+@pytest.mark.parametrize('df', [make_session_laps(0), make_session_laps(1, 'FP2'),
+                                make_season_laps(3)], ids=['race', 'practice', 'season'])
+def test_calculate_race_lap_times_matches_loop(df):
+    # The last lap of each driver has a lap time, so the loop never crosses drivers.
+    expected = df.copy()
+    calculate_race_lap_times_loop(expected)
+
+    laps = df.copy()
+    calculate_race_lap_times(laps)
+    pd.testing.assert_series_equal(laps['LapTime'], expected['LapTime'])
+
+    # Lap tables order the laps by session and driver, and store seconds as float32.
+    expected = expected.sort_values(['season', 'event', 'session', 'Driver', 'LapNumber']
+                                    if 'season' in df.columns else ['Driver', 'LapNumber'])
+    table = get_lap_table(df)
+    calculate_race_lap_times(table)
+    assert np.allclose(table['LapTime'], expected['LapTime'].dt.total_seconds(), rtol=0,
+                       atol=1e-3)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_track_status_decoding_matches_strings(seed):
+    df = make_session_laps(seed)
+    df.loc[df.index[:3], 'TrackStatus'] = np.nan
+
+    assert get_track_status_by_lap(df) == get_track_status_by_lap_loop(df)
+    assert np.array_equal(get_green_flag_mask(df), df['TrackStatus'] == '1')
+
+
+def test_calculate_race_lap_times_keeps_missing_last_laps():
+    df = make_session_laps(0, no_of_laps=10).sort_values(['Driver', 'LapNumber'],
+                                                         ignore_index=True)
+    last_laps = df.groupby('Driver')['LapNumber'].transform('max') == df['LapNumber']
+    df.loc[last_laps, 'LapTime'] = pd.NaT
+    table = get_lap_table(df)
+
+    calculate_race_lap_times(df)
+    calculate_race_lap_times(table)
+
+    assert df['LapTime'].isnull().to_numpy().tolist() == last_laps.tolist()
+    assert np.isnan(table['LapTime']).tolist() == last_laps.tolist()
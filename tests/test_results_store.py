@@ -0,0 +1,68 @@
+"""
+Tests of results_store.py on races simulated from synthetic drivers.
+"""
+import numpy as np
+import pytest
+
+from constants import *
+from fixtures import make_driver_tyre_data
+from race_engine import get_race_setup
+from results_store import append_races, create_results_store, get_race_time_quantiles, \
+    iter_results, simulate_races_to_store
+from strategy import get_optimal_strategies
+
+QUANTILES = [0, 0.05, 0.25, 0.5, 0.75, 0.95, 1]
+TRACK_PARAMETERS = {'no_of_laps': 30, 'in_lap': DEFAULT_IN_LAP, 'out_lap': DEFAULT_OUT_LAP,
+                    'start_time': DEFAULT_START_TIME}
+
+
+@pytest.fixture(scope='module')
+def race_setup() -> dict:
+    driver_tyre_data = make_driver_tyre_data().head(5)
+    strategies = get_optimal_strategies(driver_tyre_data, **TRACK_PARAMETERS)
+
+    return get_race_setup(driver_tyre_data, strategies, **TRACK_PARAMETERS)
+
+
+def get_race_time_quantiles_in_memory(store_dir: str) -> np.ndarray:
+    """
+    Returns the quantiles of the race times of each car with numpy.quantile, loading all races.
+    """
+    race_times = np.concatenate([results['RaceTimes'] for results in
+                                 iter_results(store_dir, ['RaceTimes'])])
+
+    return np.array([np.quantile(times[np.isfinite(times)], QUANTILES)
+                     if np.isfinite(times).any() else np.full(len(QUANTILES), np.nan)
+                     for times in race_times.T])
+
+
+@pytest.mark.parametrize('bins', [1, 16, RESULTS_STORE_QUANTILE_BINS])
+def test_get_race_time_quantiles_matches_numpy(race_setup, tmp_path, bins):
+    simulate_races_to_store(race_setup, tmp_path, 3000, seed=0, processes=1,
+                            races_per_file=1000)
+
+    quantiles = get_race_time_quantiles(tmp_path, QUANTILES, bins)
+
+    assert np.allclose(quantiles[QUANTILES].to_numpy(), get_race_time_quantiles_in_memory(tmp_path),
+                       rtol=0, atol=1e-9)
+
+
+@pytest.mark.parametrize('bins', [1, 16, RESULTS_STORE_QUANTILE_BINS])
+def test_get_race_time_quantiles_with_ties_and_retirements(race_setup, tmp_path, bins):
+    create_results_store(tmp_path, race_setup)
+    rng = np.random.default_rng(0)
+    no_of_cars = len(race_setup['drivers'])
+    for no_of_races in [100, 1, 250]:
+        # Round the race times to get ties, and let some cars retire or never finish.
+        race_times = np.round(rng.normal(5400, 20, (no_of_races, no_of_cars)))
+        race_times[rng.random(race_times.shape) < 0.1] = np.inf
+        race_times[:, -1] = np.inf
+        positions = race_times.argsort(axis=1).argsort(axis=1) + 1
+        track_status = np.zeros((no_of_races, TRACK_PARAMETERS['no_of_laps']), dtype=np.int8)
+        append_races(tmp_path, positions, race_times, track_status)
+
+    quantiles = get_race_time_quantiles(tmp_path, QUANTILES, bins)
+
+    assert np.allclose(quantiles[QUANTILES].to_numpy(), get_race_time_quantiles_in_memory(tmp_path),
+                       rtol=0, atol=1e-9, equal_nan=True)
+    assert quantiles['FinishProbability'].iloc[-1] == 0
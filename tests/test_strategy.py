@@ -0,0 +1,78 @@
+"""
+Tests of strategy.py on synthetic drivers.
+"""
+from itertools import combinations, combinations_with_replacement
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from constants import *
+from fixtures import make_driver_tyre_data
+from strategy import get_optimal_strategies, get_optimal_strategies_for_races, \
+    get_stint_cost_table
+
+TRACK_PARAMETERS = {'in_lap': DEFAULT_IN_LAP, 'out_lap': DEFAULT_OUT_LAP,
+                    'start_time': DEFAULT_START_TIME}
+
+
+def get_stint_costs_brute_force(driver_tyre_data, no_of_laps: int, max_stops: int) -> dict:
+    """
+    Returns the stint costs of every strategy of each driver, found by enumerating all of them.
+
+    :return: a dict mapping each (driver, number of stops) to a sorted list of the stint costs.
+    """
+    costs = {}
+    for driver in driver_tyre_data.to_dict('records'):
+        tables = {compound: get_stint_cost_table(compound, driver[compound.title() + 'DegFactor'],
+                                                 no_of_laps) for compound in DRY_TYRES}
+        for no_of_stops in range(1, max_stops + 1):
+            driver_costs = costs.setdefault((driver['Driver'], no_of_stops), [])
+            for compounds in combinations_with_replacement(DRY_TYRES, no_of_stops + 1):
+                if len(set(compounds)) < MIN_DRY_COMPOUNDS:
+                    continue
+                for pit_laps in combinations(range(1, no_of_laps), no_of_stops):
+                    stint_lengths = np.diff((0,) + pit_laps + (no_of_laps,))
+                    # The same stints in another order are the same strategy.
+                    if any(compounds[i] == compounds[i + 1] and
+                           stint_lengths[i] < stint_lengths[i + 1]
+                           for i in range(no_of_stops)):
+                        continue
+                    driver_costs.append(sum(tables[compound][stint_length] for
+                                            compound, stint_length in zip(compounds,
+                                                                          stint_lengths)))
+            driver_costs.sort()
+
+    return costs
+
+
+@pytest.mark.parametrize('max_stops, top_k', [(1, 3), (2, 3), (3, 5)])
+def test_get_optimal_strategies_matches_brute_force(max_stops, top_k):
+    driver_tyre_data = make_driver_tyre_data().head(3)
+    no_of_laps = 16
+    strategies = get_optimal_strategies(driver_tyre_data, no_of_laps, max_stops=max_stops,
+                                        top_k=top_k, **TRACK_PARAMETERS)
+
+    # Each set of stints is only returned once.
+    assert not strategies[['Driver', 'Strategy']].duplicated().any()
+
+    expected = get_stint_costs_brute_force(driver_tyre_data, no_of_laps, max_stops)
+    long_run_estimates = driver_tyre_data.set_index('Driver')['LongRunEstimate']
+    for (driver, no_of_stops), group in strategies.groupby(['Driver', 'NoOfStops']):
+        race_base_time = long_run_estimates[driver] * no_of_laps + \
+            no_of_stops * (DEFAULT_IN_LAP + DEFAULT_OUT_LAP + 1) + DEFAULT_START_TIME
+        assert np.allclose(group['RaceTime'] - race_base_time,
+                           expected[(driver, no_of_stops)][:top_k])
+
+
+def test_get_optimal_strategies_for_races_matches_single_races():
+    driver_tyre_data = make_driver_tyre_data().head(5)
+    races = pd.DataFrame({'Track': ['Short', 'Long'], 'NoOfLaps': [44, 70],
+                          'InLap': DEFAULT_IN_LAP, 'OutLap': DEFAULT_OUT_LAP,
+                          'StartTime': DEFAULT_START_TIME})
+    strategies = get_optimal_strategies_for_races(driver_tyre_data, races)
+
+    for track, no_of_laps in zip(races['Track'], races['NoOfLaps']):
+        expected = get_optimal_strategies(driver_tyre_data, no_of_laps, **TRACK_PARAMETERS)
+        race_strategies = strategies.loc[strategies['Track'] == track].drop(columns='Track')
+        pd.testing.assert_frame_equal(race_strategies.reset_index(drop=True), expected)
@@ -0,0 +1,302 @@
+"""
+Contains helper functions for the track registry, which holds the parameters of each track used by
+the strategy predictions and the race simulations.
+
+The registry is a dict of numpy.arrays with one entry per track (struct of arrays):
+    'Track'                        the name of the event, e.g. 'Hungarian Grand Prix'
+    'NoOfLaps'                     int16, the number of laps of the race
+    'InLap', 'OutLap', 'StartTime' float32, the time lost (in seconds) on an in lap, an out lap and
+                                   at the race start
+    'PitLoss'                      float32, the time lost by a pit stop, InLap + OutLap + 1
+    'SafetyCarProbability', 'VirtualSafetyCarProbability'
+                                   float32, the probability of a neutralisation on each lap
+    'DryCompounds'                 bool of shape (tracks, len(DRY_TYRES)), the dry compounds
+                                   available in the race
+    'MinDryCompounds'              int8, the number of different dry compounds a driver must use
+It is stored in a single uncompressed .npz file (TRACK_REGISTRY_FILE), which loads instantly.
+"""
+import numpy as np
+
+from constants import *
+
+# The registry entries of each track, with the values used when a parameter is unknown
+TRACK_PARAMETER_DEFAULTS = {'NoOfLaps': None, 'InLap': DEFAULT_IN_LAP, 'OutLap': DEFAULT_OUT_LAP,
+                            'StartTime': DEFAULT_START_TIME,
+                            'SafetyCarProbability': SAFETY_CAR_PROBABILITY_PER_LAP,
+                            'VirtualSafetyCarProbability': VIRTUAL_SAFETY_CAR_PROBABILITY_PER_LAP,
+                            'DryCompounds': DRY_TYRES, 'MinDryCompounds': MIN_DRY_COMPOUNDS}
+
+
+def build_track_registry(parameters: dict) -> dict:
+    """
+    Builds a track registry from the parameters of each track.
+
+    :param parameters: a dict mapping the name of each track to a dict of its parameters (see
+    TRACK_PARAMETER_DEFAULTS), e.g. DEFAULT_TRACK_PARAMETERS. 'NoOfLaps' is required, the other
+    parameters are optional. Missing (or NaN) parameters take their defaults.
+
+    :return: a dict containing the registry, see the description of this module.
+    """
+    values = {}
+    for name, default in TRACK_PARAMETER_DEFAULTS.items():
+        values[name] = []
+        for track, track_parameters in parameters.items():
+            value = track_parameters.get(name)
+            if value is None or (np.isscalar(value) and np.isnan(value)):
+                if default is None:
+                    raise ValueError('The parameter {} of {} is missing'.format(name, track))
+                value = default
+            values[name].append(value)
+
+    registry = {
+        'Track': np.array(list(parameters), dtype=str),
+        'NoOfLaps': np.array(values['NoOfLaps'], dtype=np.int16),
+        'InLap': np.array(values['InLap'], dtype=np.float32),
+        'OutLap': np.array(values['OutLap'], dtype=np.float32),
+        'StartTime': np.array(values['StartTime'], dtype=np.float32),
+        'SafetyCarProbability': np.array(values['SafetyCarProbability'], dtype=np.float32),
+        'VirtualSafetyCarProbability': np.array(values['VirtualSafetyCarProbability'],
+                                                dtype=np.float32),
+        'DryCompounds': np.array([[compound in compounds for compound in DRY_TYRES]
+                                  for compounds in values['DryCompounds']],
+                                 dtype=bool).reshape(-1, len(DRY_TYRES)),
+        'MinDryCompounds': np.array(values['MinDryCompounds'], dtype=np.int8),
+    }
+
+    # Precompute the pit losses, as in the strategy predictions.
+    registry['PitLoss'] = registry['InLap'] + registry['OutLap'] + 1
+
+    return registry
+
+
+def save_track_registry(registry: dict, path: str = TRACK_REGISTRY_FILE) -> None:
+    """
+    Writes a track registry to a .npz file.
+
+    :param registry: a dict returned by build_track_registry.
+
+    :param path: a string representing the path of the file.
+    """
+    with open(path, 'wb') as file:
+        np.savez(file, **registry)
+
+
+def load_track_registry(path: str = TRACK_REGISTRY_FILE) -> dict:
+    """
+    Reads a track registry written by save_track_registry. If the file does not exist, the registry
+    of DEFAULT_TRACK_PARAMETERS is returned.
+
+    :param path: a string representing the path of the file.
+
+    :return: a dict containing the registry, see the description of this module.
+    """
+    import os
+
+    if not os.path.exists(path):
+        return build_track_registry(DEFAULT_TRACK_PARAMETERS)
+
+    with np.load(path, allow_pickle=False) as file:
+        return {name: file[name] for name in file.files}
+
+
+def get_track_index(registry: dict, track: str) -> int:
+    """
+    Returns the index of a track in a registry.
+
+    :param registry: a dict returned by build_track_registry or load_track_registry.
+
+    :param track: a string representing the name of the track, e.g. 'Hungarian Grand Prix'.
+
+    :return: an int, raises a KeyError if the track is not in the registry.
+    """
+    indices = np.flatnonzero(registry['Track'] == track)
+    if len(indices) == 0:
+        raise KeyError('{} is not in the track registry'.format(track))
+
+    return int(indices[0])
+
+
+def get_strategy_parameters(registry: dict, track: str) -> dict:
+    """
+    Returns the parameters of a track accepted by strategy.get_optimal_strategies, e.g.
+    get_optimal_strategies(driver_tyre_data, **get_strategy_parameters(registry, track)).
+
+    :param registry: a dict returned by build_track_registry or load_track_registry.
+
+    :param track: a string representing the name of the track.
+
+    :return: a dict with the keys 'no_of_laps', 'in_lap', 'out_lap', 'start_time',
+    'dry_compounds' (a tuple of the available dry compounds) and 'min_dry_compounds'.
+    """
+    i = get_track_index(registry, track)
+
+    return {'no_of_laps': int(registry['NoOfLaps'][i]), 'in_lap': float(registry['InLap'][i]),
+            'out_lap': float(registry['OutLap'][i]),
+            'start_time': float(registry['StartTime'][i]),
+            'dry_compounds': tuple(compound for compound, available in
+                                   zip(DRY_TYRES, registry['DryCompounds'][i]) if available),
+            'min_dry_compounds': int(registry['MinDryCompounds'][i])}
+
+
+def get_simulation_parameters(registry: dict, track: str) -> dict:
+    """
+    Returns the parameters of a track accepted by race_engine.get_race_setup, e.g.
+    get_race_setup(race_data, strategies, **get_simulation_parameters(registry, track)).
+
+    :param registry: a dict returned by build_track_registry or load_track_registry.
+
+    :param track: a string representing the name of the track.
+
+    :return: a dict with the keys 'no_of_laps', 'in_lap', 'out_lap', 'start_time',
+    'safety_car_probability' and 'virtual_safety_car_probability'.
+    """
+    i = get_track_index(registry, track)
+
+    return {'no_of_laps': int(registry['NoOfLaps'][i]), 'in_lap': float(registry['InLap'][i]),
+            'out_lap': float(registry['OutLap'][i]),
+            'start_time': float(registry['StartTime'][i]),
+            'safety_car_probability': float(registry['SafetyCarProbability'][i]),
+            'virtual_safety_car_probability': float(registry['VirtualSafetyCarProbability'][i])}
+
+
+def get_track_df(registry: dict, tracks: list = None) -> object:
+    """
+    Returns the parameters of the tracks as a DataFrame, e.g. for
+    strategy.get_optimal_strategies_for_races.
+
+    :param registry: a dict returned by build_track_registry or load_track_registry.
+
+    :param tracks: a list of strings representing the tracks, or None for all of them.
+
+    :return: a DataFrame with one row per track and a column per parameter. 'DryCompounds' contains
+    lists of the available dry compounds.
+    """
+    import pandas as pd
+
+    indices = np.arange(len(registry['Track'])) if tracks is None else \
+        [get_track_index(registry, track) for track in tracks]
+
+    columns = {name: registry[name][indices] for name in TRACK_PARAMETER_DEFAULTS
+               if name != 'DryCompounds'}
+    columns['DryCompounds'] = [[compound for compound, available in zip(DRY_TYRES, row)
+                                if available] for row in registry['DryCompounds'][indices]]
+    columns['PitLoss'] = registry['PitLoss'][indices]
+
+    return pd.DataFrame(dict(Track=registry['Track'][indices], **columns))
+
+
+def sweep_optimal_strategies(driver_tyre_data, registry: dict, tracks: list = None,
+                             max_stops: int = 2, top_k: int = 3) -> object:
+    """
+    Returns the fastest strategies of each driver at every track of the registry (a "what-if"
+    sweep across the calendar), in one batched call.
+
+    :param driver_tyre_data: a DataFrame containing the columns 'Driver', 'SoftDegFactor',
+    'MediumDegFactor', 'HardDegFactor' and 'LongRunEstimate', one row per driver.
+
+    :param registry: a dict returned by build_track_registry or load_track_registry.
+
+    :param tracks: a list of strings representing the tracks, or None for all of them.
+
+    :param max_stops: an int representing the largest number of pit stops considered.
+
+    :param top_k: an int representing the number of strategies returned for each driver, each
+    track and each number of pit stops.
+
+    :return: a DataFrame returned by strategy.get_optimal_strategies_for_races.
+    """
+    from strategy import get_optimal_strategies_for_races
+
+    return get_optimal_strategies_for_races(driver_tyre_data, get_track_df(registry, tracks),
+                                            max_stops, top_k)
+
+
+def derive_track_parameters(laps) -> dict:
+    """
+    Derives the parameters of each track from the laps of historic races.
+
+    The time lost on in laps, out laps and the first lap is the median difference between these
+    laps and the median green flag lap of the same driver in the same race, ignoring neutralised
+    laps. The probability of a (virtual) safety car is the number of deployments per lap, and the
+    available dry compounds are the ones used in the races. Parameters which cannot be derived
+    (e.g. the first lap has no lap time) are left out, so they take their defaults.
+
+    :param laps: a DataFrame containing the laps of races, e.g. returned by
+    session_store.load_laps(sessions=['R']), with the columns 'season', 'event', 'Driver',
+    'LapNumber', 'LapTime' (seconds), 'Compound', 'TrackStatus', 'PitIn' and 'PitOut'.
+
+    :return: a dict mapping the name of each event to a dict of its parameters, which can be
+    passed to build_track_registry.
+    """
+    from race import get_track_status_flags
+
+    flags = get_track_status_flags(laps)
+    neutralised = (flags & (SAFETY_CAR | VIRTUAL_SAFETY_CAR | VIRTUAL_SAFETY_CAR_ENDING |
+                            RED_FLAG)) != 0
+    laps = laps.assign(Neutralised=neutralised,
+                       SafetyCar=(flags & SAFETY_CAR) != 0,
+                       VirtualSafetyCar=(flags & VIRTUAL_SAFETY_CAR) != 0)
+    race_keys = ['season', 'event']
+
+    # The time lost on each lap compared to the median green flag lap of the driver.
+    green = (flags == 0) & ~laps['PitIn'] & ~laps['PitOut'] & (laps['LapNumber'] > 1)
+    reference = laps['LapTime'].where(green).groupby(
+        [laps[key] for key in race_keys + ['Driver']]).transform('median')
+    laps['TimeLost'] = laps['LapTime'] - reference
+
+    timed = laps[~laps['Neutralised']]
+    losses = {'InLap': timed[timed['PitIn']],
+              'OutLap': timed[timed['PitOut'] & (timed['LapNumber'] > 1)],
+              'StartTime': timed[timed['LapNumber'] == 1]}
+
+    # The neutralisations of each lap of each race, and the number of deployments.
+    race_laps = laps.groupby(race_keys + ['LapNumber'])[['SafetyCar', 'VirtualSafetyCar']].any()
+    previous = race_laps.groupby(level=race_keys).shift(1, fill_value=False)
+    deployments = (race_laps & ~previous).groupby(level='event').sum()
+    no_of_race_laps = race_laps.groupby(level='event').size()
+
+    parameters = {}
+    for event, event_laps in laps.groupby('event', sort=False):
+        track_parameters = {
+            'NoOfLaps': int(event_laps.groupby('season')['LapNumber'].max().median()),
+            'SafetyCarProbability': deployments.loc[event, 'SafetyCar'] /
+            no_of_race_laps.loc[event],
+            'VirtualSafetyCarProbability': deployments.loc[event, 'VirtualSafetyCar'] /
+            no_of_race_laps.loc[event],
+        }
+        for name, lost in losses.items():
+            track_lost = lost.loc[lost['event'] == event, 'TimeLost']
+            if track_lost.notnull().any():
+                track_parameters[name] = float(track_lost.median())
+
+        compounds = [compound for compound in DRY_TYRES
+                     if (event_laps['Compound'] == compound).any()]
+        if compounds:
+            track_parameters['DryCompounds'] = compounds
+
+        parameters[event] = track_parameters
+
+    return parameters
+
+
+def derive_track_registry(store_dir: str = SESSION_STORE_DIRECTORY, seasons: list = None) -> dict:
+    """
+    Derives a track registry from the races in the local session store (see session_store.py). The
+    tracks of DEFAULT_TRACK_PARAMETERS without races in the store are kept.
+
+    :param store_dir: a string representing the folder of the store.
+
+    :param seasons: a list of ints representing the seasons used, or None for all seasons.
+
+    :return: a dict containing the registry, see the description of this module.
+    """
+    from session_store import load_laps
+
+    laps = load_laps(store_dir, seasons=seasons, sessions=['R'],
+                     columns=['season', 'event', 'Driver', 'LapNumber', 'LapTime', 'Compound',
+                              'TrackStatus', 'PitIn', 'PitOut'])
+
+    parameters = dict(DEFAULT_TRACK_PARAMETERS)
+    parameters.update(derive_track_parameters(laps))
+
+    return build_track_registry(parameters)